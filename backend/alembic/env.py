@@ -7,10 +7,13 @@ import sys
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
+from app.config import settings
 from app.database import Base
-from app.models import User, Report
+from app.models import User, Report, ReportBatch, ReportSection, ContentBlob
 
 config = context.config
+# Migrate the database the app is configured for (ConfigParser needs % escaped)
+config.set_main_option("sqlalchemy.url", settings.DATABASE_URL.replace("%", "%%"))
 
 if config.config_file_name is not None:
     fileConfig(config.config_file_name)
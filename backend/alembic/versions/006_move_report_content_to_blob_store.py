@@ -0,0 +1,125 @@
+"""move_report_content_to_blob_store
+
+Revision ID: 006
+Revises: 005
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+import hashlib
+import json
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision = '006'
+down_revision = '005'
+branch_labels = None
+depends_on = None
+
+# (blob prefix, old inline column, is_json)
+BLOB_FIELDS = [
+    ('blueprint', 'blueprint', True),
+    ('prompt', 'prompt_used', False),
+    ('content', 'generated_content', False),
+]
+
+# Reports fetched per round trip while moving data
+BATCH_SIZE = 500
+
+
+def _encode(value, is_json):
+    if is_json:
+        return json.dumps(value, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    return value.encode('utf-8')
+
+
+def upgrade() -> None:
+    import zstandard
+
+    op.create_table(
+        'content_blobs',
+        sa.Column('hash', sa.String(length=64), nullable=False),
+        sa.Column('size', sa.Integer(), nullable=False),
+        sa.Column('codec', sa.String(length=16), nullable=False),
+        sa.Column('data', sa.LargeBinary(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.PrimaryKeyConstraint('hash')
+    )
+
+    for prefix, _, _ in BLOB_FIELDS:
+        op.add_column('reports', sa.Column(f'{prefix}_hash', sa.String(length=64), nullable=True))
+        op.add_column('reports', sa.Column(f'{prefix}_size', sa.Integer(), nullable=True))
+
+    # Move existing inline data into the blob table
+    conn = op.get_bind()
+    compressor = zstandard.ZstdCompressor(level=3)
+    # Streamed: the inline columns of every report never need to fit in memory at once
+    rows = conn.execution_options(yield_per=BATCH_SIZE).execute(
+        sa.text('SELECT id, blueprint, prompt_used, generated_content FROM reports')
+    ).mappings()
+    for row in rows:
+        updates = {}
+        for prefix, column, is_json in BLOB_FIELDS:
+            value = row[column]
+            if value is None:
+                continue
+            data = _encode(value, is_json)
+            digest = hashlib.sha256(data).hexdigest()
+            conn.execute(
+                sa.text(
+                    'INSERT INTO content_blobs (hash, size, codec, data) '
+                    'VALUES (:hash, :size, :codec, :data) ON CONFLICT (hash) DO NOTHING'
+                ),
+                {'hash': digest, 'size': len(data), 'codec': 'zstd', 'data': compressor.compress(data)}
+            )
+            updates[f'{prefix}_hash'] = digest
+            updates[f'{prefix}_size'] = len(data)
+        if updates:
+            assignments = ', '.join(f'{key} = :{key}' for key in updates)
+            conn.execute(sa.text(f'UPDATE reports SET {assignments} WHERE id = :id'), {**updates, 'id': row['id']})
+
+    op.drop_column('reports', 'blueprint')
+    op.drop_column('reports', 'prompt_used')
+    op.drop_column('reports', 'generated_content')
+
+
+def downgrade() -> None:
+    import zstandard
+
+    op.add_column('reports', sa.Column('blueprint', postgresql.JSON(astext_type=sa.Text()), nullable=True))
+    op.add_column('reports', sa.Column('prompt_used', sa.Text(), nullable=True))
+    op.add_column('reports', sa.Column('generated_content', sa.Text(), nullable=True))
+
+    conn = op.get_bind()
+    decompressor = zstandard.ZstdDecompressor()
+    rows = conn.execution_options(yield_per=BATCH_SIZE).execute(
+        sa.text('SELECT id, blueprint_hash, prompt_hash, content_hash FROM reports')
+    ).mappings()
+    for row in rows:
+        updates = {}
+        for prefix, column, is_json in BLOB_FIELDS:
+            digest = row[f'{prefix}_hash']
+            if digest is None:
+                continue
+            blob = conn.execute(
+                sa.text('SELECT codec, data FROM content_blobs WHERE hash = :hash'), {'hash': digest}
+            ).mappings().first()
+            if blob is None:
+                continue
+            data = decompressor.decompress(blob['data']) if blob['codec'] == 'zstd' else bytes(blob['data'])
+            text = data.decode('utf-8')
+            updates[column] = text
+        if updates:
+            assignments = ', '.join(
+                f'{key} = CAST(:{key} AS JSON)' if key == 'blueprint' else f'{key} = :{key}'
+                for key in updates
+            )
+            conn.execute(sa.text(f'UPDATE reports SET {assignments} WHERE id = :id'), {**updates, 'id': row['id']})
+
+    for prefix, _, _ in BLOB_FIELDS:
+        op.drop_column('reports', f'{prefix}_size')
+        op.drop_column('reports', f'{prefix}_hash')
+
+    op.drop_table('content_blobs')
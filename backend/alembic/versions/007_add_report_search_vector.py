@@ -0,0 +1,48 @@
+"""add_report_search_vector
+
+Revision ID: 007
+Revises: 006
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision = '007'
+down_revision = '006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    import zstandard
+
+    op.add_column('reports', sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True))
+    op.create_index('ix_reports_search_vector', 'reports', ['search_vector'], unique=False, postgresql_using='gin')
+
+    # Backfill completed reports; content lives compressed in content_blobs
+    conn = op.get_bind()
+    decompressor = zstandard.ZstdDecompressor()
+    rows = conn.execute(sa.text(
+        "SELECT r.id, r.title, b.codec, b.data FROM reports r "
+        "JOIN content_blobs b ON b.hash = r.content_hash "
+        "WHERE r.status = 'COMPLETED'"
+    )).mappings().all()
+    for row in rows:
+        data = decompressor.decompress(row['data']) if row['codec'] == 'zstd' else bytes(row['data'])
+        conn.execute(
+            sa.text(
+                "UPDATE reports SET search_vector = "
+                "setweight(to_tsvector('english', :title), 'A') || "
+                "setweight(to_tsvector('english', :content), 'B') "
+                "WHERE id = :id"
+            ),
+            {'title': row['title'], 'content': data.decode('utf-8'), 'id': row['id']}
+        )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_reports_search_vector', table_name='reports')
+    op.drop_column('reports', 'search_vector')
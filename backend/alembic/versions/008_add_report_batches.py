@@ -0,0 +1,48 @@
+"""add_report_batches
+
+Revision ID: 008
+Revises: 007
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision = '008'
+down_revision = '007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'report_batches',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('provider', sa.String(length=50), nullable=False),
+        sa.Column('provider_batch_id', sa.String(length=255), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('total', sa.Integer(), nullable=False),
+        sa.Column('provider_succeeded', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('provider_failed', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('rendered_sections', postgresql.JSON(astext_type=sa.Text()), nullable=True),
+        sa.Column('error_message', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.Column('completed_at', sa.DateTime(timezone=True), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_report_batches_id'), 'report_batches', ['id'], unique=False)
+
+    op.add_column('reports', sa.Column('batch_id', sa.Integer(), nullable=True))
+    op.create_foreign_key('reports_batch_id_fkey', 'reports', 'report_batches', ['batch_id'], ['id'])
+    op.create_index(op.f('ix_reports_batch_id'), 'reports', ['batch_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_reports_batch_id'), table_name='reports')
+    op.drop_constraint('reports_batch_id_fkey', 'reports', type_='foreignkey')
+    op.drop_column('reports', 'batch_id')
+    op.drop_index(op.f('ix_report_batches_id'), table_name='report_batches')
+    op.drop_table('report_batches')
@@ -0,0 +1,41 @@
+"""add_report_sections
+
+Revision ID: 009
+Revises: 008
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '009'
+down_revision = '008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'report_sections',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('report_id', sa.Integer(), nullable=False),
+        sa.Column('section_id', sa.String(length=255), nullable=False),
+        sa.Column('position', sa.Integer(), nullable=False),
+        sa.Column('unit_hash', sa.String(length=64), nullable=False),
+        sa.Column('content_hash', sa.String(length=64), nullable=True),
+        sa.Column('content_size', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.ForeignKeyConstraint(['report_id'], ['reports.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_report_sections_id'), 'report_sections', ['id'], unique=False)
+    op.create_index(op.f('ix_report_sections_report_id'), 'report_sections', ['report_id'], unique=False)
+    op.create_index(op.f('ix_report_sections_unit_hash'), 'report_sections', ['unit_hash'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_report_sections_unit_hash'), table_name='report_sections')
+    op.drop_index(op.f('ix_report_sections_report_id'), table_name='report_sections')
+    op.drop_index(op.f('ix_report_sections_id'), table_name='report_sections')
+    op.drop_table('report_sections')
@@ -0,0 +1,25 @@
+"""add_cancelled_report_status
+
+Revision ID: 010
+Revises: 009
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+
+
+revision = '010'
+down_revision = '009'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # ALTER TYPE ... ADD VALUE cannot run inside a transaction block before Postgres 12
+    with op.get_context().autocommit_block():
+        op.execute("ALTER TYPE reportstatus ADD VALUE IF NOT EXISTS 'CANCELLED'")
+
+
+def downgrade() -> None:
+    # Postgres cannot drop a value from an enum type: cancelled reports become failed ones
+    op.execute("UPDATE reports SET status = 'FAILED' WHERE status = 'CANCELLED'")
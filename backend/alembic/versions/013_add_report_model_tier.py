@@ -0,0 +1,23 @@
+"""add_report_model_tier
+
+Revision ID: 013
+Revises: 012
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '013'
+down_revision = '012'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('reports', sa.Column('model_tier', sa.String(length=20), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('reports', 'model_tier')
@@ -0,0 +1,32 @@
+"""index_blob_references
+
+Revision ID: 014
+Revises: 013
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+
+
+revision = '014'
+down_revision = '013'
+branch_labels = None
+depends_on = None
+
+# Columns referencing content_blobs, checked before a blob is deleted
+BLOB_REFERENCES = [
+    ('reports', 'blueprint_hash'),
+    ('reports', 'prompt_hash'),
+    ('reports', 'content_hash'),
+    ('report_sections', 'content_hash'),
+]
+
+
+def upgrade() -> None:
+    for table, column in BLOB_REFERENCES:
+        op.create_index(op.f(f'ix_{table}_{column}'), table, [column], unique=False)
+
+
+def downgrade() -> None:
+    for table, column in BLOB_REFERENCES:
+        op.drop_index(op.f(f'ix_{table}_{column}'), table_name=table)
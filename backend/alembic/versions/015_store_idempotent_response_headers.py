@@ -0,0 +1,38 @@
+"""store_idempotent_response_headers
+
+Revision ID: 015
+Revises: 014
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision = '015'
+down_revision = '014'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('idempotency_keys', sa.Column('response_headers', postgresql.JSON(astext_type=sa.Text()), nullable=True))
+    # Responses stored before the upgrade keep their content type
+    op.execute(
+        "UPDATE idempotency_keys "
+        "SET response_headers = json_build_array(json_build_array('content-type', response_content_type)) "
+        "WHERE response_content_type IS NOT NULL"
+    )
+    op.drop_column('idempotency_keys', 'response_content_type')
+
+
+def downgrade() -> None:
+    op.add_column('idempotency_keys', sa.Column('response_content_type', sa.String(length=255), nullable=True))
+    op.execute(
+        "UPDATE idempotency_keys SET response_content_type = ("
+        "SELECT header->>1 FROM json_array_elements(response_headers) AS header "
+        "WHERE lower(header->>0) = 'content-type' LIMIT 1"
+        ") WHERE response_headers IS NOT NULL"
+    )
+    op.drop_column('idempotency_keys', 'response_headers')
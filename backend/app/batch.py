@@ -0,0 +1,497 @@
+"""
+Batch report generation through the provider message-batch APIs.
+
+A batch submits many report prompts in one provider call (Anthropic Message
+Batches or the OpenAI Batch API, both billed at batch pricing) and a single
+background poller per batch checks on it with exponential backoff. When the
+provider reports the batch ended, results are streamed back and fanned out
+into the individual Report rows. A local mock backend stands in for the
+providers in tests and development.
+
+With several workers, every worker rescans for unfinished batches but a
+poller only runs while it holds the batch's lease in shared state, so each
+batch is polled by exactly one worker and is taken over by another if its
+worker dies.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import time
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from app.config import settings
+from app.database import SessionLocal
+from app.llm import LLMAPIError
+from app.shared_state import get_shared_state, worker_id
+
+logger = logging.getLogger(__name__)
+
+BATCH_STATUS_SUBMITTED = "submitted"
+BATCH_STATUS_IN_PROGRESS = "in_progress"
+BATCH_STATUS_ENDED = "ended"
+BATCH_STATUS_FAILED = "failed"
+
+POLLER_LEASE_PREFIX = "batch-poller:"
+
+# Background pollers by batch id, so each batch is polled once per process
+_pollers: Dict[int, "asyncio.Task[None]"] = {}
+_supervisor: Optional["asyncio.Task[None]"] = None
+
+@dataclass
+class BatchItem:
+    custom_id: str
+    prompt: str
+    system_prompt: str
+    max_tokens: int
+    temperature: float = 0.7
+    # None: the backend's default model
+    model: Optional[str] = None
+
+@dataclass
+class BatchPollResult:
+    ended: bool
+    succeeded: int = 0
+    failed: int = 0
+    processing: int = 0
+    failure_reason: Optional[str] = None
+
+@dataclass
+class BatchItemResult:
+    custom_id: str
+    content: Optional[str] = None
+    model: Optional[str] = None
+    input_tokens: int = 0
+    output_tokens: int = 0
+    error: Optional[str] = None
+
+def report_custom_id(report_id: int) -> str:
+    return f"report-{report_id}"
+
+def report_id_from_custom_id(custom_id: str) -> Optional[int]:
+    prefix, _, value = custom_id.partition("-")
+    return int(value) if prefix == "report" and value.isdigit() else None
+
+class BatchBackend(ABC):
+    """Provider batch API adapter."""
+
+    provider = ""
+
+    @abstractmethod
+    async def submit(self, items: List[BatchItem]) -> str:
+        """Submit the items as one provider batch; returns the provider's batch id."""
+
+    @abstractmethod
+    async def poll(self, batch_id: str) -> BatchPollResult:
+        """Current progress of a provider batch."""
+
+    @abstractmethod
+    def results(self, batch_id: str) -> AsyncIterator[BatchItemResult]:
+        """Results of an ended provider batch, one per item."""
+
+class AnthropicBatchBackend(BatchBackend):
+    provider = "anthropic"
+    model = "claude-3-5-sonnet-20241022"
+
+    def _client(self):
+        from anthropic import AsyncAnthropic
+
+        if not settings.ANTHROPIC_API_KEY:
+            raise LLMAPIError("ANTHROPIC_API_KEY not configured")
+        return AsyncAnthropic(api_key=settings.ANTHROPIC_API_KEY, base_url=settings.ANTHROPIC_BASE_URL)
+
+    async def submit(self, items: List[BatchItem]) -> str:
+        requests = [
+            {
+                "custom_id": item.custom_id,
+                "params": {
+                    "model": item.model or self.model,
+                    "max_tokens": item.max_tokens,
+                    "temperature": item.temperature,
+                    "system": item.system_prompt,
+                    "messages": [{"role": "user", "content": item.prompt}],
+                },
+            }
+            for item in items
+        ]
+        batch = await self._client().beta.messages.batches.create(requests=requests)
+        return batch.id
+
+    async def poll(self, batch_id: str) -> BatchPollResult:
+        batch = await self._client().beta.messages.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        return BatchPollResult(
+            ended=batch.processing_status == "ended",
+            succeeded=counts.succeeded,
+            failed=counts.errored + counts.canceled + counts.expired,
+            processing=counts.processing
+        )
+
+    async def results(self, batch_id: str) -> AsyncIterator[BatchItemResult]:
+        decoder = await self._client().beta.messages.batches.results(batch_id)
+        async for entry in decoder:
+            if entry.result.type == "succeeded":
+                message = entry.result.message
+                yield BatchItemResult(
+                    custom_id=entry.custom_id,
+                    content=message.content[0].text if message.content else "",
+                    model=message.model,
+                    input_tokens=message.usage.input_tokens,
+                    output_tokens=message.usage.output_tokens
+                )
+            else:
+                error = getattr(entry.result, "error", None)
+                yield BatchItemResult(custom_id=entry.custom_id, error=f"{entry.result.type}: {error}")
+
+class OpenAIBatchBackend(BatchBackend):
+    provider = "openai"
+    model = "gpt-4o-mini"
+
+    def _client(self):
+        from openai import AsyncOpenAI
+
+        if not settings.OPENAI_API_KEY:
+            raise LLMAPIError("OPENAI_API_KEY not configured")
+        return AsyncOpenAI(api_key=settings.OPENAI_API_KEY, base_url=settings.OPENAI_BASE_URL)
+
+    async def submit(self, items: List[BatchItem]) -> str:
+        lines = [
+            json.dumps({
+                "custom_id": item.custom_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": item.model or self.model,
+                    "max_tokens": item.max_tokens,
+                    "temperature": item.temperature,
+                    "messages": [
+                        {"role": "system", "content": item.system_prompt},
+                        {"role": "user", "content": item.prompt},
+                    ],
+                },
+            })
+            for item in items
+        ]
+        client = self._client()
+        input_file = await client.files.create(
+            file=("batch.jsonl", "\n".join(lines).encode("utf-8")),
+            purpose="batch"
+        )
+        batch = await client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        return batch.id
+
+    async def poll(self, batch_id: str) -> BatchPollResult:
+        batch = await self._client().batches.retrieve(batch_id)
+        counts = batch.request_counts
+        ended = batch.status in ("completed", "failed", "expired", "cancelled")
+        return BatchPollResult(
+            ended=ended,
+            succeeded=counts.completed if counts else 0,
+            failed=counts.failed if counts else 0,
+            processing=(counts.total - counts.completed - counts.failed) if counts else 0,
+            failure_reason=batch.status if batch.status in ("failed", "expired", "cancelled") else None
+        )
+
+    async def results(self, batch_id: str) -> AsyncIterator[BatchItemResult]:
+        client = self._client()
+        batch = await client.batches.retrieve(batch_id)
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            content = await client.files.content(file_id)
+            for line in content.text.splitlines():
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                response = entry.get("response") or {}
+                body = response.get("body") or {}
+                if entry.get("error") or response.get("status_code") != 200:
+                    yield BatchItemResult(
+                        custom_id=entry["custom_id"],
+                        error=str(entry.get("error") or body.get("error") or response.get("status_code"))
+                    )
+                    continue
+                usage = body.get("usage") or {}
+                yield BatchItemResult(
+                    custom_id=entry["custom_id"],
+                    content=body["choices"][0]["message"].get("content") or "",
+                    model=body.get("model"),
+                    input_tokens=usage.get("prompt_tokens", 0),
+                    output_tokens=usage.get("completion_tokens", 0)
+                )
+
+@dataclass
+class _MockBatch:
+    items: List[BatchItem]
+    submitted_at: float = field(default_factory=time.monotonic)
+
+class MockBatchBackend(BatchBackend):
+    """In-process stand-in that completes every batch after LLM_BATCH_MOCK_LATENCY seconds."""
+
+    provider = "mock"
+    model = "mock-batch"
+
+    def __init__(self):
+        self._batches: Dict[str, _MockBatch] = {}
+
+    async def submit(self, items: List[BatchItem]) -> str:
+        batch_id = f"mockbatch_{uuid.uuid4().hex[:16]}"
+        self._batches[batch_id] = _MockBatch(items=list(items))
+        return batch_id
+
+    def _ended(self, batch: _MockBatch) -> bool:
+        return time.monotonic() - batch.submitted_at >= settings.LLM_BATCH_MOCK_LATENCY
+
+    async def poll(self, batch_id: str) -> BatchPollResult:
+        batch = self._batches.get(batch_id)
+        if batch is None:
+            return BatchPollResult(ended=True, failure_reason="unknown batch")
+        ended = self._ended(batch)
+        return BatchPollResult(
+            ended=ended,
+            succeeded=len(batch.items) if ended else 0,
+            processing=0 if ended else len(batch.items)
+        )
+
+    async def results(self, batch_id: str) -> AsyncIterator[BatchItemResult]:
+        batch = self._batches.pop(batch_id, None)
+        for item in batch.items if batch else []:
+            digest = hashlib.sha256(item.prompt.encode("utf-8")).hexdigest()[:12]
+            content = f"# Mock Report\n\nDeterministic batch output for prompt {digest}.\n"
+            yield BatchItemResult(
+                custom_id=item.custom_id,
+                content=content,
+                model=self.model,
+                input_tokens=len(item.prompt) // 4,
+                output_tokens=len(content) // 4
+            )
+
+_mock_backend = MockBatchBackend()
+
+def get_batch_backend(provider: Optional[str] = None) -> BatchBackend:
+    """Return the backend for a provider (defaults to the configured one)."""
+    if settings.LLM_BATCH_BACKEND == "mock" or provider == "mock":
+        return _mock_backend
+    provider = provider or settings.LLM_PROVIDER
+    if provider == "anthropic":
+        return AnthropicBatchBackend()
+    if provider == "openai":
+        return OpenAIBatchBackend()
+    raise ValueError(f"Unsupported LLM provider: {provider}")
+
+async def _apply_results(batch_id: int, backend: BatchBackend, provider_batch_id: str) -> None:
+    """Fan provider results out into the batch's Report rows."""
+    from app.models import Report, ReportBatch
+    from app.report_service import complete_report, fail_report
+
+    db = SessionLocal()
+    try:
+        batch = db.query(ReportBatch).filter(ReportBatch.id == batch_id).first()
+        reports = {r.id: r for r in db.query(Report).filter(Report.batch_id == batch_id).all()}
+        rendered_by_report = batch.rendered_sections or {}
+        submitted_at = batch.created_at if batch.created_at.tzinfo else batch.created_at.replace(tzinfo=timezone.utc)
+        elapsed = (datetime.now(timezone.utc) - submitted_at).total_seconds()
+        seen = set()
+        pending = 0
+
+        async for item in backend.results(provider_batch_id):
+            report_id = report_id_from_custom_id(item.custom_id)
+            report = reports.get(report_id)
+            if report is None or report.status != "processing":
+                continue
+            seen.add(report_id)
+
+            if item.error:
+                fail_report(db, report, f"Batch item failed: {item.error}")
+            else:
+                result = {
+                    "content": item.content,
+                    "provider": backend.provider,
+                    "model": item.model,
+                    "tokens_used": item.input_tokens + item.output_tokens,
+                }
+                rendered = _rendered_from_json(rendered_by_report.get(str(report_id)))
+                complete_report(db, report, result, rendered, elapsed)
+
+            pending += 1
+            if pending >= 50:
+                db.commit()
+                pending = 0
+
+        for report_id, report in reports.items():
+            if report_id not in seen and report.status == "processing":
+                fail_report(db, report, "Missing from batch results")
+
+        batch.status = BATCH_STATUS_ENDED
+        batch.completed_at = datetime.now(timezone.utc)
+        db.commit()
+        logger.info(f"Batch {batch_id} results applied to {len(seen)} of {len(reports)} reports")
+    finally:
+        db.close()
+
+def _rendered_from_json(data: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    from app.rendering import RenderedSection
+
+    return {section_id: RenderedSection(**value) for section_id, value in (data or {}).items()}
+
+async def poll_batch(batch_id: int) -> None:
+    """
+    Poll one batch until it ends, then apply its results.
+
+    The interval starts at BATCH_POLL_MIN_INTERVAL and doubles while nothing
+    changes, up to BATCH_POLL_MAX_INTERVAL, so long-running batches cost only
+    a handful of provider calls per hour.
+    """
+    from app.models import ReportBatch
+
+    db = SessionLocal()
+    try:
+        batch = db.query(ReportBatch).filter(ReportBatch.id == batch_id).first()
+        if batch is None or batch.status in (BATCH_STATUS_ENDED, BATCH_STATUS_FAILED):
+            return
+        provider, provider_batch_id = batch.provider, batch.provider_batch_id
+    finally:
+        db.close()
+
+    backend = get_batch_backend(provider)
+    interval = settings.BATCH_POLL_MIN_INTERVAL
+    last_progress = None
+    state = get_shared_state()
+    lease_key = f"{POLLER_LEASE_PREFIX}{batch_id}"
+    owner = worker_id()
+    # Outlives the longest sleep between renewals
+    lease_ttl = settings.BATCH_POLL_MAX_INTERVAL * 2
+
+    try:
+        while True:
+            if not state.acquire_lease(lease_key, owner, lease_ttl):
+                logger.debug(f"Batch {batch_id} is polled by another worker")
+                return
+
+            try:
+                result = await backend.poll(provider_batch_id)
+            except Exception as e:
+                logger.warning(f"Polling batch {batch_id} failed: {str(e)}")
+                result = None
+
+            if result is not None:
+                progress = (result.succeeded, result.failed, result.processing)
+                if progress != last_progress:
+                    _record_progress(batch_id, result)
+                    last_progress = progress
+                    interval = settings.BATCH_POLL_MIN_INTERVAL
+
+                if result.ended:
+                    if result.failure_reason and not result.succeeded:
+                        _fail_batch(batch_id, f"Batch {result.failure_reason}")
+                    else:
+                        await _apply_results(batch_id, backend, provider_batch_id)
+                    return
+
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, settings.BATCH_POLL_MAX_INTERVAL)
+    except asyncio.CancelledError:
+        logger.info(f"Poller for batch {batch_id} cancelled")
+        raise
+    except Exception as e:
+        logger.error(f"Batch {batch_id} poller failed: {str(e)}")
+    finally:
+        _pollers.pop(batch_id, None)
+        try:
+            state.release_lease(lease_key, owner)
+        except Exception as e:
+            logger.warning(f"Could not release lease for batch {batch_id}: {str(e)}")
+
+def _record_progress(batch_id: int, result: BatchPollResult) -> None:
+    from app.models import ReportBatch
+
+    db = SessionLocal()
+    try:
+        batch = db.query(ReportBatch).filter(ReportBatch.id == batch_id).first()
+        if batch is not None:
+            batch.status = BATCH_STATUS_IN_PROGRESS
+            batch.provider_succeeded = result.succeeded
+            batch.provider_failed = result.failed
+            db.commit()
+    finally:
+        db.close()
+
+def _fail_batch(batch_id: int, error: str) -> None:
+    from app.models import Report, ReportBatch
+    from app.report_service import fail_report
+
+    db = SessionLocal()
+    try:
+        batch = db.query(ReportBatch).filter(ReportBatch.id == batch_id).first()
+        for report in db.query(Report).filter(Report.batch_id == batch_id, Report.status == "processing").all():
+            fail_report(db, report, error)
+        if batch is not None:
+            batch.status = BATCH_STATUS_FAILED
+            batch.error_message = error
+            batch.completed_at = datetime.now(timezone.utc)
+        db.commit()
+        logger.error(f"Batch {batch_id} failed: {error}")
+    finally:
+        db.close()
+
+def start_poller(batch_id: int) -> None:
+    """Start the background poller for a batch unless one is already running."""
+    if batch_id in _pollers:
+        return
+    _pollers[batch_id] = asyncio.get_running_loop().create_task(poll_batch(batch_id))
+
+def resume_pollers() -> None:
+    """Start pollers for unfinished batches that have none in this process."""
+    from app.models import ReportBatch
+
+    db = SessionLocal()
+    try:
+        unfinished = db.query(ReportBatch.id).filter(
+            ReportBatch.status.in_([BATCH_STATUS_SUBMITTED, BATCH_STATUS_IN_PROGRESS])
+        ).all()
+    except Exception as e:
+        logger.warning(f"Could not resume batch pollers: {str(e)}")
+        return
+    finally:
+        db.close()
+
+    started = [batch_id for (batch_id,) in unfinished if batch_id not in _pollers]
+    for batch_id in started:
+        start_poller(batch_id)
+    if started:
+        logger.debug(f"Checked {len(started)} unfinished batches for pollers")
+
+async def _supervise_pollers() -> None:
+    while True:
+        resume_pollers()
+        await asyncio.sleep(settings.BATCH_RESCAN_INTERVAL)
+
+def start_poller_supervisor() -> None:
+    """
+    Resume pollers now and rescan periodically.
+
+    The rescan picks up batches whose worker stopped or died, once their
+    lease has expired.
+    """
+    global _supervisor
+    if _supervisor is None or _supervisor.done():
+        _supervisor = asyncio.get_running_loop().create_task(_supervise_pollers())
+
+async def stop_pollers() -> None:
+    """Cancel all pollers (on shutdown) and release their leases."""
+    global _supervisor
+    if _supervisor is not None:
+        _supervisor.cancel()
+        _supervisor = None
+    tasks = list(_pollers.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,122 @@
+"""
+Cancellation of in-flight LLM work.
+
+A generation's LLM call runs in its own task while the route watches for a
+reason to stop it: the client disconnecting, or a POST
+/api/reports/{id}/cancel (a flag in shared state, so the request may land on
+any worker). Stopping cancels the task, which closes the connection to the
+provider; the provider stops generating, and billing, output tokens. The route
+then keeps what was generated so far (see llm.PartialOutput).
+
+Deadlines are enforced by the LLM layer itself (llm.llm_deadline).
+"""
+import asyncio
+import logging
+from typing import Awaitable, Optional, TypeVar
+
+from starlette.requests import Request
+
+from app.config import settings
+from app.metrics import llm_cancellations_total, llm_cancelled_output_tokens_total, llm_cancelled_tokens_saved_total
+from app.shared_state import get_shared_state
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+REASON_CLIENT_DISCONNECTED = "client_disconnected"
+REASON_CANCEL_REQUESTED = "cancel_requested"
+REASON_DEADLINE = "deadline"
+
+class GenerationCancelledError(Exception):
+    """Raised when in-flight LLM work is stopped by the client or a cancel request"""
+
+    def __init__(self, reason: str):
+        super().__init__(f"Generation cancelled ({reason})")
+        self.reason = reason
+
+def _cancel_key(report_id: int) -> str:
+    return f"report_cancel:{report_id}"
+
+def request_cancel(report_id: int) -> None:
+    """Ask the worker generating a report to stop; the flag expires with the report deadline."""
+    ttl = int(settings.REPORT_DEADLINE_SECONDS or 3600) + 60
+    get_shared_state().set(_cancel_key(report_id), "1", ttl)
+
+def _take_cancel_request(report_id: int) -> bool:
+    state = get_shared_state()
+    if state.get(_cancel_key(report_id)) is None:
+        return False
+    state.delete(_cancel_key(report_id))
+    return True
+
+async def wait_for_disconnect(request: Request) -> None:
+    """
+    Return once the client of a request has gone away.
+
+    Once the body has been read the next message is the disconnect.
+    Request.is_disconnected cannot be used, it never sees the message
+    through BaseHTTPMiddleware (main.log_requests).
+    """
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+async def run_cancellable(work: Awaitable[T], request: Optional[Request], report_id: Optional[int] = None) -> T:
+    """
+    Await LLM work, stopping it if the client goes away or the report's generation is cancelled.
+
+    Args:
+        work: The LLM call (coroutine); it runs as a task in the current context
+        request: Request whose client disconnecting stops the work
+        report_id: Report whose cancel requests stop the work
+
+    Returns:
+        The result of the work
+
+    Raises:
+        GenerationCancelledError: If the work was stopped
+    """
+    task = asyncio.ensure_future(work)
+    watchers = set()
+    if request is not None:
+        watchers.add(asyncio.ensure_future(wait_for_disconnect(request)))
+    try:
+        while True:
+            done, _ = await asyncio.wait({task, *watchers}, timeout=settings.CANCEL_POLL_INTERVAL,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if task in done:
+                return task.result()
+            if done:
+                reason = REASON_CLIENT_DISCONNECTED
+                break
+            if report_id is not None and await asyncio.to_thread(_take_cancel_request, report_id):
+                reason = REASON_CANCEL_REQUESTED
+                break
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        else:
+            logger.info("LLM work finished as it was cancelled")
+        raise GenerationCancelledError(reason)
+    finally:
+        # Also reached when the route itself is cancelled (e.g. worker shutdown)
+        for pending in (task, *watchers):
+            if not pending.done():
+                pending.cancel()
+
+def meter_cancellation(route: str, reason: str, generated_tokens: int, max_tokens: int) -> None:
+    """
+    Count stopped LLM work and the output tokens it did and did not generate.
+
+    Args:
+        route: "blueprint" or "report"
+        reason: Why the work was stopped
+        generated_tokens: Output tokens generated (and billed) before stopping
+        max_tokens: Output budget of the call; what was left of it is counted as saved
+    """
+    llm_cancellations_total.inc(route=route, reason=reason)
+    llm_cancelled_output_tokens_total.inc(generated_tokens, route=route)
+    llm_cancelled_tokens_saved_total.inc(max(max_tokens - generated_tokens, 0), route=route)
+    logger.info(f"Cancelled {route} generation ({reason}) after ~{generated_tokens} output tokens")
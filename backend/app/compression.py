@@ -0,0 +1,127 @@
+"""
+Response compression for large text bodies (report markdown, listings).
+
+Negotiates brotli (when the brotli package is installed) or gzip from
+Accept-Encoding and compresses complete, non-streamed responses of textual
+media types above COMPRESSION_MIN_SIZE. Streamed responses (SSE, file
+downloads, byte ranges) pass through untouched: compressing them would
+buffer events and break Content-Range offsets. Starlette's GZipMiddleware is
+not used for that reason.
+"""
+import gzip
+import logging
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.config import settings
+from app.metrics import http_response_body_bytes_total, http_response_uncompressed_bytes_total
+
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = {
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+}
+
+def _is_compressible(headers: Headers) -> bool:
+    media_type = headers.get("content-type", "").split(";")[0].strip().lower()
+    if media_type == "text/event-stream":
+        return False
+    return media_type.startswith("text/") or media_type in COMPRESSIBLE_TYPES
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Pick "br", "gzip" or None from an Accept-Encoding header."""
+    accepted = {}
+    for item in accept_encoding.lower().split(","):
+        token, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if token:
+            accepted[token] = quality
+
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", accepted.get("*", 0)) > 0:
+        return "gzip"
+    return None
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=settings.COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=settings.COMPRESSION_GZIP_LEVEL)
+
+class CompressionMiddleware:
+    """ASGI middleware compressing complete textual responses."""
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message: Optional[Message] = None
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                # Hold the headers until the first body chunk shows whether this is streamed
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or start_message is None:
+                await send(message)
+                return
+
+            start, start_message = start_message, None
+            headers = MutableHeaders(scope=start)
+            body = message.get("body", b"")
+            eligible = (
+                _is_compressible(headers)
+                and "content-encoding" not in headers
+                and "content-range" not in headers
+                and start["status"] not in (204, 206, 304)
+            )
+            if eligible:
+                headers.add_vary_header("Accept-Encoding")
+            if not eligible or message.get("more_body", False) or len(body) < self.minimum_size:
+                if eligible and not message.get("more_body", False):
+                    http_response_uncompressed_bytes_total.inc(len(body), encoding="identity")
+                    http_response_body_bytes_total.inc(len(body), encoding="identity")
+                await send(start)
+                await send(message)
+                return
+
+            compressed = compress(body, encoding)
+            http_response_uncompressed_bytes_total.inc(len(body), encoding=encoding)
+            http_response_body_bytes_total.inc(len(compressed), encoding=encoding)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(compressed))
+            # The compressed bytes are a different representation, so the tag is weakened
+            etag = headers.get("etag")
+            if etag and not etag.startswith("W/"):
+                headers["ETag"] = f"W/{etag}"
+            await send(start)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,267 @@
+"""
+Compressed, content-addressed storage for large report fields.
+
+Prompts, generated markdown and blueprint JSON live in the content_blobs
+table, zstd-compressed and keyed by the sha256 of their raw bytes. Report rows
+only carry the hash and size, so polling, listing and stats never read them.
+BlobField exposes a stored blob as a normal attribute that is loaded on first
+access and written alongside the owning row on flush.
+
+Blobs are shared between rows, so they are deleted by reference check:
+collect_blobs removes the blobs of a deleted report that nothing references
+any more, and a periodic sweep catches the rest. created_at is refreshed
+whenever a blob is written again, and blobs written within
+CONTENT_STORE_GC_GRACE_SECONDS are never collected, so a row being written
+in a concurrent transaction cannot lose its blob.
+"""
+import hashlib
+import json
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event, exists, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Mapper, Session, object_session
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+CODEC_ZSTD = "zstd"
+CODEC_RAW = "raw"
+
+_last_sweep = 0.0
+
+class ContentStoreError(Exception):
+    """Raised when a referenced blob is missing or cannot be decoded"""
+    pass
+
+def hash_bytes(data: bytes) -> str:
+    """Content address of a blob."""
+    return hashlib.sha256(data).hexdigest()
+
+def compress(data: bytes) -> bytes:
+    import zstandard
+
+    return zstandard.ZstdCompressor(level=settings.CONTENT_STORE_ZSTD_LEVEL).compress(data)
+
+def decompress(codec: str, data: bytes) -> bytes:
+    if codec == CODEC_RAW:
+        return data
+    if codec == CODEC_ZSTD:
+        import zstandard
+
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ContentStoreError(f"Unknown blob codec: {codec}")
+
+def store_blob(session: Session, data: bytes) -> Tuple[str, int]:
+    """
+    Write a blob unless an identical one is already stored.
+
+    Args:
+        session: Database session (the insert joins its transaction)
+        data: Raw blob bytes
+
+    Returns:
+        Tuple of (hash, uncompressed size)
+    """
+    from app.models import ContentBlob
+
+    digest = hash_bytes(data)
+    values = {
+        "hash": digest,
+        "size": len(data),
+        "codec": CODEC_ZSTD,
+        "data": compress(data),
+    }
+
+    # An existing blob is only touched: the newer created_at keeps it from collect_blobs
+    dialect = session.get_bind().dialect.name
+    if dialect == "postgresql":
+        stmt = pg_insert(ContentBlob).values(**values).on_conflict_do_update(
+            index_elements=["hash"], set_={"created_at": func.now()}
+        )
+    elif dialect == "sqlite":
+        stmt = sqlite_insert(ContentBlob).values(**values).on_conflict_do_update(
+            index_elements=["hash"], set_={"created_at": func.now()}
+        )
+    else:
+        with session.no_autoflush:
+            blob = session.get(ContentBlob, digest)
+            if blob is None:
+                session.add(ContentBlob(**values))
+            else:
+                blob.created_at = func.now()
+        return digest, len(data)
+
+    session.execute(stmt)
+    return digest, len(data)
+
+def load_blob(session: Session, digest: str) -> bytes:
+    """
+    Read and decompress a blob.
+
+    Raises:
+        ContentStoreError: If no blob with this hash exists
+    """
+    from app.models import ContentBlob
+
+    row = session.query(ContentBlob.codec, ContentBlob.data).filter(ContentBlob.hash == digest).first()
+    if row is None:
+        raise ContentStoreError(f"Blob {digest} not found")
+    return decompress(row.codec, row.data)
+
+def load_blobs(session: Session, digests: Iterable[str]) -> Dict[str, bytes]:
+    """
+    Read and decompress several blobs in one query.
+
+    Returns:
+        Raw bytes keyed by hash (missing hashes are left out)
+    """
+    from app.models import ContentBlob
+
+    digests = list(set(digests))
+    if not digests:
+        return {}
+
+    rows = session.query(ContentBlob.hash, ContentBlob.codec, ContentBlob.data).filter(
+        ContentBlob.hash.in_(digests)
+    ).all()
+    return {row.hash: decompress(row.codec, row.data) for row in rows}
+
+def _referenced(blob_hash: Any) -> List[Any]:
+    """Conditions that a blob hash is referenced by a report or a report section."""
+    from app.models import Report, ReportSection
+
+    return [
+        exists().where(column == blob_hash)
+        for column in (Report.blueprint_hash, Report.prompt_hash, Report.content_hash, ReportSection.content_hash)
+    ]
+
+def _unreferenced_query(session: Session) -> Any:
+    from app.models import ContentBlob
+
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=settings.CONTENT_STORE_GC_GRACE_SECONDS)
+    return session.query(ContentBlob).filter(
+        ContentBlob.created_at < cutoff,
+        *[~condition for condition in _referenced(ContentBlob.hash)]
+    )
+
+def collect_blobs(session: Session, digests: Iterable[Optional[str]]) -> int:
+    """
+    Delete the given blobs if no report or section references them any more.
+
+    Run it after the rows that referenced them were deleted and committed.
+    Every CONTENT_STORE_GC_INTERVAL it also sweeps the whole table, for blobs
+    left behind by replaced sections or written within the grace period.
+
+    Args:
+        session: Database session (committed here)
+        digests: Hashes the deleted rows referenced (None entries are ignored)
+
+    Returns:
+        Number of blobs deleted
+    """
+    from app.models import ContentBlob
+
+    global _last_sweep
+    digests = {digest for digest in digests if digest}
+    deleted = 0
+    if digests:
+        deleted = _unreferenced_query(session).filter(ContentBlob.hash.in_(digests)).delete(
+            synchronize_session=False
+        )
+    if time.monotonic() - _last_sweep >= settings.CONTENT_STORE_GC_INTERVAL:
+        _last_sweep = time.monotonic()
+        swept = _unreferenced_query(session).delete(synchronize_session=False)
+        if swept:
+            logger.info(f"Swept {swept} unreferenced content blobs")
+        deleted += swept
+    session.commit()
+    return deleted
+
+def _encode(value: Any, kind: str) -> bytes:
+    if kind == "json":
+        return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return value.encode("utf-8")
+
+def _decode(data: bytes, kind: str) -> Any:
+    if kind == "json":
+        return json.loads(data)
+    return data.decode("utf-8")
+
+class BlobField:
+    """
+    Model attribute backed by the content store.
+
+    The owning model needs `<prefix>_hash` and `<prefix>_size` columns. Values
+    are loaded lazily on first access and cached on the instance together with
+    the hash they were loaded for, so a value is reloaded once the hash column
+    changes (a rollback or refresh brings back another one); assigned values
+    are queued and stored when the session flushes.
+    """
+
+    def __init__(self, prefix: str, kind: str = "text"):
+        self.prefix = prefix
+        self.kind = kind
+        self.name = prefix
+
+    def __set_name__(self, owner: type, name: str) -> None:
+        self.name = name
+
+    def __get__(self, obj: Any, owner: type) -> Any:
+        if obj is None:
+            return self
+
+        digest = getattr(obj, f"{self.prefix}_hash")
+        cache = obj.__dict__.setdefault("_blob_values", {})
+        cached = cache.get(self.name)
+        if cached is not None and cached[0] == digest:
+            return cached[1]
+
+        if digest is None:
+            return None
+
+        session = object_session(obj)
+        if session is None:
+            logger.warning(f"Cannot load {self.name} of a detached {owner.__name__}")
+            return None
+
+        value = _decode(load_blob(session, digest), self.kind)
+        cache[self.name] = (digest, value)
+        return value
+
+    def __set__(self, obj: Any, value: Any) -> None:
+        if value is None:
+            obj.__dict__.setdefault("_blob_values", {})[self.name] = (None, None)
+            setattr(obj, f"{self.prefix}_hash", None)
+            setattr(obj, f"{self.prefix}_size", None)
+            return
+
+        data = _encode(value, self.kind)
+        digest = hash_bytes(data)
+        obj.__dict__.setdefault("_blob_values", {})[self.name] = (digest, value)
+        setattr(obj, f"{self.prefix}_hash", digest)
+        setattr(obj, f"{self.prefix}_size", len(data))
+        obj.__dict__.setdefault("_pending_blobs", {})[digest] = data
+
+@event.listens_for(Session, "before_flush")
+def _store_pending_blobs(session: Session, flush_context: Any, instances: Optional[Any]) -> None:
+    """Write blobs assigned through BlobField before the rows referencing them."""
+    for obj in list(session.new) + list(session.dirty):
+        pending = obj.__dict__.get("_pending_blobs")
+        if not pending:
+            continue
+        for data in pending.values():
+            store_blob(session, data)
+        pending.clear()
+
+@event.listens_for(Mapper, "expire")
+def _drop_pending_blobs(target: Any, attrs: Optional[Iterable[str]]) -> None:
+    """Forget unflushed BlobField assignments when the instance is expired in full (rollback)."""
+    pending = target.__dict__.get("_pending_blobs")
+    if attrs is None and pending:
+        pending.clear()
@@ -0,0 +1,180 @@
+"""
+Continuation of LLM output cut off at max_tokens.
+
+When a call stops at max_tokens (result["truncated"]), up to
+LLM_MAX_CONTINUATIONS follow-up calls are made with the same prompt, seeded
+with the tail of the output so far: Anthropic continues it as a prefilled
+assistant turn, OpenAI is sent it back with an instruction to go on (see
+llm.call_llm's prefill). Only the last CONTINUATION_TAIL_CHARS are sent
+(headed by the marker of the section being written), so a round costs the
+prompt again plus the tail, not the whole output.
+
+Before seeding, the output is cut back to the last line break (or sentence
+end, for a long last line) so every round continues from a clean boundary,
+and the text it repeats is dropped when stitching.
+
+Each round is recorded in the result's "continuations" (the top-level
+section it resumed in and its usage), which complete_report keeps on the
+report, so sections that keep overflowing can be found and split.
+"""
+import logging
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.llm import PartialOutput, call_llm
+from app.metrics import llm_continuations_total, llm_truncated_outputs_total
+from app.sections import SECTION_MARKER, split_sections
+
+logger = logging.getLogger(__name__)
+
+CONTINUATION_TAIL_CHARS = 4000
+# A last line longer than this is cut at its last sentence end rather than dropped
+MAX_DROPPED_LINE_CHARS = 300
+# Shortest repeated text recognised (and dropped) at the start of a continuation
+MIN_OVERLAP_CHARS = 20
+MAX_OVERLAP_CHARS = 1000
+
+_SENTENCE_END = re.compile(r"[.!?:;][\"')\]*_]*(?=\s)")
+_LEADING_SPACE = re.compile(r"^\s*")
+_TRAILING_SPACE = re.compile(r"\s*$")
+
+def cut_to_boundary(text: str) -> Tuple[str, bool]:
+    """
+    Cut truncated output back to where a continuation can pick up cleanly.
+
+    Returns:
+        (kept text, whether it was cut within a line)
+    """
+    line_start = text.rfind("\n") + 1
+    last_line = text[line_start:]
+    if len(last_line) > MAX_DROPPED_LINE_CHARS:
+        ends = list(_SENTENCE_END.finditer(last_line))
+        if ends:
+            return text[:line_start + ends[-1].end()], True
+    if line_start == 0:
+        # A single unfinished line: keep it whole
+        return text, True
+    return text[:line_start], False
+
+def stitch(kept: str, continuation: str, mid_line: bool) -> str:
+    """Join a continuation to the output it continues, dropping text it repeats."""
+    trailing = _TRAILING_SPACE.search(kept).group(0)
+    kept = kept[:len(kept) - len(trailing)]
+    leading = _LEADING_SPACE.match(continuation).group(0)
+    body = continuation[len(leading):]
+
+    longest = min(len(kept), len(body), MAX_OVERLAP_CHARS)
+    for size in range(longest, MIN_OVERLAP_CHARS - 1, -1):
+        if kept.endswith(body[:size]):
+            body = body[size:]
+            leading = _LEADING_SPACE.match(body).group(0)
+            body = body[len(leading):]
+            break
+
+    if not body:
+        return kept + trailing
+    if leading or trailing:
+        # Whichever side kept the paragraph break
+        separator = max(leading, trailing, key=lambda space: (space.count("\n"), len(space)))
+    else:
+        separator = " " if mid_line else "\n"
+    return kept + separator + body
+
+def _current_section(text: str) -> Optional[str]:
+    """Id of the last section marker in the text, i.e. the section output was cut off in."""
+    section_ids = list(split_sections(text))
+    return section_ids[-1] if section_ids else None
+
+def continuation_seed(kept: str, section_id: Optional[str]) -> str:
+    """The tail of the output to continue: whole lines, headed by the marker of the section being written."""
+    start = max(len(kept) - CONTINUATION_TAIL_CHARS, 0)
+    line_end = kept.find("\n", start) if start else -1
+    if 0 <= line_end < len(kept) - 1:
+        start = line_end + 1
+    tail = kept[start:]
+    marker = SECTION_MARKER.format(section_id=section_id) if section_id else None
+    if marker and marker not in tail:
+        # Keep the section being written in view
+        tail = f"{marker}\n{tail}"
+    return tail
+
+async def call_llm_continued(
+    prompt: str,
+    route: str,
+    model: Optional[str] = None,
+    max_tokens: int = 2048,
+    temperature: float = 0.7,
+    system_prompt: Optional[str] = None,
+    partial: Optional[PartialOutput] = None
+) -> Dict[str, Any]:
+    """
+    call_llm, continuing output cut off at max_tokens.
+
+    Args:
+        prompt: The user prompt
+        route: "blueprint" or "report", for metrics
+        model: Optional model override
+        max_tokens: Output budget of each round
+        temperature: Sampling temperature
+        system_prompt: Optional system prompt
+        partial: Collects the text as it is generated, earlier rounds included
+
+    Returns:
+        The call_llm result with the stitched content and the usage of all
+        rounds; "continuations" lists the rounds after the first, and
+        "truncated" stays set if the output was still cut off after the last
+
+    Raises:
+        LLMError: As call_llm, from any round
+    """
+    first = await call_llm(
+        prompt=prompt,
+        model=model,
+        system_prompt=system_prompt,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        partial=partial
+    )
+    if not first.get("truncated"):
+        return first
+
+    result = first
+    content = first["content"]
+    continuations: List[Dict[str, Any]] = []
+    while result.get("truncated") and len(continuations) < settings.LLM_MAX_CONTINUATIONS:
+        kept, mid_line = cut_to_boundary(content)
+        section_id = _current_section(kept)
+        logger.info(
+            f"LLM output cut off at max_tokens ({len(content)} chars"
+            f"{f', in section {section_id}' if section_id else ''}); continuing"
+        )
+        llm_continuations_total.inc(route=route)
+        if partial is not None:
+            partial.carry(kept)
+
+        result = await call_llm(
+            prompt=prompt,
+            model=model,
+            system_prompt=system_prompt,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            partial=partial,
+            prefill=continuation_seed(kept, section_id)
+        )
+        content = stitch(kept, result["content"], mid_line)
+        continuations.append({
+            "round": len(continuations) + 1,
+            "section_id": section_id,
+            "input_tokens": result.get("input_tokens"),
+            "output_tokens": result.get("output_tokens"),
+        })
+        for key in ("tokens_used", "input_tokens", "output_tokens"):
+            first[key] = (first.get(key) or 0) + (result.get(key) or 0)
+
+    truncated = bool(result.get("truncated"))
+    llm_truncated_outputs_total.inc(route=route, outcome="cut_off" if truncated else "completed")
+    if truncated:
+        logger.warning(f"LLM output still cut off after {len(continuations)} continuations")
+    first.update(content=content, truncated=truncated, continuations=continuations)
+    return first
@@ -1,17 +1,229 @@
-from sqlalchemy import create_engine
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError, SQLAlchemyError, TimeoutError as PoolTimeoutError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import NullPool, QueuePool
 
 from app.config import settings
+from app.metrics import (
+    db_pool_capacity,
+    db_pool_checked_out,
+    db_pool_checkout_wait_seconds_total,
+    db_pool_checkouts_total,
+    db_pool_connections_opened_total,
+    db_pool_invalidations_total,
+    db_pool_timeouts_total
+)
+from app.tracing import KIND_CLIENT, current_span, span, start_span
+
+logger = logging.getLogger(__name__)
+
+ALEMBIC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "alembic")
+
+# Postgres error code for "canceling statement due to statement timeout"
+QUERY_CANCELED = "57014"
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long checkouts wait for a connection."""
+
+    def _do_get(self) -> Any:
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            db_pool_timeouts_total.inc()
+            raise
+        finally:
+            db_pool_checkout_wait_seconds_total.inc(time.perf_counter() - start)
+
+def _engine_options(url: str) -> Dict[str, Any]:
+    """create_engine keyword arguments for the configured pooling mode."""
+    options: Dict[str, Any] = {"query_cache_size": settings.DB_QUERY_CACHE_SIZE}
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite" and parsed.database in (None, "", ":memory:"):
+        # In-memory SQLite lives in a single connection; keep SQLAlchemy's default pool
+        return options
+
+    if settings.DB_PGBOUNCER:
+        # PgBouncer pools server connections; a second pool here would pin them.
+        # Session-level SETs do not survive transaction pooling, so the statement
+        # timeout is applied per transaction instead (see _apply_statement_timeout)
+        options["poolclass"] = NullPool
+        return options
+
+    options.update(
+        poolclass=TimedQueuePool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING
+    )
+    if parsed.get_backend_name() == "postgresql" and settings.DB_STATEMENT_TIMEOUT_MS:
+        options["connect_args"] = {"options": f"-c statement_timeout={settings.DB_STATEMENT_TIMEOUT_MS}"}
+    return options
 
-engine = create_engine(settings.DATABASE_URL)
+engine = create_engine(settings.DATABASE_URL, **_engine_options(settings.DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
-def get_db():
+if isinstance(engine.pool, QueuePool):
+    db_pool_capacity.set(settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW)
+
+@event.listens_for(engine, "connect")
+def _on_connect(dbapi_connection: Any, connection_record: Any) -> None:
+    db_pool_connections_opened_total.inc()
+
+if engine.dialect.name == "sqlite":
+    @event.listens_for(engine, "connect")
+    def _enable_sqlite_foreign_keys(dbapi_connection: Any, connection_record: Any) -> None:
+        # Routes rely on foreign keys to reject missing users; SQLite enforces
+        # them only when enabled on each connection
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+@event.listens_for(engine, "checkout")
+def _on_checkout(dbapi_connection: Any, connection_record: Any, connection_proxy: Any) -> None:
+    db_pool_checkouts_total.inc()
+    db_pool_checked_out.inc()
+
+@event.listens_for(engine, "checkin")
+def _on_checkin(dbapi_connection: Any, connection_record: Any) -> None:
+    db_pool_checked_out.dec()
+
+@event.listens_for(engine, "invalidate")
+def _on_invalidate(dbapi_connection: Any, connection_record: Any, exception: Optional[BaseException]) -> None:
+    db_pool_invalidations_total.inc()
+
+@event.listens_for(engine, "before_cursor_execute")
+def _start_query_span(conn: Any, cursor: Any, statement: str, parameters: Any, context: Any, executemany: bool) -> None:
+    if not current_span().recording:
+        return
+    query_span = start_span("db.query", KIND_CLIENT, {
+        "db.system": conn.dialect.name,
+        "db.operation": statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "",
+        # Bound parameters are left out: they may hold user data
+        "db.statement": statement[:1000],
+    })
+    conn.info.setdefault("query_spans", []).append(query_span)
+
+@event.listens_for(engine, "after_cursor_execute")
+def _end_query_span(conn: Any, cursor: Any, statement: str, parameters: Any, context: Any, executemany: bool) -> None:
+    spans = conn.info.get("query_spans")
+    if spans:
+        query_span = spans.pop()
+        query_span.set_attribute("db.rows", cursor.rowcount)
+        query_span.end()
+
+@event.listens_for(engine, "handle_error")
+def _fail_query_span(exception_context: Any) -> None:
+    conn = exception_context.connection
+    spans = conn.info.get("query_spans") if conn is not None else None
+    if spans:
+        query_span = spans.pop()
+        query_span.record_error(exception_context.original_exception)
+        query_span.end()
+
+@event.listens_for(SessionLocal, "after_begin")
+def _apply_statement_timeout(session: Session, transaction: Any, connection: Any) -> None:
+    """Apply a per-session statement timeout (or the default behind PgBouncer)."""
+    timeout = session.info.get("statement_timeout_ms")
+    if timeout is None and settings.DB_PGBOUNCER:
+        timeout = settings.DB_STATEMENT_TIMEOUT_MS
+    if timeout is None or connection.dialect.name != "postgresql":
+        return
+    # SET LOCAL ends with the transaction, so it never leaks to other users of the connection
+    connection.exec_driver_sql(f"SET LOCAL statement_timeout = {int(timeout)}")
+
+def is_statement_timeout(error: OperationalError) -> bool:
+    """Whether a database error is a statement cancelled by statement_timeout."""
+    return getattr(error.orig, "pgcode", None) == QUERY_CANCELED
+
+class SchemaVersionError(Exception):
+    """Raised when the database is not migrated to the Alembic head revision"""
+    pass
+
+def _session_scope(statement_timeout_ms: Optional[int] = None, checkout: bool = True) -> Iterator[Session]:
     db = SessionLocal()
+    if statement_timeout_ms is not None:
+        db.info["statement_timeout_ms"] = statement_timeout_ms
     try:
+        if checkout:
+            # Check out the connection here: sync dependencies run in the threadpool,
+            # so waiting for a free pooled connection does not block the event loop
+            # (where the requests holding connections need to run to release them)
+            with span("db.checkout"):
+                db.connection()
         yield db
     finally:
         db.close()
+
+def get_db() -> Iterator[Session]:
+    yield from _session_scope()
+
+def db_session(statement_timeout_ms: Optional[int] = None, checkout: bool = True) -> Callable[[], Iterator[Session]]:
+    """
+    Build a get_db-style dependency with its own statement timeout or checkout policy.
+
+    Args:
+        statement_timeout_ms: Timeout for each statement in milliseconds (0 disables);
+            None keeps DB_STATEMENT_TIMEOUT_MS
+        checkout: Check out a connection before the route runs. Routes that are
+            usually answered from a cache pass False so a hit needs no connection
+
+    Returns:
+        Dependency yielding a session
+    """
+    def dependency() -> Iterator[Session]:
+        yield from _session_scope(statement_timeout_ms, checkout)
+
+    return dependency
+
+def check_schema_version() -> None:
+    """
+    Compare the database's Alembic revision with the migrations shipped in the code.
+
+    The schema is owned by Alembic (`alembic upgrade head`); the app never
+    issues DDL at startup. With SCHEMA_CHECK=warn a mismatch is logged, with
+    strict it stops the worker from starting, and off skips the query.
+
+    Raises:
+        SchemaVersionError: If SCHEMA_CHECK=strict and the database is behind,
+            ahead of, or unreachable from the code's head revision
+    """
+    if settings.SCHEMA_CHECK == "off":
+        return
+
+    from alembic.runtime.migration import MigrationContext
+    from alembic.script import ScriptDirectory
+
+    expected = set(ScriptDirectory(ALEMBIC_DIR).get_heads())
+    try:
+        with engine.connect() as connection:
+            current = set(MigrationContext.configure(connection).get_current_heads())
+    except SQLAlchemyError as e:
+        message = f"Could not read schema version: {str(e)}"
+        if settings.SCHEMA_CHECK == "strict":
+            raise SchemaVersionError(message)
+        logger.warning(message)
+        return
+
+    if current == expected:
+        logger.info(f"Database schema at revision {', '.join(sorted(current))}")
+        return
+
+    message = (
+        f"Database schema revision {', '.join(sorted(current)) or 'none'} does not match "
+        f"code head {', '.join(sorted(expected))}; run `alembic upgrade head`"
+    )
+    if settings.SCHEMA_CHECK == "strict":
+        raise SchemaVersionError(message)
+    logger.warning(message)
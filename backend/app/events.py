@@ -0,0 +1,399 @@
+"""
+Per-user push channel for report status transitions.
+
+Status changes are picked up from flushed Report rows by a Session listener
+and published once the transaction commits, so every path that changes a
+status (interactive generation, batch pollers, failures) is covered without
+extra calls. Subscribers receive them over Server-Sent Events. While a report
+is being generated, report.progress events carry the share of its sections
+written so far; they are not tied to a transaction.
+
+With EVENTS_BACKEND=memory events are fanned out in-process. With
+EVENTS_BACKEND=postgres they are sent through NOTIFY inside the committing
+transaction and every worker LISTENs, so a client connected to one worker
+sees reports finished by another.
+
+Each stream has a bounded queue. When a consumer falls behind, the oldest
+event is dropped and the client is told to resync by refetching, which is
+safe because events describe state rather than deltas. Streams end after
+EVENTS_STREAM_MAX_AGE; browsers reconnect on their own (receiving a fresh
+snapshot), which lets a stopping worker drain and spreads clients over workers.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Set
+
+from sqlalchemy import event, inspect, text
+from sqlalchemy.orm import Session
+from starlette.requests import Request
+
+from app.cancellation import wait_for_disconnect
+from app.config import settings
+from app.metrics import (
+    event_stream_heartbeats_total,
+    event_streams_active,
+    events_delivered_total,
+    events_dropped_total,
+    events_published_total
+)
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = "report_events"
+# NOTIFY payloads are limited to 8000 bytes
+MAX_ERROR_LENGTH = 500
+RECONNECT_DELAY = 5.0
+
+_PENDING_KEY = "pending_report_events"
+_FINAL_STATUSES = ("completed", "failed", "cancelled")
+
+class TooManyStreamsError(Exception):
+    """Raised when a user already has EVENTS_MAX_STREAMS_PER_USER open streams"""
+    pass
+
+class Subscription:
+    """One open stream: a bounded queue of events for a user."""
+
+    def __init__(self, user_id: int, max_queue: int):
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.dropped = 0
+
+    def offer(self, payload: Dict[str, Any]) -> None:
+        if self.queue.full():
+            try:
+                self.queue.get_nowait()
+                self.dropped += 1
+                events_dropped_total.inc()
+            except asyncio.QueueEmpty:
+                pass
+        self.queue.put_nowait(payload)
+
+class EventBroker:
+    """In-process fan-out of events to the subscriptions of each user."""
+
+    def __init__(self):
+        self._subscriptions: Dict[int, Set[Subscription]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id: int) -> Subscription:
+        """
+        Open a subscription for a user.
+
+        Raises:
+            TooManyStreamsError: If the user is at the per-user stream limit
+        """
+        self._loop = asyncio.get_running_loop()
+        with self._lock:
+            subscriptions = self._subscriptions.setdefault(user_id, set())
+            if len(subscriptions) >= settings.EVENTS_MAX_STREAMS_PER_USER:
+                raise TooManyStreamsError(f"User {user_id} already has {len(subscriptions)} open event streams")
+            subscription = Subscription(user_id, settings.EVENTS_QUEUE_SIZE)
+            subscriptions.add(subscription)
+        event_streams_active.inc()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is None or subscription not in subscriptions:
+                return
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscriptions[subscription.user_id]
+        event_streams_active.dec()
+
+    def publish(self, payload: Dict[str, Any]) -> None:
+        """Deliver an event to the user's subscriptions (safe from any thread)."""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._deliver(payload)
+        else:
+            loop.call_soon_threadsafe(self._deliver, payload)
+
+    def _deliver(self, payload: Dict[str, Any]) -> None:
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(payload.get("user_id"), ()))
+        for subscription in subscriptions:
+            subscription.offer(payload)
+
+broker = EventBroker()
+
+def _status_value(status: Any) -> Optional[str]:
+    return getattr(status, "value", status)
+
+def report_event(report: Any) -> Dict[str, Any]:
+    """Event payload describing a report's current status."""
+    status = _status_value(report.status)
+    error = report.error_message
+    return {
+        "type": "report.status",
+        "report_id": report.id,
+        "user_id": report.user_id,
+        "batch_id": report.batch_id,
+        "title": report.title,
+        "status": status,
+        "progress": 1.0 if status in _FINAL_STATUSES else 0.0,
+        "error_message": error[:MAX_ERROR_LENGTH] if error else None,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+    }
+
+def _notify(payload: Dict[str, Any]) -> None:
+    from app.database import engine
+
+    with engine.connect() as connection:
+        connection.execute(
+            text("SELECT pg_notify(:channel, :payload)"),
+            {"channel": NOTIFY_CHANNEL, "payload": json.dumps(payload)}
+        )
+        connection.commit()
+
+async def publish_event(payload: Dict[str, Any]) -> None:
+    """Publish an event that is not tied to a committed status change, to every worker."""
+    if settings.EVENTS_BACKEND == "postgres":
+        try:
+            await asyncio.to_thread(_notify, payload)
+        except Exception as e:
+            # Progress is best effort; the final status still arrives through the commit
+            logger.warning(f"Could not publish {payload['type']} event: {str(e)}")
+            return
+    else:
+        broker.publish(payload)
+    events_published_total.inc()
+
+@asynccontextmanager
+async def publishing_progress(report: Any, progress: Callable[[], float]) -> AsyncIterator[None]:
+    """
+    Publish report.progress events while the body runs (the generation of a report).
+
+    Every EVENTS_PROGRESS_INTERVAL the progress callable is sampled, and an
+    event is sent when its value moved. Progress stays below 1.0: completion
+    is the report.status event of the final status.
+
+    Args:
+        report: Report being generated (read once, on entry)
+        progress: Returns the share of the report generated so far
+    """
+    if settings.EVENTS_PROGRESS_INTERVAL <= 0:
+        yield
+        return
+
+    # Built up front: the report's attributes must not be loaded from the background task
+    base = dict(report_event(report), type="report.progress")
+
+    async def publish() -> None:
+        last = 0.0
+        while True:
+            await asyncio.sleep(settings.EVENTS_PROGRESS_INTERVAL)
+            value = round(min(max(progress(), 0.0), 0.99), 2)
+            if value > last:
+                last = value
+                await publish_event(dict(base, progress=value, timestamp=datetime.now(timezone.utc).isoformat()))
+
+    task = asyncio.create_task(publish())
+    try:
+        yield
+    finally:
+        task.cancel()
+
+def _uses_notify(session: Session) -> bool:
+    return settings.EVENTS_BACKEND == "postgres" and session.get_bind().dialect.name == "postgresql"
+
+@event.listens_for(Session, "after_flush")
+def _collect_status_changes(session: Session, flush_context: Any) -> None:
+    """Queue an event for every Report whose status was set in this flush."""
+    from app.models import Report
+
+    payloads = []
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Report) and inspect(obj).attrs.status.history.has_changes():
+            payloads.append(report_event(obj))
+    if not payloads:
+        return
+
+    if _uses_notify(session):
+        # NOTIFY is transactional: delivered on commit, discarded on rollback
+        connection = session.connection()
+        for payload in payloads:
+            connection.execute(
+                text("SELECT pg_notify(:channel, :payload)"),
+                {"channel": NOTIFY_CHANNEL, "payload": json.dumps(payload)}
+            )
+        events_published_total.inc(len(payloads))
+    else:
+        session.info.setdefault(_PENDING_KEY, []).extend(payloads)
+
+@event.listens_for(Session, "after_commit")
+def _publish_committed(session: Session) -> None:
+    payloads = session.info.pop(_PENDING_KEY, None)
+    if not payloads:
+        return
+    for payload in payloads:
+        broker.publish(payload)
+    events_published_total.inc(len(payloads))
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back(session: Session) -> None:
+    session.info.pop(_PENDING_KEY, None)
+
+def _format_sse(event_name: str, data: Any) -> str:
+    return f"event: {event_name}\ndata: {json.dumps(data)}\n\n"
+
+async def stream_events(
+    subscription: Subscription,
+    snapshot: List[Dict[str, Any]],
+    request: Request
+) -> AsyncIterator[str]:
+    """
+    Render a subscription as a Server-Sent Events stream.
+
+    Args:
+        subscription: Subscription opened by broker.subscribe
+        snapshot: Current status of the user's in-flight reports, read after
+            subscribing so transitions between page load and subscribing are not missed
+        request: Request whose client disconnecting ends the stream
+
+    Yields:
+        SSE frames (snapshot, report.status, resync and heartbeat comments)
+    """
+    reported_drops = 0
+    deadline = time.monotonic() + settings.EVENTS_STREAM_MAX_AGE
+    disconnected = asyncio.ensure_future(wait_for_disconnect(request))
+    try:
+        yield f"retry: {int(settings.EVENTS_HEARTBEAT_INTERVAL * 1000)}\n\n"
+        yield _format_sse("snapshot", snapshot)
+        while time.monotonic() < deadline and not disconnected.done():
+            getter = asyncio.ensure_future(subscription.queue.get())
+            done, _ = await asyncio.wait({getter, disconnected}, timeout=settings.EVENTS_HEARTBEAT_INTERVAL,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if getter not in done:
+                getter.cancel()
+                if disconnected in done:
+                    break
+                event_stream_heartbeats_total.inc()
+                yield ": heartbeat\n\n"
+                continue
+
+            payload = getter.result()
+            if subscription.dropped > reported_drops:
+                reported_drops = subscription.dropped
+                yield _format_sse("resync", {"dropped": reported_drops})
+            events_delivered_total.inc()
+            yield _format_sse(payload["type"], payload)
+    finally:
+        disconnected.cancel()
+        broker.unsubscribe(subscription)
+
+class PostgresListener:
+    """LISTENs on NOTIFY_CHANNEL and feeds notifications into the local broker."""
+
+    def __init__(self):
+        self._connection = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._reconnect: Optional[asyncio.Task] = None
+        self._stopped = False
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._stopped = False
+        if not await self._connect():
+            self._schedule_reconnect()
+
+    async def _connect(self) -> bool:
+        import psycopg2
+        import psycopg2.extensions
+
+        from sqlalchemy.engine import make_url
+
+        from app.database import engine
+
+        # LISTEN needs a session-pooled connection, so bypass PgBouncer when configured
+        url = make_url(settings.DATABASE_DIRECT_URL) if settings.DATABASE_DIRECT_URL else engine.url
+        dsn = url.set(drivername="postgresql").render_as_string(hide_password=False)
+        try:
+            connection = await asyncio.to_thread(psycopg2.connect, dsn)
+            connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+        except psycopg2.Error as e:
+            logger.error(f"Event listener could not connect: {str(e)}")
+            return False
+
+        self._connection = connection
+        self._loop.add_reader(connection.fileno(), self._on_readable)
+        logger.info(f"Listening for report events on channel {NOTIFY_CHANNEL}")
+        return True
+
+    def _on_readable(self) -> None:
+        import psycopg2
+
+        try:
+            self._connection.poll()
+        except psycopg2.Error as e:
+            logger.error(f"Event listener connection lost: {str(e)}")
+            self._close()
+            self._schedule_reconnect()
+            return
+
+        while self._connection.notifies:
+            notification = self._connection.notifies.pop(0)
+            try:
+                broker.publish(json.loads(notification.payload))
+            except ValueError:
+                logger.warning(f"Ignoring malformed report event: {notification.payload[:100]}")
+
+    def _schedule_reconnect(self) -> None:
+        if self._stopped or (self._reconnect and not self._reconnect.done()):
+            return
+
+        async def reconnect() -> None:
+            while not self._stopped:
+                await asyncio.sleep(RECONNECT_DELAY)
+                if await self._connect():
+                    return
+
+        self._reconnect = self._loop.create_task(reconnect())
+
+    def _close(self) -> None:
+        if self._connection is None:
+            return
+        try:
+            self._loop.remove_reader(self._connection.fileno())
+        except (ValueError, OSError):
+            pass
+        self._connection.close()
+        self._connection = None
+
+    async def stop(self) -> None:
+        self._stopped = True
+        if self._reconnect:
+            self._reconnect.cancel()
+        self._close()
+
+_listener: Optional[PostgresListener] = None
+
+async def start_event_listener() -> None:
+    """Start LISTENing when EVENTS_BACKEND=postgres (no-op otherwise)."""
+    global _listener
+    if settings.EVENTS_BACKEND != "postgres" or _listener is not None:
+        return
+    _listener = PostgresListener()
+    await _listener.start()
+
+async def stop_event_listener() -> None:
+    global _listener
+    if _listener is not None:
+        await _listener.stop()
+        _listener = None
@@ -0,0 +1,379 @@
+"""
+Report export: markdown to HTML, PDF and DOCX.
+
+Rendering runs in the shared process pool and artifacts are cached on disk
+under EXPORT_CACHE_DIR/<report id>/<content hash>.<ext>. Because the key is a
+hash of everything that goes into the artifact, changed content simply misses
+the cache; stale artifacts of the same report are removed when that happens.
+
+Report markdown is LLM output and is treated as untrusted: raw HTML in it is
+escaped, and renderers only load chart images from the render cache.
+"""
+import asyncio
+import hashlib
+import html
+import logging
+import os
+import re
+import shutil
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, Optional, Tuple
+from urllib.parse import unquote, urlsplit
+
+from app.config import settings
+from app.workers import run_in_process
+
+logger = logging.getLogger(__name__)
+
+# Bump when the rendering code changes so old artifacts are not served
+EXPORT_RENDERER_VERSION = "2"
+
+EXPORT_FORMATS: Dict[str, Tuple[str, str]] = {
+    "html": ("html", "text/html; charset=utf-8"),
+    "pdf": ("pdf", "application/pdf"),
+    "docx": ("docx", "application/vnd.openxmlformats-officedocument.wordprocessingml.document"),
+}
+
+_STREAM_CHUNK_SIZE = 64 * 1024
+
+# Exports currently rendering, so concurrent requests for the same artifact render once
+_in_flight: Dict[str, "asyncio.Task[str]"] = {}
+
+_HTML_TEMPLATE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+  body {{ font-family: "Helvetica Neue", Arial, sans-serif; line-height: 1.55; color: #1f2933; max-width: 820px; margin: 2rem auto; padding: 0 1rem; }}
+  h1, h2, h3, h4 {{ color: #102a43; line-height: 1.25; }}
+  table {{ border-collapse: collapse; width: 100%; margin: 1rem 0; }}
+  th, td {{ border: 1px solid #bcccdc; padding: 0.4rem 0.6rem; text-align: left; }}
+  th {{ background: #f0f4f8; }}
+  img {{ max-width: 100%; }}
+  @page {{ size: A4; margin: 2cm; }}
+</style>
+</head>
+<body>
+{body}
+</body>
+</html>
+"""
+
+class ExportError(Exception):
+    """Raised when a report cannot be exported"""
+    pass
+
+@dataclass
+class ExportArtifact:
+    path: str
+    media_type: str
+    filename: str
+    etag: str
+
+def content_hash(title: str, markdown_text: str, export_format: str) -> str:
+    """Hash of every input that affects an exported artifact."""
+    digest = hashlib.sha256()
+    for part in (EXPORT_RENDERER_VERSION, export_format, title, markdown_text):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+def report_export_dir(report_id: int) -> str:
+    """Directory holding the cached artifacts of one report."""
+    return os.path.join(settings.EXPORT_CACHE_DIR, str(report_id))
+
+def remove_report_exports(report_id: int) -> None:
+    """Delete every cached artifact of a report."""
+    shutil.rmtree(report_export_dir(report_id), ignore_errors=True)
+
+def _remove_stale_exports(report_id: int, export_format: str, current: str) -> None:
+    """Delete cached artifacts of this format that were built from older content."""
+    directory = report_export_dir(report_id)
+    extension = EXPORT_FORMATS[export_format][0]
+    for name in os.listdir(directory):
+        if name.endswith(f".{extension}") and name != os.path.basename(current):
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+
+def _localize_render_urls(markdown_text: str) -> str:
+    """Point chart image URLs at the local render cache so offline renderers can embed them."""
+    prefix = f"{settings.PUBLIC_API_URL.rstrip('/')}/api/renders/"
+    return markdown_text.replace(prefix, f"file://{os.path.abspath(settings.RENDER_CACHE_DIR)}/")
+
+def _render_file_path(url: str) -> Optional[str]:
+    """Local path of a chart in the render cache that a file:// URL points at, else None."""
+    if not url.startswith("file://"):
+        return None
+    root = os.path.realpath(settings.RENDER_CACHE_DIR)
+    path = os.path.realpath(unquote(url[len("file://"):]))
+    if os.path.dirname(path) != root:
+        return None
+    return path
+
+def _render_url_fetcher(url: str, *args, **kwargs) -> Dict:
+    """WeasyPrint URL fetcher that only resolves charts in the render cache."""
+    from weasyprint import default_url_fetcher
+
+    if _render_file_path(url) is None:
+        # Report markdown comes from the LLM: no network access or arbitrary local files
+        raise ValueError(f"Refusing to fetch {url[:200]} for an export")
+    return default_url_fetcher(url, *args, **kwargs)
+
+_SAFE_URL_SCHEMES = ("http", "https", "mailto", "file")
+
+def _markdown_extensions() -> list:
+    from markdown.extensions import Extension
+    from markdown.treeprocessors import Treeprocessor
+
+    class _DropUnsafeUrls(Treeprocessor):
+        def run(self, root):
+            for element in root.iter():
+                for attribute in ("href", "src"):
+                    value = element.get(attribute)
+                    if value is None:
+                        continue
+                    scheme = urlsplit(value.strip()).scheme.lower()
+                    if scheme and scheme not in _SAFE_URL_SCHEMES:
+                        element.set(attribute, "#")
+
+    class _EscapeRawHtml(Extension):
+        """Treat raw HTML in the markdown as text and drop javascript: and similar URLs."""
+
+        def extendMarkdown(self, md):
+            md.preprocessors.deregister("html_block")
+            md.inlinePatterns.deregister("html")
+            md.treeprocessors.register(_DropUnsafeUrls(md), "drop_unsafe_urls", 0)
+
+    return [_EscapeRawHtml(), "tables", "fenced_code", "sane_lists"]
+
+def _markdown_to_html(title: str, markdown_text: str) -> str:
+    import markdown
+
+    body = markdown.markdown(markdown_text, extensions=_markdown_extensions())
+    return _HTML_TEMPLATE.format(title=html.escape(title), body=body)
+
+_INLINE_PATTERN = re.compile(r"(\*\*[^*]+\*\*|\*[^*]+\*|`[^`]+`)")
+_IMAGE_PATTERN = re.compile(r"^!\[([^\]]*)\]\(([^)]+)\)$")
+
+def _add_inline_runs(paragraph, text: str) -> None:
+    """Add text to a docx paragraph, honouring **bold**, *italic* and `code` spans."""
+    for part in _INLINE_PATTERN.split(text):
+        if not part:
+            continue
+        if part.startswith("**") and part.endswith("**"):
+            paragraph.add_run(part[2:-2]).bold = True
+        elif part.startswith("`") and part.endswith("`"):
+            paragraph.add_run(part[1:-1]).font.name = "Courier New"
+        elif part.startswith("*") and part.endswith("*") and len(part) > 1:
+            paragraph.add_run(part[1:-1]).italic = True
+        else:
+            paragraph.add_run(part)
+
+def _markdown_to_docx(title: str, markdown_text: str, out_path: str) -> None:
+    from docx import Document
+    from docx.shared import Inches
+
+    document = Document()
+    document.core_properties.title = title
+    lines = markdown_text.splitlines()
+    i = 0
+    while i < len(lines):
+        line = lines[i].rstrip()
+        stripped = line.strip()
+
+        if not stripped:
+            i += 1
+            continue
+
+        heading = re.match(r"^(#{1,6})\s+(.*)$", stripped)
+        if heading:
+            document.add_heading(heading.group(2).strip(), level=min(len(heading.group(1)) - 1, 4))
+            i += 1
+            continue
+
+        if stripped.startswith("|"):
+            rows = []
+            while i < len(lines) and lines[i].strip().startswith("|"):
+                cells = [c.strip() for c in re.split(r"(?<!\\)\|", lines[i].strip().strip("|"))]
+                if not all(re.match(r"^:?-{3,}:?$", c) for c in cells if c):
+                    rows.append(cells)
+                i += 1
+            if rows:
+                width = max(len(r) for r in rows)
+                table = document.add_table(rows=len(rows), cols=width)
+                table.style = "Table Grid"
+                for r_idx, row in enumerate(rows):
+                    for c_idx, value in enumerate(row):
+                        _add_inline_runs(table.cell(r_idx, c_idx).paragraphs[0], value.replace("\\|", "|"))
+            continue
+
+        image = _IMAGE_PATTERN.match(stripped)
+        if image:
+            source = image.group(2)
+            local_path = _render_file_path(source)
+            # python-docx cannot embed SVG; fall back to the caption for those
+            if local_path and local_path.endswith(".png") and os.path.exists(local_path):
+                document.add_picture(local_path, width=Inches(6))
+            else:
+                document.add_paragraph().add_run(f"[Figure: {image.group(1)}]").italic = True
+            i += 1
+            continue
+
+        bullet = re.match(r"^[-*+]\s+(.*)$", stripped)
+        numbered = re.match(r"^\d+[.)]\s+(.*)$", stripped)
+        if bullet:
+            _add_inline_runs(document.add_paragraph(style="List Bullet"), bullet.group(1))
+        elif numbered:
+            _add_inline_runs(document.add_paragraph(style="List Number"), numbered.group(1))
+        else:
+            paragraph_lines = [stripped]
+            while i + 1 < len(lines) and lines[i + 1].strip() and not re.match(r"^(#|\||[-*+]\s|\d+[.)]\s|!\[)", lines[i + 1].strip()):
+                i += 1
+                paragraph_lines.append(lines[i].strip())
+            _add_inline_runs(document.add_paragraph(), " ".join(paragraph_lines))
+        i += 1
+
+    document.save(out_path)
+
+def render_export_file(export_format: str, title: str, markdown_text: str, out_path: str) -> str:
+    """
+    Render a report to an export file. Runs inside a worker process.
+
+    Args:
+        export_format: One of EXPORT_FORMATS
+        title: Report title
+        markdown_text: Report markdown
+        out_path: Destination path (written atomically)
+
+    Returns:
+        The path the artifact was written to
+    """
+    tmp_path = f"{out_path}.{os.getpid()}.tmp"
+
+    if export_format == "html":
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(_markdown_to_html(title, markdown_text))
+    elif export_format == "pdf":
+        from weasyprint import HTML
+
+        document = _markdown_to_html(title, _localize_render_urls(markdown_text))
+        HTML(string=document, url_fetcher=_render_url_fetcher).write_pdf(tmp_path)
+    elif export_format == "docx":
+        _markdown_to_docx(title, _localize_render_urls(markdown_text), tmp_path)
+    else:
+        raise ValueError(f"Unsupported export format: {export_format}")
+
+    os.replace(tmp_path, out_path)
+    return out_path
+
+async def _render_export(report_id: int, export_format: str, title: str, markdown_text: str, path: str) -> str:
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        logger.info(f"Rendering {export_format} export for report {report_id}")
+        await run_in_process(render_export_file, export_format, title, markdown_text, path)
+        _remove_stale_exports(report_id, export_format, path)
+        return path
+    except Exception as e:
+        logger.error(f"Export of report {report_id} failed: {str(e)}")
+        raise ExportError(f"Export failed: {str(e)}")
+    finally:
+        del _in_flight[path]
+
+async def export_report(
+    report_id: int,
+    title: str,
+    markdown_text: str,
+    export_format: str
+) -> ExportArtifact:
+    """
+    Return the export artifact for a report, rendering it if not cached.
+
+    Args:
+        report_id: Report ID
+        title: Report title
+        markdown_text: Report markdown
+        export_format: One of EXPORT_FORMATS
+
+    Returns:
+        The cached artifact
+
+    Raises:
+        ExportError: If the format is unsupported or rendering fails
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ExportError(f"Unsupported export format: {export_format}")
+
+    extension, media_type = EXPORT_FORMATS[export_format]
+    digest = content_hash(title, markdown_text, export_format)
+    directory = report_export_dir(report_id)
+    path = os.path.join(directory, f"{digest}.{extension}")
+    safe_title = re.sub(r"[^A-Za-z0-9._-]+", "_", title).strip("_") or f"report_{report_id}"
+    artifact = ExportArtifact(path, media_type, f"{safe_title}.{extension}", digest)
+
+    if os.path.exists(path):
+        logger.info(f"Export cache hit for report {report_id} ({export_format})")
+        return artifact
+
+    task = _in_flight.get(path)
+    if task is None:
+        # Not tied to this request: a requester going away does not stop the render for the others
+        task = asyncio.create_task(_render_export(report_id, export_format, title, markdown_text, path))
+        _in_flight[path] = task
+
+    await asyncio.shield(task)
+    return artifact
+
+def parse_range_header(range_header: Optional[str], file_size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range 'bytes=' header.
+
+    Args:
+        range_header: Value of the Range request header
+        file_size: Size of the file being served
+
+    Returns:
+        Inclusive (start, end) byte offsets, or None to serve the whole file
+
+    Raises:
+        ValueError: If the range cannot be satisfied
+    """
+    if not range_header or not range_header.startswith("bytes="):
+        return None
+
+    spec = range_header[len("bytes="):].strip()
+    if "," in spec:
+        # Multipart ranges are not worth supporting; serve the whole file
+        return None
+
+    start_str, _, end_str = spec.partition("-")
+    if not start_str:
+        length = int(end_str)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        start, end = max(file_size - length, 0), file_size - 1
+    else:
+        start = int(start_str)
+        end = int(end_str) if end_str else file_size - 1
+        end = min(end, file_size - 1)
+
+    if start > end or start >= file_size:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+async def iter_file_range(path: str, start: int, end: int) -> AsyncIterator[bytes]:
+    """Yield the inclusive byte range of a file in chunks, reading off the event loop."""
+    f = await asyncio.to_thread(open, path, "rb")
+    try:
+        await asyncio.to_thread(f.seek, start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await asyncio.to_thread(f.read, min(_STREAM_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
@@ -0,0 +1,88 @@
+"""
+Conditional GET support for report reads.
+
+Report responses carry a strong ETag derived from the row's identity and
+version (updated_at, status and the hashes of its stored blobs), so a client
+revalidating an unchanged report gets a 304 without the row's content being
+loaded, decompressed or serialized. Completed reports never change, so they
+are also marked immutable; in-flight ones must be revalidated on every use.
+"""
+import hashlib
+from typing import Any, Dict, Iterable, Optional
+
+from fastapi import Response
+
+from app.metrics import http_not_modified_bytes_saved_total, http_not_modified_total
+
+# Completed content is final; anything else may still change
+IMMUTABLE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "private, no-cache"
+
+def _digest(*parts: Any) -> str:
+    return hashlib.sha256("\x1f".join(str(part) for part in parts).encode("utf-8")).hexdigest()[:32]
+
+def _status_value(status: Any) -> Optional[str]:
+    return getattr(status, "value", status)
+
+def report_etag(report: Any) -> str:
+    """Strong validator for a full report response (unquoted)."""
+    return _digest(
+        "report", report.id, report.updated_at, _status_value(report.status),
+        report.title, report.content_hash, report.blueprint_hash, report.prompt_hash
+    )
+
+def report_list_etag(reports: Iterable[Any], *params: Any) -> str:
+    """Validator for a page of report summaries; params are the paging arguments."""
+    return _digest(
+        "reports", *params,
+        *(f"{r.id}:{r.updated_at}:{_status_value(r.status)}" for r in reports)
+    )
+
+def report_cache_control(report: Any) -> str:
+    return IMMUTABLE_CACHE_CONTROL if _status_value(report.status) == "completed" else REVALIDATE_CACHE_CONTROL
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Evaluate an If-None-Match header against an ETag.
+
+    Uses the weak comparison RFC 9110 prescribes for If-None-Match, so tags
+    weakened by the compression middleware (W/"...") still match.
+
+    Args:
+        if_none_match: Header value, if any
+        etag: Current ETag (unquoted)
+
+    Returns:
+        True if the client's copy is current and a 304 can be sent
+    """
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate.strip('"') == etag:
+            return True
+    return False
+
+def cache_headers(etag: str, cache_control: str) -> Dict[str, str]:
+    return {"ETag": f'"{etag}"', "Cache-Control": cache_control}
+
+def not_modified(route: str, etag: str, cache_control: str, saved_bytes: int = 0) -> Response:
+    """
+    Build a 304 response and record the bandwidth it saved.
+
+    Args:
+        route: Route template, for metrics
+        etag: Current ETag (unquoted)
+        cache_control: Cache-Control value to repeat on the 304
+        saved_bytes: Estimated size of the body that was not sent
+
+    Returns:
+        Empty 304 response
+    """
+    http_not_modified_total.inc(route=route)
+    http_not_modified_bytes_saved_total.inc(saved_bytes, route=route)
+    return Response(status_code=304, headers=cache_headers(etag, cache_control))
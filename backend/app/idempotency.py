@@ -0,0 +1,291 @@
+"""
+Idempotency-Key support for generation requests.
+
+A POST to one of IDEMPOTENT_PATHS carrying an Idempotency-Key header runs at
+most once per key: the first request claims the key (a row in
+idempotency_keys, unique on key and path), and its response is stored there
+for IDEMPOTENCY_TTL_SECONDS. Duplicates arriving meanwhile wait for it, on an
+event within the worker or by polling the row from other workers, and get
+the same response, headers included; later duplicates get it straight away.
+Replayed responses carry an Idempotent-Replayed header.
+
+Reusing a key with a different body is rejected (422). Responses that are
+worth retrying (429 and 5xx) are not stored: the key is released and the
+next duplicate runs the request again. A request with a key is not cancelled
+when its client disconnects, since the client may come back for the result.
+A key whose request died with its worker is taken over once its claim
+expires (the generation deadline plus a margin).
+
+The claim costs one INSERT on the unique index for a new key, and a lookup
+on it for a duplicate.
+"""
+import asyncio
+import hashlib
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse, Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.config import settings
+from app.database import SessionLocal
+from app.metrics import idempotency_requests_total
+from app.models import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENT_PATHS = ("/api/reports/generate", "/api/blueprint/generate")
+MAX_KEY_LENGTH = 255
+
+STATUS_PROCESSING = "processing"
+STATUS_COMPLETED = "completed"
+
+# Outcomes of a claim
+CLAIMED = "claimed"
+IN_FLIGHT = "in_flight"
+COMPLETED = "completed"
+MISMATCH = "mismatch"
+
+# Status, headers ([name, value] pairs) and body
+StoredResponse = Tuple[int, List[List[str]], bytes]
+
+# Not replayed: they describe the original connection (Content-Length is recomputed)
+UNSTORED_HEADERS = frozenset((
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te", "trailer",
+    "transfer-encoding", "upgrade", "content-length"
+))
+
+# Requests holding a key in this worker, so duplicates here need not poll
+_in_flight: Dict[Tuple[str, str], asyncio.Event] = {}
+_last_cleanup = 0.0
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+def _aware(value: datetime) -> datetime:
+    # SQLite hands timestamps back without their zone
+    return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+
+def _claim_seconds() -> float:
+    """How long a claim holds before its request is presumed dead."""
+    deadline = max(settings.REPORT_DEADLINE_SECONDS, settings.BLUEPRINT_DEADLINE_SECONDS)
+    return (deadline or settings.IDEMPOTENCY_TTL_SECONDS) + 60
+
+def _delete_expired(db: Session) -> None:
+    global _last_cleanup
+    if time.monotonic() - _last_cleanup < settings.IDEMPOTENCY_CLEANUP_INTERVAL:
+        return
+    _last_cleanup = time.monotonic()
+    deleted = db.query(IdempotencyKey).filter(IdempotencyKey.expires_at < _now()).delete(synchronize_session=False)
+    db.commit()
+    if deleted:
+        logger.info(f"Deleted {deleted} expired idempotency keys")
+
+def claim_key(path: str, key: str, request_hash: str) -> Tuple[str, Optional[StoredResponse]]:
+    """
+    Claim an idempotency key for a request, or find out what became of it.
+
+    Args:
+        path: Request path (keys are scoped per path)
+        key: Idempotency-Key header value
+        request_hash: SHA-256 of the request body
+
+    Returns:
+        (outcome, stored response); the response is set for COMPLETED only
+    """
+    db = SessionLocal()
+    try:
+        _delete_expired(db)
+        for _ in range(2):
+            db.add(IdempotencyKey(
+                key=key,
+                path=path,
+                request_hash=request_hash,
+                status=STATUS_PROCESSING,
+                expires_at=_now() + timedelta(seconds=_claim_seconds())
+            ))
+            try:
+                db.commit()
+                return CLAIMED, None
+            except IntegrityError:
+                db.rollback()
+
+            record = db.query(IdempotencyKey).filter(
+                IdempotencyKey.key == key, IdempotencyKey.path == path
+            ).first()
+            if record is None:
+                # Released in the meantime: try again
+                continue
+            if _aware(record.expires_at) <= _now():
+                # Expired (a stored response past its TTL or a dead claim): start over
+                db.delete(record)
+                db.commit()
+                continue
+            if record.request_hash != request_hash:
+                return MISMATCH, None
+            if record.status == STATUS_COMPLETED:
+                return COMPLETED, (record.response_status, record.response_headers or [], record.response_body)
+            return IN_FLIGHT, None
+        return IN_FLIGHT, None
+    finally:
+        db.close()
+
+def store_response(path: str, key: str, response: StoredResponse) -> None:
+    """Keep the response of a claimed key for IDEMPOTENCY_TTL_SECONDS."""
+    status, headers, body = response
+    db = SessionLocal()
+    try:
+        db.query(IdempotencyKey).filter(IdempotencyKey.key == key, IdempotencyKey.path == path).update({
+            IdempotencyKey.status: STATUS_COMPLETED,
+            IdempotencyKey.response_status: status,
+            IdempotencyKey.response_headers: headers,
+            IdempotencyKey.response_body: body,
+            IdempotencyKey.expires_at: _now() + timedelta(seconds=settings.IDEMPOTENCY_TTL_SECONDS)
+        }, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+def release_key(path: str, key: str) -> None:
+    """Give up a claimed key so the next duplicate runs the request again."""
+    db = SessionLocal()
+    try:
+        db.query(IdempotencyKey).filter(
+            IdempotencyKey.key == key, IdempotencyKey.path == path
+        ).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+def _stored_headers(raw_headers: List[Tuple[bytes, bytes]]) -> List[List[str]]:
+    headers = []
+    for name, value in raw_headers:
+        name = name.decode("latin-1").lower()
+        if name not in UNSTORED_HEADERS:
+            headers.append([name, value.decode("latin-1")])
+    return headers
+
+def _should_store(status: int) -> bool:
+    return status < 500 and status != 429
+
+async def _read_body(receive: Receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            raise ConnectionError("Client disconnected while sending the request")
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+class IdempotencyMiddleware:
+    """ASGI middleware running requests with an Idempotency-Key at most once."""
+
+    def __init__(self, app: ASGIApp, paths: Tuple[str, ...] = IDEMPOTENT_PATHS):
+        self.app = app
+        self.paths = paths
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        key = Headers(scope=scope).get("idempotency-key")
+        if key is None:
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+        if not key or len(key) > MAX_KEY_LENGTH:
+            response = JSONResponse(
+                {"detail": f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters"}, status_code=400
+            )
+            await response(scope, receive, send)
+            return
+
+        try:
+            body = await _read_body(receive)
+        except ConnectionError:
+            return
+        request_hash = hashlib.sha256(body).hexdigest()
+
+        waited = False
+        while True:
+            outcome, stored = await asyncio.to_thread(claim_key, path, key, request_hash)
+            if outcome == CLAIMED:
+                break
+            if outcome == MISMATCH:
+                idempotency_requests_total.inc(path=path, result="mismatch")
+                response = JSONResponse(
+                    {"detail": "Idempotency-Key was already used with a different request"}, status_code=422
+                )
+                await response(scope, receive, send)
+                return
+            if outcome == COMPLETED:
+                idempotency_requests_total.inc(path=path, result="attached" if waited else "replayed")
+                status, headers, stored_body = stored
+                response = Response(stored_body, status_code=status)
+                for name, value in headers:
+                    response.headers.append(name, value)
+                response.headers["Idempotent-Replayed"] = "true"
+                await response(scope, receive, send)
+                return
+
+            # In flight: wait for it here, or poll when it runs on another worker
+            waited = True
+            event = _in_flight.get((path, key))
+            try:
+                if event is not None:
+                    await asyncio.wait_for(event.wait(), settings.IDEMPOTENCY_POLL_INTERVAL)
+                else:
+                    await asyncio.sleep(settings.IDEMPOTENCY_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+        idempotency_requests_total.inc(path=path, result="new")
+        done = asyncio.Event()
+        _in_flight[(path, key)] = done
+        await self._run(scope, receive, send, path, key, body, done)
+
+    async def _run(
+        self, scope: Scope, receive: Receive, send: Send, path: str, key: str, body: bytes, done: asyncio.Event
+    ) -> None:
+        body_sent = False
+        status = 500
+        headers: List[List[str]] = []
+        chunks = []
+
+        async def receive_request() -> Message:
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            # The client may retry for the result: it does not get to cancel the work by leaving
+            await done.wait()
+            return {"type": "http.disconnect"}
+
+        async def capture(message: Message) -> None:
+            nonlocal status, headers
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = _stored_headers(list(message.get("headers", [])))
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        stored = False
+        try:
+            await self.app(scope, receive_request, capture)
+            if _should_store(status):
+                await asyncio.to_thread(store_response, path, key, (status, headers, b"".join(chunks)))
+                stored = True
+        finally:
+            if not stored:
+                idempotency_requests_total.inc(path=path, result="released")
+                await asyncio.to_thread(release_key, path, key)
+            _in_flight.pop((path, key), None)
+            done.set()
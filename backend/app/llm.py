@@ -1,10 +1,12 @@
-from typing import Dict, Any, Optional, AsyncGenerator
+from typing import Dict, Any, Optional, AsyncGenerator, Iterator, List, Tuple
+from contextlib import contextmanager
+from contextvars import ContextVar
 import logging
-from anthropic import AsyncAnthropic, APIError, RateLimitError
-from openai import AsyncOpenAI, APIError as OpenAIAPIError, RateLimitError as OpenAIRateLimitError
 import asyncio
+import time
 
 from app.config import settings
+from app.tracing import KIND_CLIENT, current_span, span, start_span
 
 logger = logging.getLogger(__name__)
 
@@ -20,13 +22,114 @@ class LLMAPIError(LLMError):
     """Raised when API call fails"""
     pass
 
+class LLMDeadlineExceeded(LLMError):
+    """Raised when an LLM call cannot finish before the deadline of the request"""
+    pass
+
+# Follows the seeded output in an OpenAI continuation, which cannot prefill the assistant turn
+CONTINUE_INSTRUCTION = (
+    "Your previous reply was cut off; its last part is above. Continue exactly where it stops, "
+    "without repeating any of it and without any commentary."
+)
+
+# Monotonic time by which the LLM calls of the current request must be done
+_deadline: ContextVar[Optional[float]] = ContextVar("llm_deadline", default=None)
+
+@contextmanager
+def llm_deadline(seconds: Optional[float]) -> Iterator[None]:
+    """
+    Give the LLM calls made in the block, retries and backoff included, a time budget.
+
+    The deadline follows the context into tasks started in the block. Nested
+    deadlines keep the earliest one; None or 0 adds no deadline.
+    """
+    if not seconds:
+        yield
+        return
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    if current is not None:
+        deadline = min(deadline, current)
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+def deadline_remaining() -> Optional[float]:
+    """Seconds left before the current deadline (negative once past it); None without one."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+def _attempt_timeout() -> float:
+    """Timeout of one provider attempt: LLM_REQUEST_TIMEOUT, cut short by the deadline."""
+    remaining = deadline_remaining()
+    if remaining is None:
+        return settings.LLM_REQUEST_TIMEOUT
+    if remaining <= 0:
+        raise LLMDeadlineExceeded("Deadline exceeded before the LLM call")
+    return min(remaining, settings.LLM_REQUEST_TIMEOUT)
+
+def _timeout_error(timeout: float) -> LLMError:
+    remaining = deadline_remaining()
+    if remaining is not None and remaining <= 0:
+        return LLMDeadlineExceeded("LLM call did not finish before the deadline")
+    return LLMAPIError(f"LLM call timed out after {timeout:.0f}s")
+
+async def _retry_backoff(wait_time: float) -> None:
+    """Wait before retrying a rate limited call, unless the deadline would pass meanwhile."""
+    remaining = deadline_remaining()
+    if remaining is not None and remaining <= wait_time:
+        raise LLMDeadlineExceeded(f"Rate limited with {max(remaining, 0):.1f}s left before the deadline")
+    logger.warning(f"Rate limit hit, waiting {wait_time}s before retry")
+    current_span().add_event("llm.retry_backoff", wait_seconds=wait_time)
+    await asyncio.sleep(wait_time)
+
+class PartialOutput:
+    """
+    Text of a call_llm call collected as it is generated.
+
+    Passing one to call_llm streams the provider call, so the output produced
+    before a cancellation or a deadline can still be saved.
+    """
+
+    def __init__(self) -> None:
+        self.carried = ""
+        self.chunks: List[str] = []
+        self.chars = 0
+
+    def append(self, text: str) -> None:
+        self.chunks.append(text)
+        self.chars += len(text)
+
+    def reset(self) -> None:
+        """Drop the text of the current call (a retried attempt starts over)."""
+        self.chunks.clear()
+        self.chars = 0
+
+    def carry(self, text: str) -> None:
+        """Put the output of earlier calls (continued by the next one) ahead of its text."""
+        self.carried = text
+        self.reset()
+
+    @property
+    def text(self) -> str:
+        return self.carried + "".join(self.chunks)
+
+    @property
+    def output_tokens(self) -> int:
+        """Estimated number of tokens generated so far (about 4 characters each)."""
+        return (len(self.carried) + self.chars) // 4
+
 async def call_llm(
     prompt: str,
     model: Optional[str] = None,
     max_tokens: int = 2048,
     temperature: float = 0.7,
     system_prompt: Optional[str] = None,
-    stream: bool = False
+    stream: bool = False,
+    partial: Optional[PartialOutput] = None,
+    prefill: Optional[str] = None
 ) -> Dict[str, Any]:
     """
     Call LLM provider based on settings.LLM_PROVIDER.
@@ -39,6 +142,9 @@ async def call_llm(
         temperature: Sampling temperature (0.0-1.0)
         system_prompt: Optional system prompt for context
         stream: Whether to stream the response
+        partial: Collects the text as it is generated (the provider call is streamed)
+        prefill: Earlier output the reply continues (see app/continuation.py); the
+            returned content is only the continuation
 
     Returns:
         Dict containing the LLM response with keys:
@@ -46,24 +152,45 @@ async def call_llm(
             - content: str
             - model: str
             - tokens_used: int (if available)
+            - truncated: bool, whether generation stopped at max_tokens
 
     Raises:
         LLMError: If the API call fails
         LLMRateLimitError: If rate limit is exceeded
+        LLMDeadlineExceeded: If the call cannot finish before the deadline (see llm_deadline)
     """
     provider = settings.LLM_PROVIDER
     logger.info(f"Calling LLM with provider: {provider}, model: {model}, stream: {stream}")
 
-    try:
+    async def call() -> Dict[str, Any]:
         if provider == "anthropic":
-            return await _call_anthropic(prompt, model, max_tokens, temperature, system_prompt, stream)
+            return await _call_anthropic(
+                prompt, model, max_tokens, temperature, system_prompt, stream, partial, prefill
+            )
         elif provider == "openai":
-            return await _call_openai(prompt, model, max_tokens, temperature, system_prompt, stream)
+            return await _call_openai(prompt, model, max_tokens, temperature, system_prompt, stream, partial, prefill)
         else:
             raise ValueError(f"Unsupported LLM provider: {provider}")
-    except Exception as e:
-        logger.error(f"LLM call failed: {str(e)}")
-        raise
+
+    with span("llm.call", **{"gen_ai.system": provider, "gen_ai.request.max_tokens": max_tokens}) as call_span:
+        try:
+            if settings.LLM_FIXTURE_MODE != "off":
+                # Imported here so the fixture layer costs nothing when it is off
+                from app.llm_fixtures import fixture_call, llm_request
+
+                request = llm_request("call", prompt, model, max_tokens, temperature, system_prompt, prefill)
+                result = await fixture_call(request, call)
+            else:
+                result = await call()
+        except Exception as e:
+            logger.error(f"LLM call failed: {str(e)}")
+            raise
+        call_span.set_attributes({
+            "gen_ai.response.model": result.get("model"),
+            "gen_ai.usage.input_tokens": result.get("input_tokens"),
+            "gen_ai.usage.output_tokens": result.get("output_tokens")
+        })
+        return result
 
 async def call_llm_stream(
     prompt: str,
@@ -88,18 +215,49 @@ async def call_llm_stream(
     provider = settings.LLM_PROVIDER
     logger.info(f"Streaming LLM call with provider: {provider}")
 
-    try:
+    def stream() -> AsyncGenerator[str, None]:
         if provider == "anthropic":
-            async for chunk in _stream_anthropic(prompt, model, max_tokens, temperature, system_prompt):
-                yield chunk
+            return _stream_anthropic(prompt, model, max_tokens, temperature, system_prompt)
         elif provider == "openai":
-            async for chunk in _stream_openai(prompt, model, max_tokens, temperature, system_prompt):
-                yield chunk
+            return _stream_openai(prompt, model, max_tokens, temperature, system_prompt)
         else:
             raise ValueError(f"Unsupported LLM provider: {provider}")
+
+    # Not made the active span: the generator may be resumed from other contexts
+    stream_span = start_span("llm.stream", KIND_CLIENT, {
+        "gen_ai.system": provider,
+        "gen_ai.request.model": model,
+        "gen_ai.request.max_tokens": max_tokens
+    })
+    start = time.perf_counter()
+    chunk_count = 0
+    output_chars = 0
+    try:
+        if settings.LLM_FIXTURE_MODE != "off":
+            # Imported here so the fixture layer costs nothing when it is off
+            from app.llm_fixtures import fixture_stream, llm_request
+
+            request = llm_request("stream", prompt, model, max_tokens, temperature, system_prompt)
+            chunks = fixture_stream(request, stream)
+        else:
+            chunks = stream()
+        async for chunk in chunks:
+            if chunk_count == 0:
+                stream_span.set_attribute("llm.time_to_first_token_ms", (time.perf_counter() - start) * 1000)
+                stream_span.add_event("first_token")
+            chunk_count += 1
+            output_chars += len(chunk)
+            remaining = deadline_remaining()
+            if remaining is not None and remaining <= 0:
+                raise LLMDeadlineExceeded("LLM stream did not finish before the deadline")
+            yield chunk
     except Exception as e:
+        stream_span.record_error(e)
         logger.error(f"LLM streaming failed: {str(e)}")
         raise
+    finally:
+        stream_span.set_attributes({"llm.chunks": chunk_count, "llm.output_chars": output_chars})
+        stream_span.end()
 
 async def _call_anthropic(
     prompt: str,
@@ -107,7 +265,9 @@ async def _call_anthropic(
     max_tokens: int = 2048,
     temperature: float = 0.7,
     system_prompt: Optional[str] = None,
-    stream: bool = False
+    stream: bool = False,
+    partial: Optional[PartialOutput] = None,
+    prefill: Optional[str] = None
 ) -> Dict[str, Any]:
     """
     Call Anthropic Claude API with retry logic.
@@ -119,6 +279,8 @@ async def _call_anthropic(
         temperature: Sampling temperature
         system_prompt: System prompt for context
         stream: Whether to stream (not used in non-streaming call)
+        partial: Collects the text as it is generated (the call is then streamed)
+        prefill: Start of the assistant turn, continued by the reply
 
     Returns:
         Dict with response data
@@ -126,10 +288,17 @@ async def _call_anthropic(
     if not settings.ANTHROPIC_API_KEY:
         raise LLMAPIError("ANTHROPIC_API_KEY not configured")
 
-    client = AsyncAnthropic(api_key=settings.ANTHROPIC_API_KEY)
+    # Imported here so only the configured provider's SDK is loaded
+    from anthropic import AsyncAnthropic, APIError, APITimeoutError, RateLimitError
+    import httpx
+
+    client = AsyncAnthropic(api_key=settings.ANTHROPIC_API_KEY, base_url=settings.ANTHROPIC_BASE_URL)
     model = model or "claude-3-5-sonnet-20241022"
 
     messages = [{"role": "user", "content": prompt}]
+    if prefill:
+        # The API rejects a final assistant turn ending in whitespace
+        messages.append({"role": "assistant", "content": prefill.rstrip()})
 
     retry_count = 0
     max_retries = 3
@@ -148,7 +317,25 @@ async def _call_anthropic(
             if system_prompt:
                 kwargs["system"] = system_prompt
 
-            response = await client.messages.create(**kwargs)
+            timeout = _attempt_timeout()
+            if partial is not None:
+                partial.reset()
+            with span("llm.attempt", KIND_CLIENT, **{
+                "gen_ai.system": "anthropic", "gen_ai.request.model": model, "llm.attempt": retry_count + 1
+            }) as attempt_span:
+                async with asyncio.timeout(timeout):
+                    if partial is not None:
+                        async with client.messages.stream(**kwargs, timeout=timeout) as message_stream:
+                            async for text in message_stream.text_stream:
+                                partial.append(text)
+                            response = await message_stream.get_final_message()
+                    else:
+                        response = await client.messages.create(**kwargs, timeout=timeout)
+                attempt_span.set_attributes({
+                    "gen_ai.usage.input_tokens": response.usage.input_tokens,
+                    "gen_ai.usage.output_tokens": response.usage.output_tokens,
+                    "gen_ai.response.finish_reasons": response.stop_reason
+                })
 
             content = response.content[0].text if response.content else ""
 
@@ -158,7 +345,8 @@ async def _call_anthropic(
                 "model": model,
                 "tokens_used": response.usage.input_tokens + response.usage.output_tokens,
                 "input_tokens": response.usage.input_tokens,
-                "output_tokens": response.usage.output_tokens
+                "output_tokens": response.usage.output_tokens,
+                "truncated": response.stop_reason == "max_tokens"
             }
 
             logger.info(f"Anthropic API call successful. Tokens used: {result['tokens_used']}")
@@ -170,9 +358,15 @@ async def _call_anthropic(
                 logger.error(f"Rate limit exceeded after {max_retries} retries")
                 raise LLMRateLimitError(f"Rate limit exceeded: {str(e)}")
 
-            wait_time = 2 ** retry_count
-            logger.warning(f"Rate limit hit, waiting {wait_time}s before retry")
-            await asyncio.sleep(wait_time)
+            await _retry_backoff(2 ** retry_count)
+
+        except (TimeoutError, APITimeoutError):
+            raise _timeout_error(timeout)
+
+        except httpx.TransportError as e:
+            # Not wrapped by the SDK when a streamed response breaks off
+            logger.error(f"Anthropic stream interrupted: {str(e)}")
+            raise LLMAPIError(f"Anthropic API error: stream interrupted: {str(e)}")
 
         except APIError as e:
             logger.error(f"Anthropic API error: {str(e)}")
@@ -191,7 +385,10 @@ async def _stream_anthropic(
     if not settings.ANTHROPIC_API_KEY:
         raise LLMAPIError("ANTHROPIC_API_KEY not configured")
 
-    client = AsyncAnthropic(api_key=settings.ANTHROPIC_API_KEY)
+    # Imported here so only the configured provider's SDK is loaded
+    from anthropic import AsyncAnthropic, APIError, RateLimitError
+
+    client = AsyncAnthropic(api_key=settings.ANTHROPIC_API_KEY, base_url=settings.ANTHROPIC_BASE_URL)
     model = model or "claude-3-5-sonnet-20241022"
 
     messages = [{"role": "user", "content": prompt}]
@@ -207,7 +404,7 @@ async def _stream_anthropic(
         if system_prompt:
             kwargs["system"] = system_prompt
 
-        async with client.messages.stream(**kwargs) as stream:
+        async with client.messages.stream(**kwargs, timeout=_attempt_timeout()) as stream:
             async for text in stream.text_stream:
                 yield text
 
@@ -224,7 +421,9 @@ async def _call_openai(
     max_tokens: int = 2048,
     temperature: float = 0.7,
     system_prompt: Optional[str] = None,
-    stream: bool = False
+    stream: bool = False,
+    partial: Optional[PartialOutput] = None,
+    prefill: Optional[str] = None
 ) -> Dict[str, Any]:
     """
     Call OpenAI API with retry logic.
@@ -236,6 +435,8 @@ async def _call_openai(
         temperature: Sampling temperature
         system_prompt: System prompt for context
         stream: Whether to stream (not used in non-streaming call)
+        partial: Collects the text as it is generated (the call is then streamed)
+        prefill: Earlier output, sent back with CONTINUE_INSTRUCTION to be continued
 
     Returns:
         Dict with response data
@@ -243,13 +444,23 @@ async def _call_openai(
     if not settings.OPENAI_API_KEY:
         raise LLMAPIError("OPENAI_API_KEY not configured")
 
-    client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
+    # Imported here so only the configured provider's SDK is loaded
+    from openai import (
+        AsyncOpenAI, APIError as OpenAIAPIError, APITimeoutError as OpenAITimeoutError,
+        RateLimitError as OpenAIRateLimitError
+    )
+    import httpx
+
+    client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY, base_url=settings.OPENAI_BASE_URL)
     model = model or "gpt-4o-mini" #edjon perchè gpt-5-nano ha parametri diversi?
 
     messages = []
     if system_prompt:
         messages.append({"role": "system", "content": system_prompt})
     messages.append({"role": "user", "content": prompt})
+    if prefill:
+        messages.append({"role": "assistant", "content": prefill})
+        messages.append({"role": "user", "content": CONTINUE_INSTRUCTION})
 
     retry_count = 0
     max_retries = 3
@@ -258,22 +469,42 @@ async def _call_openai(
         try:
             logger.info(f"OpenAI API call attempt {retry_count + 1}")
 
-            response = await client.chat.completions.create(
-                model=model,
-                messages=messages,
-                max_tokens=max_tokens,
-                temperature=temperature
-            )
-
-            content = response.choices[0].message.content or ""
+            timeout = _attempt_timeout()
+            if partial is not None:
+                partial.reset()
+            with span("llm.attempt", KIND_CLIENT, **{
+                "gen_ai.system": "openai", "gen_ai.request.model": model, "llm.attempt": retry_count + 1
+            }) as attempt_span:
+                async with asyncio.timeout(timeout):
+                    if partial is not None:
+                        content, finish_reason, usage = await _collect_openai_stream(
+                            client, model, messages, max_tokens, temperature, timeout, partial
+                        )
+                    else:
+                        response = await client.chat.completions.create(
+                            model=model,
+                            messages=messages,
+                            max_tokens=max_tokens,
+                            temperature=temperature,
+                            timeout=timeout
+                        )
+                        content = response.choices[0].message.content or ""
+                        finish_reason = response.choices[0].finish_reason
+                        usage = response.usage
+                attempt_span.set_attributes({
+                    "gen_ai.usage.input_tokens": usage.prompt_tokens,
+                    "gen_ai.usage.output_tokens": usage.completion_tokens,
+                    "gen_ai.response.finish_reasons": finish_reason
+                })
 
             result = {
                 "provider": "openai",
                 "content": content,
                 "model": model,
-                "tokens_used": response.usage.total_tokens,
-                "input_tokens": response.usage.prompt_tokens,
-                "output_tokens": response.usage.completion_tokens
+                "tokens_used": usage.total_tokens,
+                "input_tokens": usage.prompt_tokens,
+                "output_tokens": usage.completion_tokens,
+                "truncated": finish_reason == "length"
             }
 
             logger.info(f"OpenAI API call successful. Tokens used: {result['tokens_used']}")
@@ -285,14 +516,60 @@ async def _call_openai(
                 logger.error(f"Rate limit exceeded after {max_retries} retries")
                 raise LLMRateLimitError(f"Rate limit exceeded: {str(e)}")
 
-            wait_time = 2 ** retry_count
-            logger.warning(f"Rate limit hit, waiting {wait_time}s before retry")
-            await asyncio.sleep(wait_time)
+            await _retry_backoff(2 ** retry_count)
+
+        except (TimeoutError, OpenAITimeoutError):
+            raise _timeout_error(timeout)
+
+        except httpx.TransportError as e:
+            # Not wrapped by the SDK when a streamed response breaks off
+            logger.error(f"OpenAI stream interrupted: {str(e)}")
+            raise LLMAPIError(f"OpenAI API error: stream interrupted: {str(e)}")
 
         except OpenAIAPIError as e:
             logger.error(f"OpenAI API error: {str(e)}")
             raise LLMAPIError(f"OpenAI API error: {str(e)}")
 
+async def _collect_openai_stream(
+    client: Any,
+    model: str,
+    messages: List[Dict[str, str]],
+    max_tokens: int,
+    temperature: float,
+    timeout: float,
+    partial: PartialOutput
+) -> Tuple[str, Optional[str], Any]:
+    """Stream a chat completion into partial; returns (content, finish reason, usage)."""
+    from openai.types import CompletionUsage
+
+    stream = await client.chat.completions.create(
+        model=model,
+        messages=messages,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        stream=True,
+        stream_options={"include_usage": True},
+        timeout=timeout
+    )
+    finish_reason = None
+    usage = None
+    # partial.text also holds what earlier calls are continued from
+    parts = []
+    async for chunk in stream:
+        if chunk.usage is not None:
+            usage = chunk.usage
+        if chunk.choices:
+            if chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+                partial.append(chunk.choices[0].delta.content)
+            finish_reason = chunk.choices[0].finish_reason or finish_reason
+    content = "".join(parts)
+    if usage is None:
+        # Endpoints that ignore stream_options send no usage: estimate the output
+        output_tokens = len(content) // 4
+        usage = CompletionUsage(prompt_tokens=0, completion_tokens=output_tokens, total_tokens=output_tokens)
+    return content, finish_reason, usage
+
 async def _stream_openai(
     prompt: str,
     model: Optional[str] = None,
@@ -306,7 +583,10 @@ async def _stream_openai(
     if not settings.OPENAI_API_KEY:
         raise LLMAPIError("OPENAI_API_KEY not configured")
 
-    client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
+    # Imported here so only the configured provider's SDK is loaded
+    from openai import AsyncOpenAI, APIError as OpenAIAPIError, RateLimitError as OpenAIRateLimitError
+
+    client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY, base_url=settings.OPENAI_BASE_URL)
     model = model or "gpt-4o-mini"
 
     messages = []
@@ -320,11 +600,12 @@ async def _stream_openai(
             messages=messages,
             max_tokens=max_tokens,
             temperature=temperature,
-            stream=True
+            stream=True,
+            timeout=_attempt_timeout()
         )
 
         async for chunk in stream:
-            if chunk.choices[0].delta.content:
+            if chunk.choices and chunk.choices[0].delta.content:
                 yield chunk.choices[0].delta.content
 
     except OpenAIRateLimitError as e:
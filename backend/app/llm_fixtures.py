@@ -0,0 +1,236 @@
+"""
+Record/replay of LLM calls as on-disk fixtures.
+
+With LLM_FIXTURE_MODE=record, call_llm and call_llm_stream reach the provider
+as usual and every request is stored with its outcome (result or error) and
+timing; for streams, the arrival offset of each chunk. With
+LLM_FIXTURE_MODE=replay the provider is not contacted: recorded outcomes are
+served back after the recorded delays, multiplied by LLM_FIXTURE_TIME_SCALE.
+Blueprint and report generation can then be benchmarked offline against the
+exact workload and latency profile of a captured run.
+
+Fixtures are keyed by a hash of everything that determines the response
+(provider, model, prompts, max_tokens, temperature, streaming). Each key has
+one gzip file under LLM_FIXTURE_DIR with a JSON line per recorded call, each
+appended as its own gzip member in a single write so several workers can
+record at once. A request recorded several times is replayed round-robin,
+keeping the spread of latencies it had.
+"""
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from app.config import settings
+from app.llm import LLMAPIError, LLMDeadlineExceeded, LLMError, LLMRateLimitError
+from app.metrics import llm_fixture_requests_total
+
+logger = logging.getLogger(__name__)
+
+FIXTURE_VERSION = 1
+
+class FixtureNotFoundError(LLMAPIError):
+    """Raised when replaying a request that was never recorded"""
+    pass
+
+# Recorded errors are raised again as the same type
+ERROR_TYPES = {error.__name__: error for error in (LLMError, LLMAPIError, LLMRateLimitError)}
+
+class FixtureStore:
+    """Fixture files in a directory, with replay cursors per key."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._records: Dict[str, List[Dict[str, Any]]] = {}
+        self._cursors: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.jsonl.gz")
+
+    def append(self, key: str, record: Dict[str, Any]) -> None:
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+        with open(path, "ab") as f:
+            f.write(gzip.compress(line.encode("utf-8")))
+
+    def next(self, key: str) -> Optional[Dict[str, Any]]:
+        """The next recorded call for a key, cycling through its records; None if there is none."""
+        with self._lock:
+            records = self._records.get(key)
+            if records is None:
+                try:
+                    with gzip.open(self.path(key), "rt", encoding="utf-8") as f:
+                        records = [json.loads(line) for line in f if line.strip()]
+                except FileNotFoundError:
+                    records = []
+                self._records[key] = records
+            if not records:
+                return None
+            index = self._cursors.get(key, 0)
+            self._cursors[key] = index + 1
+            return records[index % len(records)]
+
+_store: Optional[FixtureStore] = None
+
+def get_fixture_store() -> FixtureStore:
+    global _store
+    if _store is None or _store.directory != settings.LLM_FIXTURE_DIR:
+        _store = FixtureStore(settings.LLM_FIXTURE_DIR)
+    return _store
+
+def llm_request(
+    kind: str,
+    prompt: str,
+    model: Optional[str],
+    max_tokens: int,
+    temperature: float,
+    system_prompt: Optional[str],
+    prefill: Optional[str] = None
+) -> Dict[str, Any]:
+    """The parts of an LLM call that determine its response ("call" or "stream")."""
+    request = {
+        "kind": kind,
+        "provider": settings.LLM_PROVIDER,
+        "model": model,
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+        "system_prompt": system_prompt,
+        "prompt": prompt,
+    }
+    if prefill:
+        # Only continuations carry it, so the keys of earlier recordings stay valid
+        request["prefill"] = prefill
+    return request
+
+def fixture_key(request: Dict[str, Any]) -> str:
+    canonical = json.dumps(request, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def _record(key: str, request: Dict[str, Any], latency: float, **outcome: Any) -> None:
+    record = {
+        "version": FIXTURE_VERSION,
+        "recorded_at": datetime.now(timezone.utc).isoformat(),
+        "request": request,
+        "latency": round(latency, 4),
+        **outcome,
+    }
+    try:
+        get_fixture_store().append(key, record)
+        llm_fixture_requests_total.inc(mode="record", result="recorded")
+    except OSError as e:
+        logger.warning(f"Could not record LLM fixture {key[:12]}: {str(e)}")
+
+def _error_record(error: LLMError) -> Dict[str, str]:
+    return {"type": type(error).__name__, "message": str(error)}
+
+def _replayed_error(record: Dict[str, str]) -> LLMError:
+    return ERROR_TYPES.get(record["type"], LLMAPIError)(record["message"])
+
+def _replay_record(key: str) -> Optional[Dict[str, Any]]:
+    """The recorded call to replay, or None to call the provider; raises if missing and required."""
+    record = get_fixture_store().next(key)
+    if record is not None:
+        llm_fixture_requests_total.inc(mode="replay", result="hit")
+        return record
+
+    llm_fixture_requests_total.inc(mode="replay", result="miss")
+    if settings.LLM_FIXTURE_ON_MISS == "error":
+        raise FixtureNotFoundError(f"No LLM fixture recorded for request {key[:12]}")
+    logger.warning(f"No LLM fixture recorded for request {key[:12]}, calling the provider")
+    return None
+
+async def fixture_call(
+    request: Dict[str, Any],
+    call: Callable[[], Awaitable[Dict[str, Any]]]
+) -> Dict[str, Any]:
+    """
+    Run a non-streaming LLM call through the fixture layer.
+
+    Args:
+        request: Request description from llm_request
+        call: Performs the call against the provider
+
+    Returns:
+        The provider's (or the recorded) result
+
+    Raises:
+        LLMError: The provider's (or the recorded) error
+        FixtureNotFoundError: When replaying a request that was never recorded
+    """
+    key = fixture_key(request)
+    if settings.LLM_FIXTURE_MODE == "replay":
+        record = _replay_record(key)
+        if record is None:
+            return await call()
+        await asyncio.sleep(record["latency"] * settings.LLM_FIXTURE_TIME_SCALE)
+        if "error" in record:
+            raise _replayed_error(record["error"])
+        return dict(record["result"])
+
+    start = time.perf_counter()
+    try:
+        result = await call()
+    except LLMDeadlineExceeded:
+        # The request ran out of time; the provider's response is unknown
+        raise
+    except LLMError as e:
+        _record(key, request, time.perf_counter() - start, error=_error_record(e))
+        raise
+    _record(key, request, time.perf_counter() - start, result=result)
+    return result
+
+async def fixture_stream(
+    request: Dict[str, Any],
+    stream: Callable[[], AsyncIterator[str]]
+) -> AsyncIterator[str]:
+    """
+    Run a streaming LLM call through the fixture layer.
+
+    Args:
+        request: Request description from llm_request
+        stream: Starts the stream from the provider
+
+    Yields:
+        str: Chunks of generated text, replayed at their recorded offsets
+
+    Raises:
+        LLMError: The provider's (or the recorded) error, after the chunks sent before it
+        FixtureNotFoundError: When replaying a request that was never recorded
+    """
+    key = fixture_key(request)
+    if settings.LLM_FIXTURE_MODE == "replay":
+        record = _replay_record(key)
+        if record is None:
+            async for text in stream():
+                yield text
+            return
+        start = time.monotonic()
+        for offset, text in record["chunks"]:
+            delay = start + offset * settings.LLM_FIXTURE_TIME_SCALE - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield text
+        if "error" in record:
+            raise _replayed_error(record["error"])
+        return
+
+    start = time.perf_counter()
+    chunks: List[List[Any]] = []
+    try:
+        async for text in stream():
+            chunks.append([round(time.perf_counter() - start, 4), text])
+            yield text
+    except LLMDeadlineExceeded:
+        raise
+    except LLMError as e:
+        _record(key, request, time.perf_counter() - start, chunks=chunks, error=_error_record(e))
+        raise
+    _record(key, request, time.perf_counter() - start, chunks=chunks)
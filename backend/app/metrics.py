@@ -0,0 +1,193 @@
+"""
+In-process metrics exposed in the Prometheus text format at /api/metrics.
+
+Counters and gauges are kept per process; in a multi-worker deployment each
+worker reports its own values and the scraper aggregates them.
+"""
+import threading
+from typing import Dict, List, Tuple
+
+LabelValues = Tuple[str, ...]
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def collect(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        if not items and not self.labels:
+            items = [((), 0.0)]
+        for key, value in items:
+            label_text = ",".join(
+                f'{label}="{_escape(v)}"' for label, v in zip(self.labels, key)
+            )
+            suffix = f"{{{label_text}}}" if label_text else ""
+            lines.append(f"{self.name}{suffix} {value:g}")
+        return lines
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+_registry: List[_Metric] = []
+
+def render_metrics() -> str:
+    """All registered metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
+
+# HTTP traffic
+http_requests_total = Counter(
+    "http_requests_total", "HTTP requests handled", ("method", "route", "status")
+)
+http_request_duration_seconds_total = Counter(
+    "http_request_duration_seconds_total", "Total time spent handling HTTP requests", ("method", "route")
+)
+
+# Bandwidth: conditional GETs and compression
+http_not_modified_total = Counter("http_not_modified_total", "304 responses to conditional GETs", ("route",))
+http_not_modified_bytes_saved_total = Counter(
+    "http_not_modified_bytes_saved_total", "Estimated body bytes not sent thanks to 304 responses", ("route",)
+)
+http_response_uncompressed_bytes_total = Counter(
+    "http_response_uncompressed_bytes_total", "Compressible response bytes before compression", ("encoding",)
+)
+http_response_body_bytes_total = Counter(
+    "http_response_body_bytes_total", "Compressible response bytes sent", ("encoding",)
+)
+
+# Pre-serialized report fields
+serialized_fragment_requests_total = Counter(
+    "serialized_fragment_requests_total", "Serialized report blob lookups by outcome", ("result",)
+)
+
+# LLM call fixtures (record/replay)
+llm_fixture_requests_total = Counter(
+    "llm_fixture_requests_total", "LLM calls recorded or replayed as fixtures", ("mode", "result")
+)
+
+# Cancelled LLM work (client disconnect, cancel request or deadline)
+llm_cancellations_total = Counter(
+    "llm_cancellations_total", "LLM generations stopped before completion", ("route", "reason")
+)
+llm_cancelled_output_tokens_total = Counter(
+    "llm_cancelled_output_tokens_total", "Output tokens generated before cancellation (estimated)", ("route",)
+)
+llm_cancelled_tokens_saved_total = Counter(
+    "llm_cancelled_tokens_saved_total", "Output tokens not generated thanks to cancellation (max_tokens left, upper bound)", ("route",)
+)
+
+# Continuation of output cut off at max_tokens
+llm_continuations_total = Counter(
+    "llm_continuations_total", "Follow-up calls continuing output cut off at max_tokens", ("route",)
+)
+llm_truncated_outputs_total = Counter(
+    "llm_truncated_outputs_total", "Generations cut off at max_tokens by whether continuation completed them",
+    ("route", "outcome")
+)
+
+# LLM admission control
+llm_scheduler_queue_depth = Gauge("llm_scheduler_queue_depth", "LLM calls waiting for a slot", ("priority",))
+llm_scheduler_running = Gauge("llm_scheduler_running", "LLM calls holding a slot")
+llm_scheduler_admitted_total = Counter("llm_scheduler_admitted_total", "LLM calls given a slot", ("priority",))
+llm_scheduler_wait_seconds_total = Counter(
+    "llm_scheduler_wait_seconds_total", "Time LLM calls waited for a slot", ("priority",)
+)
+llm_scheduler_shed_total = Counter(
+    "llm_scheduler_shed_total", "LLM calls rejected with 503 because of the estimated queue wait", ("priority",)
+)
+
+# Pre-flight sizing of LLM calls
+llm_preflight_rejected_total = Counter(
+    "llm_preflight_rejected_total", "Generation requests rejected before any LLM call", ("route", "reason")
+)
+llm_token_estimate_ratio = Gauge(
+    "llm_token_estimate_ratio", "Provider input tokens per locally counted text piece", ("provider",)
+)
+
+# Model tier routing
+llm_routed_calls_total = Counter(
+    "llm_routed_calls_total", "LLM generations by task and the model tier that served them", ("task", "tier")
+)
+llm_tier_fallbacks_total = Counter(
+    "llm_tier_fallbacks_total", "LLM generations moved to a cheaper model tier", ("task", "reason")
+)
+
+# Idempotency keys
+idempotency_requests_total = Counter(
+    "idempotency_requests_total", "Requests carrying an Idempotency-Key by outcome", ("path", "result")
+)
+
+# Tracing
+tracing_traces_total = Counter("tracing_traces_total", "Recorded traces by export decision", ("decision",))
+tracing_spans_exported_total = Counter("tracing_spans_exported_total", "Spans exported")
+tracing_spans_dropped_total = Counter("tracing_spans_dropped_total", "Spans dropped (queue full or export failed)")
+
+# Sampling profiler
+profiles_captured_total = Counter("profiles_captured_total", "Sampling profiles taken", ("kind",))
+
+# Report status event channel
+events_published_total = Counter("report_events_published_total", "Report status events published")
+events_delivered_total = Counter("report_events_delivered_total", "Report status events written to streams")
+events_dropped_total = Counter("report_events_dropped_total", "Events dropped for slow stream consumers")
+event_streams_active = Gauge("report_event_streams_active", "Open report event streams")
+event_stream_heartbeats_total = Counter("report_event_stream_heartbeats_total", "Heartbeats sent on event streams")
+
+# Database connection pool
+db_pool_capacity = Gauge("db_pool_capacity", "Connections the pool may open (size + overflow)")
+db_pool_checked_out = Gauge("db_pool_checked_out", "Connections currently checked out of the pool")
+db_pool_checkouts_total = Counter("db_pool_checkouts_total", "Connections checked out of the pool")
+db_pool_checkout_wait_seconds_total = Counter(
+    "db_pool_checkout_wait_seconds_total", "Time spent waiting for (or opening) a pooled connection"
+)
+db_pool_timeouts_total = Counter("db_pool_timeouts_total", "Checkouts that gave up after DB_POOL_TIMEOUT")
+db_pool_connections_opened_total = Counter("db_pool_connections_opened_total", "New database connections opened")
+db_pool_invalidations_total = Counter(
+    "db_pool_invalidations_total", "Pooled connections discarded as stale or broken"
+)
+db_statement_timeouts_total = Counter("db_statement_timeouts_total", "Statements cancelled by statement_timeout")
+
+# User record cache
+user_cache_requests_total = Counter(
+    "user_cache_requests_total", "User cache lookups by outcome", ("lookup", "result")
+)
+user_cache_invalidations_total = Counter("user_cache_invalidations_total", "Users invalidated in the cache")
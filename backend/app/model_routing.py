@@ -0,0 +1,131 @@
+"""
+Routing of LLM calls to model tiers by task and load.
+
+LLM_TASK_TIERS maps each task to the tier that serves it:
+
+  - blueprint: structuring a report blueprint
+  - section:   writing the sections of a report
+  - repair:    rewriting the changed sections of an earlier report
+
+Pre-flight sizing picks the first model of that tier the call fits (see
+app/preflight.py), and the model of the next cheaper tier it also fits.
+
+A call moves to that cheaper, faster tier by itself when:
+
+  - the queue is loaded: its estimated wait for a slot reaches LLM_ECONOMY_LOAD
+    of its class's wait budget, so the backlog drains sooner instead of
+    growing to the point where calls are shed (see app/scheduler.py)
+  - the provider keeps rate limiting the model (LLMRateLimitError once its
+    retries are spent): the call is made again on the fallback model, which
+    has limits of its own
+
+The tier that served a report is stored on it (reports.model_tier), and
+benchmarks/tier_eval.py compares latency and cost per tier on recorded
+fixtures.
+"""
+import logging
+from dataclasses import replace
+from typing import Any, Dict, Optional
+
+from app.config import settings
+from app.continuation import call_llm_continued
+from app.llm import LLMRateLimitError, PartialOutput
+from app.metrics import llm_routed_calls_total, llm_tier_fallbacks_total
+from app.preflight import TIER_STANDARD, CallSizing
+from app.scheduler import llm_scheduler
+
+logger = logging.getLogger(__name__)
+
+TASK_BLUEPRINT = "blueprint"
+TASK_SECTION = "section"
+TASK_REPAIR = "repair"
+
+def task_tier(task: str) -> str:
+    """Tier the routing table (LLM_TASK_TIERS) assigns a task."""
+    return settings.LLM_TASK_TIERS.get(task, TIER_STANDARD)
+
+def _fall_back(sizing: CallSizing) -> CallSizing:
+    return replace(sizing, model=sizing.fallback.model, tier=sizing.fallback.name, fallback=None)
+
+def route_by_load(task: str, priority: str, user: Any, sizing: CallSizing) -> CallSizing:
+    """
+    The sizing to queue a call with: moved to its fallback tier when the queue is loaded.
+
+    Args:
+        task: TASK_BLUEPRINT, TASK_SECTION or TASK_REPAIR
+        priority: Scheduler priority class of the call
+        user: User id (or client address) the call is queued for
+        sizing: Pre-flight sizing of the call
+    """
+    if sizing.fallback is None or settings.LLM_ECONOMY_LOAD <= 0:
+        return sizing
+    load = llm_scheduler.load(priority, user, sizing.max_tokens)
+    if load < settings.LLM_ECONOMY_LOAD:
+        return sizing
+    llm_tier_fallbacks_total.inc(task=task, reason="load")
+    logger.info(
+        f"LLM queue at {load:.0%} of the {priority} wait budget: "
+        f"{task} call routed to {sizing.fallback.model} ({sizing.fallback.name} tier)"
+    )
+    return _fall_back(sizing)
+
+async def call_llm_routed(
+    task: str,
+    sizing: CallSizing,
+    prompt: str,
+    system_prompt: Optional[str] = None,
+    temperature: float = 0.7,
+    partial: Optional[PartialOutput] = None
+) -> Dict[str, Any]:
+    """
+    Make a sized call on its tier's model, falling back to the cheaper tier when rate limited.
+
+    Args:
+        task: TASK_BLUEPRINT, TASK_SECTION or TASK_REPAIR
+        sizing: Sizing of the call (from route_by_load)
+        prompt: The user prompt
+        system_prompt: Optional system prompt
+        temperature: Sampling temperature
+        partial: Collects the text as it is generated
+
+    Returns:
+        The call_llm_continued result
+
+    Raises:
+        LLMError: As call_llm_continued; LLMRateLimitError only when there is no
+            fallback or it is rate limited too
+    """
+    route = "blueprint" if task == TASK_BLUEPRINT else "report"
+    try:
+        result = await call_llm_continued(
+            prompt=prompt,
+            route=route,
+            model=sizing.model,
+            system_prompt=system_prompt,
+            max_tokens=sizing.max_tokens,
+            temperature=temperature,
+            partial=partial
+        )
+    except LLMRateLimitError as e:
+        if sizing.fallback is None:
+            raise
+        llm_tier_fallbacks_total.inc(task=task, reason="rate_limit")
+        logger.warning(
+            f"{sizing.tier.capitalize()} tier rate limited ({str(e)}); "
+            f"{task} call made again on {sizing.fallback.model}"
+        )
+        sizing = _fall_back(sizing)
+        if partial is not None:
+            # Start over: nothing generated by the rate limited model is kept
+            partial.carry("")
+        result = await call_llm_continued(
+            prompt=prompt,
+            route=route,
+            model=sizing.model,
+            system_prompt=system_prompt,
+            max_tokens=sizing.max_tokens,
+            temperature=temperature,
+            partial=partial
+        )
+    llm_routed_calls_total.inc(task=task, tier=sizing.tier)
+    return result
@@ -1,7 +1,10 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, JSON, Enum, Text, Float
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, JSON, Enum, Text, Float, LargeBinary, Index, UniqueConstraint
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import deferred
 from sqlalchemy.sql import func
 import enum
 
+from app.content_store import BlobField
 from app.database import Base
 
 class ReportStatus(str, enum.Enum):
@@ -9,6 +12,7 @@ class ReportStatus(str, enum.Enum):
     PROCESSING = "processing"
     COMPLETED = "completed"
     FAILED = "failed"
+    CANCELLED = "cancelled"
 
 class User(Base):
     __tablename__ = "users"
@@ -19,12 +23,34 @@ class User(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
+class ReportBatch(Base):
+    __tablename__ = "report_batches"
+
+    id = Column(Integer, primary_key=True, index=True)
+    provider = Column(String(50), nullable=False)
+    provider_batch_id = Column(String(255), nullable=True)
+    status = Column(String(20), nullable=False, default="submitted")
+    total = Column(Integer, nullable=False)
+
+    # Progress as last reported by the provider
+    provider_succeeded = Column(Integer, nullable=False, default=0)
+    provider_failed = Column(Integer, nullable=False, default=0)
+
+    # Deterministically rendered placeholders per report, inserted when results arrive
+    rendered_sections = Column(JSON, nullable=True)
+
+    error_message = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    completed_at = Column(DateTime(timezone=True), nullable=True)
+
 class Report(Base):
     __tablename__ = "reports"
 
     # Core identification
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    batch_id = Column(Integer, ForeignKey("report_batches.id"), nullable=True, index=True)
 
     # Report metadata
     report_type = Column(String(255), nullable=True)
@@ -34,14 +60,25 @@ class Report(Base):
     # Generation metadata
     llm_provider = Column(String(50), nullable=True)
     model_used = Column(String(100), nullable=True)
+    # Tier of model_used (see app/model_routing.py)
+    model_tier = Column(String(20), nullable=True)
     tokens_used = Column(Integer, nullable=True)
     generation_time = Column(Float, nullable=True)
+    # Rounds that continued output cut off at max_tokens (see app/continuation.py)
+    continuations = Column(JSON, nullable=True)
 
-    # Report content and structure
+    # Report content and structure (large fields live in content_blobs)
     form_selections = Column(JSON, nullable=True)
-    blueprint = Column(JSON, nullable=True)
-    prompt_used = Column(Text, nullable=True)
-    generated_content = Column(Text, nullable=True)
+    blueprint_hash = Column(String(64), nullable=True, index=True)
+    blueprint_size = Column(Integer, nullable=True)
+    prompt_hash = Column(String(64), nullable=True, index=True)
+    prompt_size = Column(Integer, nullable=True)
+    content_hash = Column(String(64), nullable=True, index=True)
+    content_size = Column(Integer, nullable=True)
+
+    blueprint = BlobField("blueprint", kind="json")
+    prompt_used = BlobField("prompt")
+    generated_content = BlobField("content")
 
     # Timestamps
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -49,3 +86,57 @@ class Report(Base):
 
     # Error handling
     error_message = Column(Text, nullable=True)
+
+    # Full-text search (PostgreSQL only; never loaded with the row)
+    search_vector = deferred(Column(Text().with_variant(TSVECTOR(), "postgresql"), nullable=True))
+
+    __table_args__ = (
+        Index("ix_reports_search_vector", "search_vector", postgresql_using="gin"),
+    )
+
+class ReportSection(Base):
+    __tablename__ = "report_sections"
+
+    id = Column(Integer, primary_key=True, index=True)
+    report_id = Column(Integer, ForeignKey("reports.id", ondelete="CASCADE"), nullable=False, index=True)
+    section_id = Column(String(255), nullable=False)
+    position = Column(Integer, nullable=False)
+
+    # Hash of the section subtree and its generation inputs
+    unit_hash = Column(String(64), nullable=False, index=True)
+
+    content_hash = Column(String(64), nullable=True, index=True)
+    content_size = Column(Integer, nullable=True)
+    content = BlobField("content")
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class ContentBlob(Base):
+    __tablename__ = "content_blobs"
+
+    hash = Column(String(64), primary_key=True)
+    size = Column(Integer, nullable=False)
+    codec = Column(String(16), nullable=False)
+    data = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    id = Column(Integer, primary_key=True, index=True)
+    key = Column(String(255), nullable=False)
+    path = Column(String(255), nullable=False)
+    request_hash = Column(String(64), nullable=False)
+    status = Column(String(20), nullable=False, default="processing")
+
+    # Response replayed to duplicates once the first request is done
+    response_status = Column(Integer, nullable=True)
+    response_headers = Column(JSON, nullable=True)  # [name, value] pairs, hop-by-hop headers left out
+    response_body = Column(LargeBinary, nullable=True)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+    __table_args__ = (
+        UniqueConstraint("key", "path", name="uq_idempotency_keys_key_path"),
+    )
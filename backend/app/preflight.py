@@ -0,0 +1,374 @@
+"""
+Pre-flight sizing of LLM calls.
+
+Before a generation spends anything, its prompt is measured in tokens and its
+output budget is sized from the request, so a call asks for the max_tokens it
+needs rather than a flat 8000 (providers reserve rate limit capacity, and the
+scheduler queues calls, by max_tokens), and a request no model can serve is
+rejected up front.
+
+Input tokens are estimated locally, without a tokenizer: words (long words as
+several pieces), numbers and runs of punctuation are counted and scaled by a
+per-provider ratio. The ratio starts from typical English prose and follows
+the input token counts the provider reports back (record_input_tokens).
+
+A report's output budget adds up each section's estimatedLength ("300-500
+words", "2 paragraphs", "1 page", ...) or a default for its type, plus a
+margin for markdown and section markers. A blueprint's is sized from the
+number of data points it has to cover.
+
+MODEL_TIERS lists each provider's models by tier (standard, then the cheaper
+and faster economy tier), in order of preference, with their context window,
+output limit and price. A call is served by the first model of its task's tier
+(see app/model_routing.py) the prompt and the budget fit, or of a more capable
+tier when none does; the first fitting model of the next cheaper tier is kept
+as its fallback. A report whose budget exceeds REPORT_MAX_OUTPUT_TOKENS is
+rejected with groups of top-level sections that would fit, to generate as
+separate reports.
+"""
+import logging
+import math
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from app.config import settings
+from app.metrics import llm_preflight_rejected_total, llm_token_estimate_ratio
+from app.rendering import RenderedSection
+from app.schemas import Blueprint, BlueprintSection, SectionTypeEnum
+
+logger = logging.getLogger(__name__)
+
+TIER_STANDARD = "standard"
+TIER_ECONOMY = "economy"
+# Most capable first; a call falls back to the tier after its own
+TIER_ORDER = (TIER_STANDARD, TIER_ECONOMY)
+
+@dataclass(frozen=True)
+class ModelTier:
+    name: str
+    model: str
+    context_window: int
+    max_output_tokens: int
+    # USD per million tokens
+    input_cost: float
+    output_cost: float
+
+    def cost(self, input_tokens: int, output_tokens: int) -> float:
+        """Price of a call in USD."""
+        return (input_tokens * self.input_cost + output_tokens * self.output_cost) / 1_000_000
+
+# By tier, in order of preference; the first model is the provider's default in app/llm.py
+MODEL_TIERS = {
+    "anthropic": [
+        ModelTier(TIER_STANDARD, "claude-3-5-sonnet-20241022", 200_000, 8_192, 3.0, 15.0),
+        ModelTier(TIER_STANDARD, "claude-sonnet-4-20250514", 200_000, 64_000, 3.0, 15.0),
+        ModelTier(TIER_ECONOMY, "claude-3-5-haiku-20241022", 200_000, 8_192, 0.8, 4.0),
+    ],
+    "openai": [
+        ModelTier(TIER_STANDARD, "gpt-4o-mini", 128_000, 16_384, 0.15, 0.6),
+        ModelTier(TIER_STANDARD, "gpt-4.1-mini", 1_047_576, 32_768, 0.4, 1.6),
+        ModelTier(TIER_ECONOMY, "gpt-4.1-nano", 1_047_576, 32_768, 0.1, 0.4),
+    ],
+}
+
+# Provider tokens per counted piece, until corrected by reported usage
+INITIAL_TOKEN_RATIO = {"anthropic": 1.3, "openai": 1.15}
+TOKEN_RATIO_SMOOTHING = 0.1
+# Role markers and message framing
+MESSAGE_OVERHEAD_TOKENS = 10
+# Longest word counted as a single piece; longer ones count one piece per this many characters
+WORD_PIECE_CHARS = 6
+PUNCTUATION_RUN_CHARS = 8
+
+# Generated markdown, per word of prose
+TOKENS_PER_WORD = 1.35
+WORDS_PER_UNIT = {
+    "word": 1, "page": 500, "paragraph": 120, "sentence": 20, "bullet": 15, "point": 15,
+}
+WORDS_PER_QUALITATIVE_LENGTH = {
+    "short": 100, "brief": 100, "medium": 250, "moderate": 250, "long": 500, "detailed": 500,
+    "comprehensive": 600, "extensive": 700,
+}
+# Output tokens of a section without a usable estimatedLength
+DEFAULT_SECTION_TOKENS = {
+    SectionTypeEnum.TITLE: 20,
+    SectionTypeEnum.SUBTITLE: 25,
+    SectionTypeEnum.SECTION: 40,
+    SectionTypeEnum.PARAGRAPH: 270,
+    SectionTypeEnum.IMAGE_PLACEHOLDER: 100,
+    SectionTypeEnum.TABLE_PLACEHOLDER: 300,
+}
+# A placeholder rendered ahead of time: the LLM only places its marker
+RENDERED_SECTION_TOKENS = 20
+# Section marker and heading of each top-level unit
+UNIT_OVERHEAD_TOKENS = 30
+OUTPUT_MARGIN = 1.2
+MIN_REPORT_MAX_TOKENS = 1024
+
+# Blueprint JSON: fixed sections (title, summary, conclusions) and sections per data point
+BLUEPRINT_BASE_SECTIONS = 8
+BLUEPRINT_SECTIONS_PER_DATA_POINT = 5
+BLUEPRINT_TOKENS_PER_SECTION = 110
+MIN_BLUEPRINT_MAX_TOKENS = 2000
+
+_PIECE_PATTERN = re.compile(r"[^\W\d_]+|\d+|([^\w\s])\1*|_+")
+_LENGTH_RANGE = re.compile(r"(\d[\d,]*(?:\.\d+)?)(?:\s*(?:-|–|to)\s*(\d[\d,]*(?:\.\d+)?))?")
+_token_ratio: Dict[str, float] = dict(INITIAL_TOKEN_RATIO)
+
+class PreflightError(Exception):
+    """Raised when a request cannot be served by any model within the configured limits"""
+
+    def __init__(self, message: str, parts: Optional[List[List[str]]] = None):
+        super().__init__(message)
+        self.parts = parts
+
+@dataclass
+class CallSizing:
+    # None: the provider's default model (the first tier)
+    model: Optional[str]
+    input_tokens: int
+    max_tokens: int
+    # Counted before scaling, for calibration against reported usage
+    pieces: int
+    tier: str = TIER_STANDARD
+    # Model of the next cheaper tier the call also fits
+    fallback: Optional[ModelTier] = None
+
+def count_pieces(text: str) -> int:
+    """Tokenizer-independent size of a text: words, numbers and punctuation runs."""
+    pieces = 0
+    for match in _PIECE_PATTERN.finditer(text):
+        piece = match.group(0)
+        if piece[0].isalpha():
+            pieces += math.ceil(len(piece) / WORD_PIECE_CHARS)
+        elif piece[0].isdigit():
+            # Numbers are split into groups of up to three digits
+            pieces += math.ceil(len(piece) / 3)
+        else:
+            pieces += math.ceil(len(piece) / PUNCTUATION_RUN_CHARS)
+    return pieces
+
+def estimate_tokens(pieces: int, provider: Optional[str] = None) -> int:
+    """Provider tokens for a number of counted pieces."""
+    ratio = _token_ratio.get(provider or settings.LLM_PROVIDER, 1.0)
+    return math.ceil(pieces * ratio)
+
+def record_input_tokens(sizing: "CallSizing", result: Dict[str, Any]) -> None:
+    """
+    Correct the provider's token ratio with the input tokens it reported for a sized call.
+
+    Continued calls are skipped: their input tokens cover several rounds.
+    """
+    provider = result.get("provider")
+    input_tokens = result.get("input_tokens")
+    if not input_tokens or result.get("continuations") or sizing.pieces <= 0 or provider not in _token_ratio:
+        return
+    observed = max(input_tokens - MESSAGE_OVERHEAD_TOKENS, 1) / sizing.pieces
+    _token_ratio[provider] += TOKEN_RATIO_SMOOTHING * (observed - _token_ratio[provider])
+    llm_token_estimate_ratio.set(_token_ratio[provider], provider=provider)
+
+def parse_estimated_length(value: Optional[str]) -> Optional[int]:
+    """
+    Output tokens of an estimatedLength such as "300-500 words", "2 paragraphs" or "short".
+
+    Ranges count at their upper end. Returns None when nothing can be made of the value.
+    """
+    if not value:
+        return None
+    text = value.lower()
+    match = _LENGTH_RANGE.search(text)
+    if match is None:
+        for word, words in WORDS_PER_QUALITATIVE_LENGTH.items():
+            if word in text:
+                return math.ceil(words * TOKENS_PER_WORD)
+        return None
+
+    amount = float((match.group(2) or match.group(1)).replace(",", ""))
+    unit = text[match.end():]
+    if re.match(r"\s*tokens?\b", unit):
+        return math.ceil(amount)
+    if re.match(r"\s*(?:characters?|chars?)\b", unit):
+        return math.ceil(amount / 4)
+    words_per_unit = 1
+    for name, words in WORDS_PER_UNIT.items():
+        if re.match(rf"\s*{name}s?\b", unit):
+            words_per_unit = words
+            break
+    return math.ceil(amount * words_per_unit * TOKENS_PER_WORD)
+
+def _section_tokens(section: BlueprintSection, rendered: Dict[str, RenderedSection], has_children: bool) -> int:
+    if section.id in rendered:
+        return RENDERED_SECTION_TOKENS
+    estimated = parse_estimated_length(section.metadata.estimatedLength)
+    if estimated is not None:
+        return estimated
+    if section.type == SectionTypeEnum.SECTION and not has_children:
+        # A heading with nothing under it gets its text written directly
+        return DEFAULT_SECTION_TOKENS[SectionTypeEnum.PARAGRAPH]
+    return DEFAULT_SECTION_TOKENS.get(section.type, DEFAULT_SECTION_TOKENS[SectionTypeEnum.PARAGRAPH])
+
+def unit_output_tokens(
+    blueprint: Blueprint,
+    rendered: Optional[Dict[str, RenderedSection]] = None
+) -> Dict[str, int]:
+    """Estimated output tokens of each top-level unit (the section and its subtree), keyed by section id."""
+    rendered = rendered or {}
+    children: Dict[Optional[str], List[BlueprintSection]] = {}
+    for section in blueprint.sections:
+        children.setdefault(section.parentId, []).append(section)
+
+    def subtree_tokens(section: BlueprintSection, seen: Set[str]) -> int:
+        seen.add(section.id)
+        kids = [child for child in children.get(section.id, []) if child.id not in seen]
+        own = _section_tokens(section, rendered, bool(kids))
+        return own + sum(subtree_tokens(child, seen) for child in kids)
+
+    seen: Set[str] = set()
+    return {
+        section.id: subtree_tokens(section, seen) + UNIT_OVERHEAD_TOKENS
+        for section in sorted(children.get(None, []), key=lambda s: s.order)
+    }
+
+def _budget(estimated: int) -> int:
+    return max(MIN_REPORT_MAX_TOKENS, math.ceil(estimated * OUTPUT_MARGIN))
+
+def _split(unit_tokens: Dict[str, int], limit: int) -> List[List[str]]:
+    """Consecutive top-level sections grouped so each group's budget fits the limit."""
+    parts: List[List[str]] = []
+    current: List[str] = []
+    current_tokens = 0
+    for section_id, tokens in unit_tokens.items():
+        if current and _budget(current_tokens + tokens) > limit:
+            parts.append(current)
+            current, current_tokens = [], 0
+        current.append(section_id)
+        current_tokens += tokens
+    if current:
+        parts.append(current)
+    return parts
+
+def choose_tier(
+    input_tokens: int,
+    max_tokens: int,
+    provider: Optional[str] = None,
+    name: Optional[str] = None
+) -> Optional[ModelTier]:
+    """First model (of the named tier) whose context window holds the call and output limit allows max_tokens."""
+    for tier in MODEL_TIERS.get(provider or settings.LLM_PROVIDER, []):
+        if name is not None and tier.name != name:
+            continue
+        if max_tokens <= tier.max_output_tokens and input_tokens + max_tokens <= tier.context_window:
+            return tier
+    return None
+
+def tier_of_model(provider: Optional[str], model: Optional[str]) -> Optional[ModelTier]:
+    """The tier entry of a model, also when named with a version suffix (as batch results name it)."""
+    for tier in MODEL_TIERS.get(provider or "", []):
+        if model and (model == tier.model or model.startswith(f"{tier.model}-")):
+            return tier
+    return None
+
+def _size_call(
+    route: str,
+    prompt: str,
+    system_prompt: Optional[str],
+    max_tokens: int,
+    tier_name: str
+) -> CallSizing:
+    provider = settings.LLM_PROVIDER
+    pieces = count_pieces(prompt) + count_pieces(system_prompt or "")
+    input_tokens = estimate_tokens(pieces, provider) + MESSAGE_OVERHEAD_TOKENS
+    if input_tokens > settings.PREFLIGHT_MAX_INPUT_TOKENS:
+        llm_preflight_rejected_total.inc(route=route, reason="input")
+        raise PreflightError(
+            f"Prompt too large: about {input_tokens} tokens, at most {settings.PREFLIGHT_MAX_INPUT_TOKENS}"
+        )
+
+    tiers = MODEL_TIERS.get(provider, [])
+    tier = choose_tier(input_tokens, max_tokens, provider, tier_name)
+    if tier is None:
+        # Too large for its own tier: served by the most capable one that fits
+        tier = choose_tier(input_tokens, max_tokens, provider)
+    if tier is None:
+        llm_preflight_rejected_total.inc(route=route, reason="context")
+        raise PreflightError(
+            f"No {provider} model fits about {input_tokens} input and {max_tokens} output tokens"
+        )
+    fallback = None
+    for name in TIER_ORDER[TIER_ORDER.index(tier.name) + 1:]:
+        fallback = choose_tier(input_tokens, max_tokens, provider, name)
+        if fallback is not None:
+            break
+    model = None if tiers and tier == tiers[0] else tier.model
+    logger.info(
+        f"Pre-flight {route}: ~{input_tokens} input tokens, max_tokens {max_tokens}, "
+        f"model {tier.model} ({tier.name} tier)"
+    )
+    return CallSizing(
+        model=model,
+        input_tokens=input_tokens,
+        max_tokens=max_tokens,
+        pieces=pieces,
+        tier=tier.name,
+        fallback=fallback
+    )
+
+def size_report_call(
+    blueprint: Blueprint,
+    prompt: str,
+    system_prompt: Optional[str],
+    rendered: Optional[Dict[str, RenderedSection]] = None,
+    section_ids: Optional[Iterable[str]] = None,
+    tier: str = TIER_STANDARD
+) -> CallSizing:
+    """
+    Size a report generation call before anything is spent on it.
+
+    Args:
+        blueprint: Report blueprint
+        prompt: Prompt built from it
+        system_prompt: System prompt of the call
+        rendered: Rendered placeholder sections (only their marker is generated)
+        section_ids: Top-level sections being generated, when only some are
+        tier: Tier the task is routed to (model_routing.task_tier)
+
+    Returns:
+        Model (None for the default one) and its tier, the fallback model,
+        estimated input tokens and max_tokens
+
+    Raises:
+        PreflightError: If the prompt or the output budget is too large; for the
+            latter, parts lists top-level section ids to generate separately
+    """
+    unit_tokens = unit_output_tokens(blueprint, rendered)
+    if section_ids is not None:
+        wanted = set(section_ids)
+        unit_tokens = {section_id: tokens for section_id, tokens in unit_tokens.items() if section_id in wanted}
+    max_tokens = _budget(sum(unit_tokens.values()))
+
+    if max_tokens > settings.REPORT_MAX_OUTPUT_TOKENS:
+        llm_preflight_rejected_total.inc(route="report", reason="output")
+        raise PreflightError(
+            f"Blueprint too large: about {max_tokens} output tokens, at most "
+            f"{settings.REPORT_MAX_OUTPUT_TOKENS} per report; generate its sections as separate reports",
+            parts=_split(unit_tokens, settings.REPORT_MAX_OUTPUT_TOKENS)
+        )
+    return _size_call("report", prompt, system_prompt, max_tokens, tier)
+
+def size_blueprint_call(
+    data_points: int,
+    prompt: str,
+    system_prompt: Optional[str],
+    tier: str = TIER_STANDARD
+) -> CallSizing:
+    """
+    Size a blueprint generation call from the number of data points it covers.
+
+    Raises:
+        PreflightError: If the prompt is too large
+    """
+    sections = BLUEPRINT_BASE_SECTIONS + BLUEPRINT_SECTIONS_PER_DATA_POINT * data_points
+    estimated = math.ceil(sections * BLUEPRINT_TOKENS_PER_SECTION * OUTPUT_MARGIN)
+    max_tokens = min(max(MIN_BLUEPRINT_MAX_TOKENS, estimated), settings.BLUEPRINT_MAX_OUTPUT_TOKENS)
+    return _size_call("blueprint", prompt, system_prompt, max_tokens, tier)
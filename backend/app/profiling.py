@@ -0,0 +1,271 @@
+"""
+On-demand sampling profiler for a live worker.
+
+A SamplingProfiler thread snapshots the stack of every other thread in the
+process (sys._current_frames) at a fixed interval and counts identical
+stacks. Nothing is instrumented, so the profiled code runs unmodified and the
+cost is the sampling thread itself; with the default 10ms interval that is a
+few percent of one core while a profile is being taken, and nothing otherwise.
+
+Profiles are wall-clock: a thread waiting on I/O is sampled like one doing
+work. Samples of threads idling in the event loop selector or waiting on a
+lock/queue are left out unless include_idle is set. Since the event loop runs
+every request of the worker, a profile (including a per-request one) shows all
+the work the worker did meanwhile, not only the request's.
+
+Output is either collapsed stacks ("thread;outer;...;leaf count" lines, for
+flamegraph.pl / speedscope / inferno) or a speedscope JSON document.
+
+Everything is off unless PROFILING_ENABLED is set and PROFILING_ADMIN_TOKEN
+is configured: the admin routes answer 404 and ProfilingMiddleware is not
+installed.
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+import secrets
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Any, Dict, Optional, Tuple
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.config import settings
+from app.metrics import profiles_captured_total
+
+logger = logging.getLogger(__name__)
+
+PROFILE_FORMATS = ("collapsed", "speedscope")
+PROFILE_ID = re.compile(r"^[0-9a-f]{32}$")
+
+# Leaf frames of threads that are waiting, not working
+IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+}
+
+Stack = Tuple[str, ...]
+
+class ProfilerBusyError(Exception):
+    """Raised when a profile is requested while another one is running in the worker"""
+    pass
+
+_profile_lock = threading.Lock()
+
+def profiling_enabled() -> bool:
+    return settings.PROFILING_ENABLED and bool(settings.PROFILING_ADMIN_TOKEN)
+
+def is_admin_token(token: Optional[str]) -> bool:
+    return profiling_enabled() and token is not None and secrets.compare_digest(token, settings.PROFILING_ADMIN_TOKEN)
+
+def _frame_label(code: Any) -> str:
+    filename = code.co_filename
+    # Shorten to the package path (site-packages/x/y.py -> x/y.py, backend/app/x.py -> app/x.py)
+    for marker in ("site-packages/", "dist-packages/", "/backend/"):
+        index = filename.rfind(marker)
+        if index != -1:
+            filename = filename[index + len(marker):]
+            break
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+class SamplingProfiler(threading.Thread):
+    """Samples the stacks of all other threads until stopped."""
+
+    def __init__(self, interval: float, include_idle: bool = False):
+        super().__init__(name="sampling-profiler", daemon=True)
+        self.interval = interval
+        self.include_idle = include_idle
+        self.counts: Counter = Counter()
+        self.samples = 0
+        self.started_at = 0.0
+        self.duration = 0.0
+        self._done = threading.Event()
+
+    def run(self) -> None:
+        own_id = threading.get_ident()
+        names: Dict[int, str] = {}
+        self.started_at = time.perf_counter()
+        while not self._done.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                code = frame.f_code
+                if not self.include_idle and (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                    continue
+                if thread_id not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, f"thread-{thread_id}"))
+                self.counts[tuple(reversed(stack))] += 1
+            self.samples += 1
+        self.duration = time.perf_counter() - self.started_at
+
+    def stop(self) -> None:
+        self._done.set()
+        self.join()
+
+def start_profiler(interval_ms: Optional[float] = None, include_idle: bool = False) -> SamplingProfiler:
+    """
+    Start sampling; one profile at a time per worker.
+
+    Raises:
+        ProfilerBusyError: If a profile is already running
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusyError("A profile is already running in this worker")
+    profiler = SamplingProfiler((interval_ms or settings.PROFILING_INTERVAL_MS) / 1000, include_idle)
+    profiler.start()
+    return profiler
+
+def stop_profiler(profiler: SamplingProfiler, kind: str) -> None:
+    try:
+        profiler.stop()
+    finally:
+        _profile_lock.release()
+    profiles_captured_total.inc(kind=kind)
+
+async def profile_worker(seconds: float, interval_ms: Optional[float] = None, include_idle: bool = False) -> SamplingProfiler:
+    """
+    Profile this worker for a number of seconds while it keeps serving requests.
+
+    Args:
+        seconds: Sampling duration (capped at PROFILING_MAX_SECONDS)
+        interval_ms: Sampling interval; defaults to PROFILING_INTERVAL_MS
+        include_idle: Keep samples of threads waiting in the selector or on locks
+
+    Returns:
+        The stopped profiler with its stack counts
+
+    Raises:
+        ProfilerBusyError: If a profile is already running
+    """
+    profiler = start_profiler(interval_ms, include_idle)
+    try:
+        await asyncio.sleep(min(seconds, settings.PROFILING_MAX_SECONDS))
+    finally:
+        await asyncio.to_thread(stop_profiler, profiler, "worker")
+    logger.info(f"Profiled worker {os.getpid()} for {profiler.duration:.1f}s ({profiler.samples} samples)")
+    return profiler
+
+def collapsed_stacks(profiler: SamplingProfiler) -> str:
+    """Collapsed stacks, one "frame;frame;...;frame count" line per distinct stack."""
+    lines = [
+        ";".join(frame.replace(";", ":") for frame in stack) + f" {count}"
+        for stack, count in profiler.counts.most_common()
+    ]
+    return "\n".join(lines) + "\n"
+
+def speedscope_profile(profiler: SamplingProfiler, name: str) -> Dict[str, Any]:
+    """A speedscope file (sampled profiles, one per thread; weights in milliseconds)."""
+    frames: list = []
+    frame_index: Dict[str, int] = {}
+    profiles: Dict[str, Dict[str, Any]] = {}
+    interval_ms = profiler.interval * 1000
+    for stack, count in profiler.counts.most_common():
+        thread, frames_in_stack = stack[0], stack[1:]
+        indexes = []
+        for frame in frames_in_stack:
+            if frame not in frame_index:
+                frame_index[frame] = len(frames)
+                frames.append({"name": frame})
+            indexes.append(frame_index[frame])
+        profile = profiles.setdefault(thread, {
+            "type": "sampled", "name": thread, "unit": "milliseconds",
+            "startValue": 0, "endValue": 0, "samples": [], "weights": [],
+        })
+        profile["samples"].append(indexes)
+        profile["weights"].append(count * interval_ms)
+        profile["endValue"] += count * interval_ms
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": name,
+        "exporter": "marketing-ai-api",
+        "shared": {"frames": frames},
+        "profiles": list(profiles.values()),
+    }
+
+def render_profile(profiler: SamplingProfiler, profile_format: str, name: str) -> Tuple[bytes, str]:
+    """The profile in the requested format, as (body, media type)."""
+    if profile_format == "speedscope":
+        return json.dumps(speedscope_profile(profiler, name)).encode("utf-8"), "application/json"
+    return collapsed_stacks(profiler).encode("utf-8"), "text/plain; charset=utf-8"
+
+def profile_path(profile_id: str, profile_format: str) -> str:
+    extension = "speedscope.json" if profile_format == "speedscope" else "collapsed.txt"
+    return os.path.join(settings.PROFILING_OUTPUT_DIR, f"{profile_id}.{extension}")
+
+def find_profile(profile_id: str) -> Optional[Tuple[str, str]]:
+    """(path, format) of a stored request profile; None if unknown."""
+    if not PROFILE_ID.match(profile_id):
+        return None
+    for profile_format in PROFILE_FORMATS:
+        path = profile_path(profile_id, profile_format)
+        if os.path.exists(path):
+            return path, profile_format
+    return None
+
+def _write_profile(profiler: SamplingProfiler, profile_id: str, profile_format: str, name: str) -> None:
+    body, _ = render_profile(profiler, profile_format, name)
+    os.makedirs(settings.PROFILING_OUTPUT_DIR, exist_ok=True)
+    with open(profile_path(profile_id, profile_format), "wb") as f:
+        f.write(body)
+
+class ProfilingMiddleware:
+    """
+    Profiles single requests sent with an X-Profile header (and the admin token).
+
+    X-Profile is "collapsed" or "speedscope" (anything else means collapsed).
+    The response carries an X-Profile-Id; the profile is stored in
+    PROFILING_OUTPUT_DIR once the response is complete and served by
+    GET /api/admin/profiles/{profile_id}. Only installed when profiling is enabled.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        requested = headers.get("x-profile")
+        if requested is None or not is_admin_token(headers.get("x-admin-token")):
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            profiler = start_profiler()
+        except ProfilerBusyError:
+            logger.warning(f"Profile of {scope['path']} skipped: another profile is running")
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = uuid.uuid4().hex
+        profile_format = requested if requested in PROFILE_FORMATS else "collapsed"
+
+        async def send_with_id(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message)["X-Profile-Id"] = profile_id
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            await asyncio.to_thread(stop_profiler, profiler, "request")
+            name = f"{scope['method']} {scope['path']}"
+            try:
+                await asyncio.to_thread(_write_profile, profiler, profile_id, profile_format, name)
+                logger.info(f"Profiled {name} in {profiler.duration * 1000:.0f}ms: profile {profile_id}")
+            except OSError as e:
+                logger.warning(f"Could not store profile {profile_id}: {str(e)}")
@@ -0,0 +1,299 @@
+"""
+Deterministic rendering of image_placeholder / table_placeholder sections.
+
+Placeholders that have tool/metrics data attached are filled here instead of
+by the LLM: tables become markdown tables and charts are rendered to image
+files in the shared process pool. The LLM only receives a marker to place
+in its narrative, which is swapped for the rendered block afterwards.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from app.config import settings
+from app.schemas import Blueprint, BlueprintSection, SectionData, SectionTypeEnum
+from app.tracing import traced
+from app.workers import run_in_process
+
+logger = logging.getLogger(__name__)
+
+RENDER_MARKER = "{{{{render:{section_id}}}}}"
+_MARKER_PATTERN = re.compile(r"\{\{render:([^}]+)\}\}")
+
+# Table markdown and chart URLs by data hash; chart files are additionally cached on disk
+_CACHE_MAX_ENTRIES = 512
+_render_cache: "OrderedDict[str, str]" = OrderedDict()
+
+@dataclass
+class RenderedSection:
+    section_id: str
+    kind: str  # "table" or "chart"
+    data_hash: str
+    markdown: str
+
+def data_hash(kind: str, data: SectionData, chart_type: Optional[str] = None) -> str:
+    """
+    Compute the cache key for a rendered section.
+
+    Args:
+        kind: "table" or "chart"
+        data: The section data being rendered
+        chart_type: Resolved chart type (charts only)
+
+    Returns:
+        Hex sha256 digest of the canonical render inputs
+    """
+    payload = {
+        "kind": kind,
+        "chart_type": chart_type,
+        "format": settings.RENDER_CHART_FORMAT if kind == "chart" else None,
+        "title": data.title,
+        "columns": data.columns,
+        "rows": data.rows,
+    }
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def resolve_chart_type(section: BlueprintSection, data: SectionData) -> str:
+    """Pick a chart type from the data or the section's visualization metadata."""
+    if data.chartType:
+        return data.chartType.lower()
+
+    hint = (section.metadata.visualizationType or section.content or "").lower()
+    if any(word in hint for word in ("line", "trend", "over time", "timeline")):
+        return "line"
+    if any(word in hint for word in ("pie", "share", "distribution", "breakdown")):
+        return "pie"
+    return "bar"
+
+def render_markdown_table(data: SectionData) -> str:
+    """Render section data as a markdown table."""
+    def cell(value: Any) -> str:
+        if value is None:
+            return ""
+        if isinstance(value, float):
+            value = f"{value:,.2f}".rstrip("0").rstrip(".")
+        return str(value).replace("|", "\\|").replace("\n", " ")
+
+    lines = []
+    if data.title:
+        lines.extend([f"**{cell(data.title)}**", ""])
+    lines.append("| " + " | ".join(cell(c) for c in data.columns) + " |")
+    lines.append("|" + "|".join(" --- " for _ in data.columns) + "|")
+    for row in data.rows:
+        padded = list(row) + [None] * (len(data.columns) - len(row))
+        lines.append("| " + " | ".join(cell(v) for v in padded[:len(data.columns)]) + " |")
+
+    return "\n".join(lines)
+
+def render_chart_file(
+    path: str,
+    chart_type: str,
+    image_format: str,
+    title: Optional[str],
+    columns: list[str],
+    rows: list[list[Any]],
+    salt: str
+) -> str:
+    """
+    Render a chart to disk. Runs inside a worker process.
+
+    The first column holds category labels and every remaining numeric column
+    is plotted as a series.
+
+    Returns:
+        The path the chart was written to
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    # Stable SVG element ids and no timestamps, so equal data gives equal bytes
+    plt.rcParams["svg.hashsalt"] = salt
+
+    labels = [str(row[0]) if row else "" for row in rows]
+    series = []
+    for col_idx, name in enumerate(columns[1:], start=1):
+        values = []
+        for row in rows:
+            try:
+                values.append(float(row[col_idx]))
+            except (IndexError, TypeError, ValueError):
+                values.append(0.0)
+        series.append((name, values))
+
+    fig, ax = plt.subplots(figsize=(8, 4.5), dpi=100)
+    try:
+        if chart_type == "pie" and series:
+            ax.pie(series[0][1], labels=labels, autopct="%1.1f%%", startangle=90)
+            ax.axis("equal")
+        elif chart_type == "line":
+            for name, values in series:
+                ax.plot(labels, values, marker="o", label=name)
+        else:
+            width = 0.8 / max(len(series), 1)
+            for idx, (name, values) in enumerate(series):
+                positions = [i + idx * width for i in range(len(labels))]
+                ax.bar(positions, values, width=width, label=name)
+            ax.set_xticks([i + width * (len(series) - 1) / 2 for i in range(len(labels))])
+            ax.set_xticklabels(labels)
+
+        if chart_type != "pie" and len(series) > 1:
+            ax.legend()
+        if title:
+            ax.set_title(title)
+        fig.tight_layout()
+
+        metadata = {"Date": None} if image_format == "svg" else {"Software": None}
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        fig.savefig(tmp_path, format=image_format, metadata=metadata)
+        os.replace(tmp_path, path)
+    finally:
+        plt.close(fig)
+
+    return path
+
+def chart_path(digest: str) -> str:
+    """Path of the cached chart file for a data hash."""
+    return os.path.join(settings.RENDER_CACHE_DIR, f"{digest}.{settings.RENDER_CHART_FORMAT}")
+
+def _cache_get(digest: str) -> Optional[str]:
+    value = _render_cache.get(digest)
+    if value is not None:
+        _render_cache.move_to_end(digest)
+    return value
+
+def _cache_put(digest: str, value: str) -> None:
+    _render_cache[digest] = value
+    _render_cache.move_to_end(digest)
+    while len(_render_cache) > _CACHE_MAX_ENTRIES:
+        _render_cache.popitem(last=False)
+
+def _find_section_data(
+    section: BlueprintSection,
+    section_data: Dict[str, SectionData]
+) -> Optional[SectionData]:
+    """Match data to a section by id first, then by its metadata.dataSource."""
+    if section.id in section_data:
+        return section_data[section.id]
+    if section.metadata.dataSource and section.metadata.dataSource in section_data:
+        return section_data[section.metadata.dataSource]
+    return None
+
+async def render_section(section: BlueprintSection, data: SectionData) -> RenderedSection:
+    """
+    Render a single placeholder section, using the data-hash cache.
+
+    Args:
+        section: The image or table placeholder section
+        data: Tool/metrics data for the section
+
+    Returns:
+        The rendered section with its markdown
+    """
+    if section.type == SectionTypeEnum.TABLE_PLACEHOLDER:
+        digest = data_hash("table", data)
+        markdown = _cache_get(digest)
+        if markdown is None:
+            # Tables are plain string formatting; a process hop would cost more than it saves
+            markdown = render_markdown_table(data)
+            _cache_put(digest, markdown)
+        return RenderedSection(section.id, "table", digest, markdown)
+
+    chart_type = resolve_chart_type(section, data)
+    digest = data_hash("chart", data, chart_type)
+    # Only the URL is cached: the caption may come from the section, which the hash does not cover
+    url = _cache_get(digest)
+    if url is None:
+        path = chart_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(settings.RENDER_CACHE_DIR, exist_ok=True)
+            await run_in_process(
+                render_chart_file,
+                path,
+                chart_type,
+                settings.RENDER_CHART_FORMAT,
+                data.title,
+                data.columns,
+                data.rows,
+                digest
+            )
+        url = f"{settings.PUBLIC_API_URL.rstrip('/')}/api/renders/{os.path.basename(path)}"
+        _cache_put(digest, url)
+    caption = (data.title or section.content).replace("]", "\\]")
+    return RenderedSection(section.id, "chart", digest, f"![{caption}]({url})")
+
+@traced("report.render_placeholders")
+async def render_placeholders(
+    blueprint: Blueprint,
+    section_data: Optional[Dict[str, SectionData]]
+) -> Dict[str, RenderedSection]:
+    """
+    Render every placeholder section of a blueprint that has data attached.
+
+    Sections without data are left to the LLM as before.
+
+    Args:
+        blueprint: The report blueprint
+        section_data: Tool/metrics data keyed by section id or dataSource
+
+    Returns:
+        Rendered sections keyed by section id
+    """
+    if not section_data:
+        return {}
+
+    rendered: Dict[str, RenderedSection] = {}
+    for section in blueprint.sections:
+        if section.type not in (SectionTypeEnum.IMAGE_PLACEHOLDER, SectionTypeEnum.TABLE_PLACEHOLDER):
+            continue
+        data = _find_section_data(section, section_data)
+        if data is None or not data.columns:
+            continue
+        try:
+            rendered[section.id] = await render_section(section, data)
+        except Exception as e:
+            # Fall back to letting the LLM handle this placeholder
+            logger.error(f"Rendering section {section.id} failed: {str(e)}")
+
+    logger.info(f"Rendered {len(rendered)} placeholder sections deterministically")
+    return rendered
+
+def insert_rendered_sections(content: str, rendered: Dict[str, RenderedSection]) -> str:
+    """
+    Replace render markers in generated content with the rendered markdown.
+
+    Rendered sections whose marker the LLM dropped are appended at the end so
+    no figure or table is lost.
+
+    Args:
+        content: Generated report markdown
+        rendered: Rendered sections keyed by section id
+
+    Returns:
+        Report markdown with all rendered sections in place
+    """
+    if not rendered:
+        return content
+
+    placed = set()
+
+    def replace(match: "re.Match[str]") -> str:
+        section_id = match.group(1).strip()
+        if section_id not in rendered:
+            return ""
+        placed.add(section_id)
+        return rendered[section_id].markdown
+
+    content = _MARKER_PATTERN.sub(replace, content)
+
+    missing = [r for section_id, r in rendered.items() if section_id not in placed]
+    if missing:
+        content = content.rstrip() + "\n\n## Figures and Tables\n\n" + "\n\n".join(r.markdown for r in missing) + "\n"
+
+    return content
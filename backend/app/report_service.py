@@ -0,0 +1,364 @@
+"""
+Report generation steps shared by the interactive and batch endpoints:
+prompt construction from a blueprint and recording the outcome on a Report.
+"""
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Set
+
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models import Report
+from app.preflight import tier_of_model
+from app.rendering import RENDER_MARKER, RenderedSection, insert_rendered_sections
+from app.schemas import Blueprint, BlueprintSection
+from app.search import index_report
+from app.sections import SECTION_MARKER, SectionPlan, section_units, store_report_sections, strip_section_markers
+from app.similarity import index_report_content
+from app.tracing import traced
+
+logger = logging.getLogger(__name__)
+
+def complete_report(
+    db: Session,
+    report: Report,
+    result: Dict[str, Any],
+    rendered: Optional[Dict[str, RenderedSection]],
+    generation_time: float
+) -> None:
+    """
+    Store a successful LLM result on a report and update the search indexes.
+
+    The content is split on its section markers and stored per section, so a
+    later regeneration can reuse unchanged sections. The caller commits.
+
+    Args:
+        db: Database session
+        report: Report being generated
+        result: call_llm result (content, provider, model, tokens_used, continuations)
+        rendered: Deterministically rendered placeholder sections
+        generation_time: Seconds spent generating
+    """
+    content = result['content']
+    units = section_units(Blueprint(**report.blueprint), rendered)
+    store_report_sections(db, report, units, content)
+
+    report.generated_content = insert_rendered_sections(strip_section_markers(content), rendered or {})
+    report.status = "completed"
+    report.error_message = None
+    report.llm_provider = result.get('provider')
+    report.model_used = result.get('model')
+    tier = tier_of_model(report.llm_provider, report.model_used)
+    report.model_tier = tier.name if tier else None
+    report.tokens_used = result.get('tokens_used')
+    report.generation_time = generation_time
+    report.continuations = result.get('continuations') or None
+    if result.get('truncated'):
+        # Kept, but flagged: the end of the report is missing
+        report.error_message = "Output was cut off at max_tokens"
+    index_report(db, report)
+    index_report_content(report)
+
+def fail_report(db: Session, report: Report, error: str) -> None:
+    """Mark a report as failed. The caller commits."""
+    report.status = "failed"
+    report.error_message = error
+
+# Interactive generations running in this process, failed on shutdown if still running
+generating_reports: Set[int] = set()
+
+INTERRUPTED_MESSAGE = "Generation interrupted by a server restart"
+
+def interrupt_generating_reports(db: Session) -> int:
+    """
+    Fail the reports this process is still generating; called on shutdown.
+
+    Their requests were cut off (graceful shutdown ran out of time), so
+    nothing else would ever take them out of 'processing'.
+
+    Returns:
+        Number of reports marked failed
+    """
+    if not generating_reports:
+        return 0
+    # Loaded rather than bulk-updated, so the status events reach subscribers
+    reports = db.query(Report).filter(
+        Report.id.in_(list(generating_reports)), Report.status == "processing"
+    ).all()
+    for report in reports:
+        fail_report(db, report, INTERRUPTED_MESSAGE)
+    db.commit()
+    generating_reports.clear()
+    return len(reports)
+
+def recover_interrupted_reports(db: Session) -> int:
+    """
+    Fail interactive reports left 'processing' by a worker that died; called on startup.
+
+    A report still 'processing' after the report deadline plus the LLM queue
+    wait budget cannot be running anywhere. Batch reports are left to their
+    poller.
+
+    Returns:
+        Number of reports marked failed
+    """
+    max_age = (settings.REPORT_DEADLINE_SECONDS or 3600) + settings.LLM_REPORT_MAX_WAIT
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=max_age)
+    reports = db.query(Report).filter(
+        Report.status == "processing",
+        Report.batch_id.is_(None),
+        Report.created_at < cutoff
+    ).all()
+    for report in reports:
+        fail_report(db, report, INTERRUPTED_MESSAGE)
+    db.commit()
+    return len(reports)
+
+def cancel_report(
+    db: Session,
+    report: Report,
+    partial_content: str,
+    rendered: Optional[Dict[str, RenderedSection]],
+    generation_time: float,
+    reason: str
+) -> None:
+    """
+    Mark a report as cancelled, keeping the content generated before it was stopped.
+
+    The partial content is not stored per section, so a regeneration based on
+    this report rewrites it in full. The caller commits.
+
+    Args:
+        db: Database session
+        report: Report being generated
+        partial_content: Marked-up LLM output received before the cancellation
+        rendered: Deterministically rendered placeholder sections
+        generation_time: Seconds spent generating
+        reason: Why generation stopped (client_disconnected, cancel_requested, deadline)
+    """
+    report.status = "cancelled"
+    report.error_message = f"Generation cancelled ({reason})"
+    report.generation_time = generation_time
+    if partial_content:
+        report.generated_content = insert_rendered_sections(strip_section_markers(partial_content), rendered or {})
+
+def build_report_generation_system_prompt() -> str:
+    """Build the system prompt for report content generation."""
+    return """You are an expert business analyst and report writer. Your role is to generate comprehensive,
+professional marketing and business reports based on structured blueprints.
+
+Your reports should:
+- Be well-researched and data-driven (use realistic example data when actual data isn't provided)
+- Include clear insights and actionable recommendations
+- Be professionally written with proper formatting
+- Use markdown for structure (headings, lists, tables, emphasis)
+- Include specific numbers, percentages, and metrics where appropriate
+- Maintain objectivity while highlighting key findings
+- Be thorough but concise - every section should add value
+
+Top-level sections in the blueprint carry a section marker (e.g., <!-- section:section-id -->). Start each of them with
+its marker on its own line, exactly as given.
+
+When you see placeholders for images or tables:
+- If the placeholder has a "Rendered" marker (e.g., {{render:section-id}}), output the marker exactly as given on its own line
+  and write only the surrounding narrative. The table or chart is inserted automatically; do not recreate or describe it.
+- For tables without a marker: Generate realistic markdown tables with relevant data
+- For images without a marker: Describe what visualization should be shown (e.g., "[Chart: Bar graph showing X over Y period]")
+
+Write in a professional business tone suitable for executive stakeholders."""
+
+
+def _section_hierarchy(blueprint: Blueprint) -> List[Dict[str, Any]]:
+    """Flatten the blueprint tree in document order with level and numbering."""
+    sections_hierarchy = []
+
+    def build_hierarchy(parent_id=None, level=0):
+        children = [s for s in blueprint.sections if s.parentId == parent_id]
+        children.sort(key=lambda x: x.order)
+
+        for idx, section in enumerate(children):
+            number = ""
+            if level > 0:
+                number = f"{idx + 1}. "
+
+            sections_hierarchy.append({
+                "section": section,
+                "level": level,
+                "number": number
+            })
+
+            build_hierarchy(section.id, level + 1)
+
+    build_hierarchy()
+    return sections_hierarchy
+
+def _describe_section(
+    section: BlueprintSection,
+    level: int,
+    number: str,
+    rendered: Dict[str, RenderedSection]
+) -> List[str]:
+    """Prompt lines for one blueprint item, including its markers."""
+    indent = "  " * level
+    type_badge = section.type.value.upper()
+
+    lines = [f"{indent}{number}[{type_badge}] {section.content}"]
+
+    if level == 0:
+        lines.append(f"{indent}  Section marker: {SECTION_MARKER.format(section_id=section.id)}")
+    if section.metadata.dataSource:
+        lines.append(f"{indent}  Data Source: {section.metadata.dataSource}")
+    if section.metadata.analysisType:
+        lines.append(f"{indent}  Analysis: {section.metadata.analysisType}")
+    if section.metadata.visualizationType:
+        lines.append(f"{indent}  Visualization: {section.metadata.visualizationType}")
+    if section.metadata.estimatedLength:
+        lines.append(f"{indent}  Est. Length: {section.metadata.estimatedLength}")
+    if section.id in rendered:
+        marker = RENDER_MARKER.format(section_id=section.id)
+        lines.append(f"{indent}  Rendered: place {marker} on its own line; do not recreate this {rendered[section.id].kind}")
+
+    lines.append("")
+    return lines
+
+@traced("report.build_prompt")
+def blueprint_to_prompt_internal(
+    blueprint: Blueprint,
+    rendered: Optional[Dict[str, RenderedSection]] = None
+) -> str:
+    """
+    Internal function to convert blueprint to prompt.
+    This matches the frontend blueprintToPrompt function.
+
+    Placeholder sections listed in `rendered` carry a marker for the LLM to
+    place instead of inventing the table or chart itself.
+    """
+    rendered = rendered or {}
+
+    # Build prompt
+    prompt_parts = [
+        "=" * 80,
+        "REPORT GENERATION INSTRUCTIONS",
+        "=" * 80,
+        "",
+        f"Report Title: {blueprint.reportTitle}",
+        f"Report Type: {blueprint.reportType.value.replace('_', ' ').title()}",
+        f"Generated At: {blueprint.generatedAt}",
+        "",
+        "=" * 80,
+        "STRUCTURAL BLUEPRINT",
+        "=" * 80,
+        ""
+    ]
+
+    for item in _section_hierarchy(blueprint):
+        prompt_parts.extend(_describe_section(item["section"], item["level"], item["number"], rendered))
+
+    prompt_parts.extend([
+        "=" * 80,
+        "GENERATION GUIDELINES",
+        "=" * 80,
+        "",
+        "1. Follow the structure above exactly",
+        "2. Generate comprehensive, professional content for each section",
+        "3. Use markdown formatting (headings, lists, tables, emphasis)",
+        "4. Include realistic data and metrics where appropriate",
+        "5. For image/table placeholders, create markdown tables or describe visualizations, unless a render marker is given",
+        "6. Maintain consistent tone and quality throughout",
+        "7. Ensure logical flow between sections",
+        "8. Include specific insights and actionable recommendations",
+        "",
+        "=" * 80
+    ])
+
+    return "\n".join(prompt_parts)
+
+
+@traced("report.build_revision_prompt")
+def blueprint_to_revision_prompt(
+    blueprint: Blueprint,
+    plan: SectionPlan,
+    rendered: Optional[Dict[str, RenderedSection]] = None
+) -> str:
+    """
+    Build a prompt that rewrites only the changed sections of a report.
+
+    Unchanged sections appear as an outline for context. Their text is only
+    included when a summary-like section has to be rewritten, since those
+    summarise the rest of the report.
+
+    Args:
+        blueprint: New blueprint
+        plan: Section plan from plan_sections
+        rendered: Rendered placeholder sections
+
+    Returns:
+        Prompt for the LLM
+    """
+    rendered = rendered or {}
+    rewrite_ids = {unit.section_id for unit in plan.regenerate}
+    hierarchy = _section_hierarchy(blueprint)
+
+    prompt_parts = [
+        "=" * 80,
+        "REPORT REVISION INSTRUCTIONS",
+        "=" * 80,
+        "",
+        f"Report Title: {blueprint.reportTitle}",
+        f"Report Type: {blueprint.reportType.value.replace('_', ' ').title()}",
+        f"Generated At: {blueprint.generatedAt}",
+        "",
+        "An existing report is being revised. Only the sections listed under SECTIONS TO WRITE",
+        "changed; every other section is kept verbatim and must not be written again.",
+        "",
+        "=" * 80,
+        "REPORT OUTLINE",
+        "=" * 80,
+        ""
+    ]
+    for item in hierarchy:
+        if item["level"] == 0:
+            status = "WRITE" if item["section"].id in rewrite_ids else "KEEP"
+            prompt_parts.append(f"[{status}] {item['section'].content}")
+    prompt_parts.append("")
+
+    prompt_parts.extend([
+        "=" * 80,
+        "SECTIONS TO WRITE",
+        "=" * 80,
+        ""
+    ])
+    current_top = None
+    for item in hierarchy:
+        if item["level"] == 0:
+            current_top = item["section"].id
+        if current_top in rewrite_ids:
+            prompt_parts.extend(_describe_section(item["section"], item["level"], item["number"], rendered))
+
+    if any(unit.dependent for unit in plan.regenerate) and plan.reused:
+        prompt_parts.extend([
+            "=" * 80,
+            "CURRENT TEXT OF KEPT SECTIONS (for summaries only; do not repeat)",
+            "=" * 80,
+            ""
+        ])
+        for unit in plan.units:
+            if unit.section_id in plan.reused:
+                prompt_parts.extend([plan.reused[unit.section_id], ""])
+
+    prompt_parts.extend([
+        "=" * 80,
+        "GENERATION GUIDELINES",
+        "=" * 80,
+        "",
+        "1. Write only the sections listed under SECTIONS TO WRITE, in the order given",
+        "2. Start each section with its section marker on its own line",
+        "3. Match the tone, depth and formatting of a professional report",
+        "4. Keep figures consistent with the kept sections",
+        "5. For image/table placeholders, create markdown tables or describe visualizations, unless a render marker is given",
+        "",
+        "=" * 80
+    ])
+
+    return "\n".join(prompt_parts)
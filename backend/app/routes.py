@@ -1,6 +1,13 @@
+import asyncio
 from datetime import datetime
+import os
+import re
 import time
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request
+from fastapi.responses import FileResponse, PlainTextResponse, Response, StreamingResponse
+from sqlalchemy import case, func
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
 from app.schemas import (
@@ -10,6 +17,10 @@ from app.schemas import (
     UserCreate,
     UserLogin,
     Report as ReportSchema,
+    ReportSummary,
+    ReportSearchResult,
+    ReportSearchResponse,
+    SimilarReport,
     ReportCreate,
     BlueprintGenerationRequest,
     BlueprintGenerationResponse,
@@ -17,18 +28,91 @@ from app.schemas import (
     BlueprintSection,
     SectionMetadata,
     ReportGenerationRequest,
-    ReportGenerationResponse
+    ReportGenerationResponse,
+    BatchReportGenerationRequest,
+    BatchGenerationResponse,
+    BatchStatusResponse
 )
 from app.config import settings
-from app.database import get_db
-from app.models import User, Report
-from app.llm import call_llm, LLMError, LLMRateLimitError, LLMAPIError
+from app.database import SessionLocal, db_session, get_db
+from app.models import User, Report, ReportBatch
+from app.metrics import render_metrics
+from app.llm import llm_deadline, LLMDeadlineExceeded, LLMError, LLMRateLimitError, LLMAPIError, PartialOutput
+from app.model_routing import (
+    TASK_BLUEPRINT,
+    TASK_REPAIR,
+    TASK_SECTION,
+    call_llm_routed,
+    route_by_load,
+    task_tier
+)
+from app.preflight import PreflightError, record_input_tokens, size_blueprint_call, size_report_call
+from app.batch import BATCH_STATUS_FAILED, BATCH_STATUS_SUBMITTED, BatchItem, get_batch_backend, report_custom_id, start_poller
+from app.events import TooManyStreamsError, broker, publishing_progress, report_event, stream_events
+from app.http_cache import (
+    REVALIDATE_CACHE_CONTROL,
+    cache_headers,
+    etag_matches,
+    not_modified,
+    report_cache_control,
+    report_etag,
+    report_list_etag
+)
+from app.content_store import collect_blobs
+from app.export import EXPORT_FORMATS, ExportError, export_report, iter_file_range, parse_range_header, remove_report_exports
+from app.rendering import chart_path, render_placeholders
+from app.report_service import (
+    blueprint_to_prompt_internal,
+    blueprint_to_revision_prompt,
+    build_report_generation_system_prompt,
+    cancel_report,
+    complete_report,
+    fail_report,
+    generating_reports
+)
+from app.scheduler import PRIORITY_INTERACTIVE, PRIORITY_REPORT, SchedulerOverloadedError, Ticket, llm_scheduler
+from app.cancellation import (
+    REASON_DEADLINE,
+    GenerationCancelledError,
+    meter_cancellation,
+    request_cancel,
+    run_cancellable
+)
+from app.profiling import (
+    PROFILE_FORMATS,
+    ProfilerBusyError,
+    find_profile,
+    is_admin_token,
+    profile_worker,
+    profiling_enabled,
+    render_profile
+)
+from app.search import SearchError, remove_report, search_reports
+from app.tracing import span
+from app.sections import SectionMergeError, count_section_markers, merge_sections, plan_sections, remove_report_sections
+from app.similarity import (
+    blueprint_request_text,
+    find_similar_blueprint,
+    find_similar_reports,
+    index_report_blueprint,
+    remove_report_entries
+)
+from app.serialization import model_response, report_response, report_summaries_response
+from app.user_cache import get_user_by_id, get_user_by_username
 import logging
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Listing, search and stats are interactive reads: fail fast rather than tie up a connection
+get_read_db = db_session(statement_timeout_ms=settings.DB_READ_STATEMENT_TIMEOUT_MS)
+# User lookups are mostly cache hits, which should not take a pooled connection
+get_cached_db = db_session(checkout=False)
+
+# Which unique column a duplicate-key error is about (Postgres and SQLite messages)
+_DUPLICATE_USER_COLUMN = re.compile(r"(?:Key \(|users\.)(username|email)\b")
+
 @router.get("/health", response_model=HealthResponse)
 async def health_check() -> HealthResponse:
     return HealthResponse(
@@ -43,6 +127,67 @@ async def debug_config() -> DebugConfigResponse:
         mcp_transport=settings.MCP_TRANSPORT
     )
 
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics() -> PlainTextResponse:
+    """Process metrics in the Prometheus text format."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+def require_admin(x_admin_token: Optional[str] = Header(None)) -> None:
+    """Admin routes: hidden (404) while profiling is disabled, 403 without the admin token."""
+    if not profiling_enabled():
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not is_admin_token(x_admin_token):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+@router.post("/admin/profile", dependencies=[Depends(require_admin)])
+async def profile_worker_stacks(
+    seconds: float = Query(10.0, gt=0, le=settings.PROFILING_MAX_SECONDS),
+    interval_ms: Optional[float] = Query(None, ge=1, le=1000),
+    format: str = Query("collapsed", description="Profile format: collapsed or speedscope"),
+    include_idle: bool = Query(False, description="Keep samples of threads waiting for I/O or locks")
+) -> Response:
+    """
+    Sample the stacks of the worker that receives this request for some seconds.
+
+    The worker keeps serving requests meanwhile. With several workers, each
+    call profiles whichever worker it reaches (see the X-Profile-Pid header).
+
+    Args:
+        seconds: Sampling duration
+        interval_ms: Sampling interval (default PROFILING_INTERVAL_MS)
+        format: "collapsed" stacks (flamegraph.pl, speedscope, inferno) or "speedscope" JSON
+        include_idle: Keep samples of idle threads
+
+    Returns:
+        The profile
+
+    Raises:
+        HTTPException: 400 for an unknown format, 409 if a profile is already running
+    """
+    if format not in PROFILE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format. Use one of: {', '.join(PROFILE_FORMATS)}")
+    try:
+        profiler = await profile_worker(seconds, interval_ms, include_idle)
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    body, media_type = render_profile(profiler, format, f"worker {os.getpid()}")
+    return Response(
+        content=body,
+        media_type=media_type,
+        headers={"X-Profile-Pid": str(os.getpid()), "X-Profile-Samples": str(profiler.samples)}
+    )
+
+@router.get("/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def get_request_profile(profile_id: str) -> FileResponse:
+    """Profile of a single request sent with the X-Profile header (see ProfilingMiddleware)."""
+    found = find_profile(profile_id)
+    if found is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    path, profile_format = found
+    media_type = "application/json" if profile_format == "speedscope" else "text/plain; charset=utf-8"
+    return FileResponse(path, media_type=media_type)
+
 # User authentication endpoints
 @router.post("/users/register", response_model=UserSchema)
 async def register_user(
@@ -64,28 +209,24 @@ async def register_user(
     """
     logger.info(f"Registering new user: {user_data.username}")
 
-    # Check if username already exists
-    existing_user = db.query(User).filter(User.username == user_data.username).first()
-    if existing_user:
-        raise HTTPException(status_code=400, detail="Username already registered")
-
-    # Check if email already exists
-    existing_email = db.query(User).filter(User.email == user_data.email).first()
-    if existing_email:
-        raise HTTPException(status_code=400, detail="Email already registered")
-
     try:
         new_user = User(
             username=user_data.username,
             email=user_data.email
         )
         db.add(new_user)
+        # Uniqueness is enforced by the username and email constraints
         db.commit()
         db.refresh(new_user)
 
         logger.info(f"User registered successfully: {new_user.id}")
         return new_user
 
+    except IntegrityError as e:
+        db.rollback()
+        match = _DUPLICATE_USER_COLUMN.search(str(e.orig))
+        column = match.group(1) if match else "username"
+        raise HTTPException(status_code=400, detail=f"{column.capitalize()} already registered")
     except Exception as e:
         logger.error(f"User registration failed: {str(e)}")
         db.rollback()
@@ -94,7 +235,7 @@ async def register_user(
 @router.post("/users/login", response_model=UserSchema)
 async def login_user(
     login_data: UserLogin,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_cached_db)
 ) -> UserSchema:
     """
     Simple login endpoint (no password validation for now).
@@ -111,18 +252,18 @@ async def login_user(
     """
     logger.info(f"Login attempt for user: {login_data.username}")
 
-    user = db.query(User).filter(User.username == login_data.username).first()
+    user = get_user_by_username(db, login_data.username)
 
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    logger.info(f"User logged in successfully: {user.id}")
+    logger.info(f"User logged in successfully: {user['id']}")
     return user
 
 @router.get("/users/me/{user_id}", response_model=UserSchema)
 async def get_current_user(
     user_id: int,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_cached_db)
 ) -> UserSchema:
     """
     Get current user information by user_id.
@@ -137,7 +278,7 @@ async def get_current_user(
     Raises:
         HTTPException: If user not found
     """
-    user = db.query(User).filter(User.id == user_id).first()
+    user = get_user_by_id(db, user_id)
 
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -147,7 +288,7 @@ async def get_current_user(
 @router.get("/users/{user_id}/stats")
 async def get_user_stats(
     user_id: int,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     Get user statistics including report counts.
@@ -162,30 +303,22 @@ async def get_user_stats(
     Raises:
         HTTPException: If user not found
     """
-    # Verify user exists
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
+    # One aggregate over the user's reports; no row means the user does not exist
+    counts = db.query(
+        func.count(Report.id).label("total_reports"),
+        func.count(case((Report.status.in_(["processing", "pending"]), Report.id))).label("active_reports"),
+        func.count(case((Report.status == "completed", Report.id))).label("completed_reports")
+    ).select_from(User).outerjoin(
+        Report, Report.user_id == User.id
+    ).filter(User.id == user_id).group_by(User.id).first()
+
+    if counts is None:
         raise HTTPException(status_code=404, detail="User not found")
 
-    # Get total reports count
-    total_reports = db.query(Report).filter(Report.user_id == user_id).count()
-
-    # Get active reports count (processing or pending)
-    active_reports = db.query(Report).filter(
-        Report.user_id == user_id,
-        Report.status.in_(["processing", "pending"])
-    ).count()
-
-    # Get completed reports count
-    completed_reports = db.query(Report).filter(
-        Report.user_id == user_id,
-        Report.status == "completed"
-    ).count()
-
     return {
-        "total_reports": total_reports,
-        "active_reports": active_reports,
-        "completed_reports": completed_reports
+        "total_reports": counts.total_reports,
+        "active_reports": counts.active_reports,
+        "completed_reports": counts.completed_reports
     }
 
 # Report management endpoints
@@ -209,40 +342,44 @@ async def create_report(
     """
     logger.info(f"Creating report for user: {report_data.user_id}")
 
-    # Verify user exists
-    user = db.query(User).filter(User.id == report_data.user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-
     try:
         new_report = Report(
             user_id=report_data.user_id,
             title=report_data.title
         )
         db.add(new_report)
+        # The user must exist: enforced by the reports.user_id foreign key
         db.commit()
         db.refresh(new_report)
 
         logger.info(f"Report created successfully: {new_report.id}")
         return new_report
 
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=404, detail="User not found")
     except Exception as e:
         logger.error(f"Report creation failed: {str(e)}")
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Report creation failed: {str(e)}")
 
-@router.get("/reports/user/{user_id}", response_model=list[ReportSchema])
+@router.get("/reports/user/{user_id}", response_model=list[ReportSummary])
 async def get_user_reports(
     user_id: int,
+    request: Request,
     skip: int = 0,
     limit: int = 50,
-    db: Session = Depends(get_db)
-) -> list[ReportSchema]:
+    db: Session = Depends(get_read_db)
+) -> list[ReportSummary]:
     """
     Get all reports for a specific user.
 
+    Large content fields are omitted; fetch a single report for those. The
+    page carries an ETag, so an unchanged listing is answered with 304.
+
     Args:
         user_id: User ID
+        request: Incoming request (for If-None-Match)
         skip: Number of records to skip
         limit: Maximum number of records to return
         db: Database session
@@ -253,29 +390,81 @@ async def get_user_reports(
     Raises:
         HTTPException: If user not found
     """
-    # Verify user exists
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-
     reports = db.query(Report).filter(
         Report.user_id == user_id
     ).order_by(
         Report.created_at.desc()
     ).offset(skip).limit(limit).all()
 
-    return reports
+    # Only an empty page needs to tell "no reports" from "no such user"
+    if not reports and get_user_by_id(db, user_id) is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    etag = report_list_etag(reports, user_id, skip, limit)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified("/reports/user/{user_id}", etag, REVALIDATE_CACHE_CONTROL)
+    return report_summaries_response(reports, cache_headers(etag, REVALIDATE_CACHE_CONTROL))
+
+@router.get("/reports/search", response_model=ReportSearchResponse)
+async def search_user_reports(
+    user_id: int,
+    q: str = Query(..., min_length=1, max_length=500),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_read_db)
+) -> ReportSearchResponse:
+    """
+    Full-text search over a user's report titles and content.
+
+    Args:
+        user_id: Owner of the reports
+        q: Search query
+        limit: Page size
+        cursor: next_cursor from the previous page
+        db: Database session
+
+    Returns:
+        Ranked results with highlighted snippets and the next page cursor
+
+    Raises:
+        HTTPException: If the cursor is invalid
+    """
+    try:
+        hits, next_cursor = search_reports(db, user_id, q, limit, cursor)
+    except SearchError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return ReportSearchResponse(
+        results=[
+            ReportSearchResult(
+                id=hit.report.id,
+                title=hit.report.title,
+                report_type=hit.report.report_type,
+                status=hit.report.status,
+                created_at=hit.report.created_at,
+                rank=hit.rank,
+                snippet=hit.snippet
+            )
+            for hit in hits
+        ],
+        next_cursor=next_cursor
+    )
 
 @router.get("/reports/{report_id}", response_model=ReportSchema)
 async def get_report(
     report_id: int,
+    request: Request,
     db: Session = Depends(get_db)
 ) -> ReportSchema:
     """
     Get a specific report by ID.
 
+    Responses carry an ETag; a matching If-None-Match is answered with 304
+    before the report's content is loaded. Completed reports are immutable.
+
     Args:
         report_id: Report ID
+        request: Incoming request (for If-None-Match)
         db: Database session
 
     Returns:
@@ -289,7 +478,59 @@ async def get_report(
     if not report:
         raise HTTPException(status_code=404, detail="Report not found")
 
-    return report
+    etag = report_etag(report)
+    cache_control = report_cache_control(report)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        saved = (report.content_size or 0) + (report.prompt_size or 0) + (report.blueprint_size or 0)
+        return not_modified("/reports/{report_id}", etag, cache_control, saved)
+    return report_response(db, report, cache_headers(etag, cache_control))
+
+@router.get("/reports/{report_id}/similar", response_model=list[SimilarReport])
+async def get_similar_reports(
+    report_id: int,
+    user_id: int,
+    limit: int = Query(5, ge=1, le=20),
+    db: Session = Depends(get_db)
+) -> list[SimilarReport]:
+    """
+    Find the user's reports whose content is most similar to the given report (with ownership check).
+
+    Args:
+        report_id: Report ID
+        user_id: User ID (for ownership verification; only their reports are returned)
+        limit: Maximum number of similar reports
+        db: Database session
+
+    Returns:
+        Similar reports, most similar first
+
+    Raises:
+        HTTPException: If the report is not found, not the user's or has no content
+    """
+    report = db.query(Report).filter(Report.id == report_id).first()
+    if not report:
+        raise HTTPException(status_code=404, detail="Report not found")
+    if report.user_id != user_id:
+        raise HTTPException(status_code=403, detail="Not authorized to access this report")
+    if not report.generated_content:
+        raise HTTPException(status_code=409, detail="Report has no content yet")
+
+    matches = [
+        m for m in await asyncio.to_thread(
+            find_similar_reports, db, report.generated_content, user_id, top_k=limit + 1
+        )
+        if m.report_id != report_id
+    ][:limit]
+    titles = dict(
+        db.query(Report.id, Report.title).filter(
+            Report.id.in_([m.report_id for m in matches]), Report.user_id == user_id
+        ).all()
+    )
+    return [
+        SimilarReport(id=m.report_id, title=titles[m.report_id], similarity=m.similarity)
+        for m in matches
+        if m.report_id in titles
+    ]
 
 @router.delete("/reports/{report_id}")
 async def delete_report(
@@ -321,8 +562,14 @@ async def delete_report(
         raise HTTPException(status_code=403, detail="Not authorized to delete this report")
 
     try:
+        blob_hashes = remove_report_sections(db, report_id)
+        blob_hashes += [report.blueprint_hash, report.prompt_hash, report.content_hash]
         db.delete(report)
         db.commit()
+        remove_report_exports(report_id)
+        remove_report(db, report_id)
+        remove_report_entries(report_id)
+        collect_blobs(db, blob_hashes)
         logger.info(f"Report deleted successfully: {report_id}")
         return {"message": "Report deleted successfully"}
 
@@ -331,47 +578,243 @@ async def delete_report(
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Report deletion failed: {str(e)}")
 
+@router.post("/reports/{report_id}/cancel", response_model=ReportGenerationResponse, status_code=202)
+async def cancel_report_generation(
+    report_id: int,
+    user_id: int,
+    db: Session = Depends(get_db)
+) -> ReportGenerationResponse:
+    """
+    Stop the generation of a report (with ownership check).
+
+    The worker generating it stops the LLM call within CANCEL_POLL_INTERVAL
+    and marks the report 'cancelled', keeping the content generated so far.
+
+    Args:
+        report_id: Report ID
+        user_id: User ID (for ownership verification)
+        db: Database session
+
+    Returns:
+        Acknowledgement; the report's final status arrives on the event stream
+
+    Raises:
+        HTTPException: If the report is not found, not owned by the user or not being generated
+    """
+    report = db.query(Report).filter(Report.id == report_id).first()
+
+    if not report:
+        raise HTTPException(status_code=404, detail="Report not found")
+
+    if report.user_id != user_id:
+        raise HTTPException(status_code=403, detail="Not authorized to cancel this report")
+
+    if report.status != "processing" or report.batch_id is not None:
+        raise HTTPException(status_code=409, detail="Report is not being generated interactively")
+
+    request_cancel(report_id)
+    logger.info(f"Cancellation requested for report {report_id}")
+    return ReportGenerationResponse(
+        report_id=report_id,
+        status="cancelling",
+        message="Report generation is being cancelled"
+    )
+
+@router.get("/reports/{report_id}/export")
+async def export_report_file(
+    report_id: int,
+    request: Request,
+    format: str = Query("pdf", description="Export format: html, pdf or docx"),
+    db: Session = Depends(get_db)
+) -> Response:
+    """
+    Export a completed report as HTML, PDF or DOCX.
+
+    Artifacts are rendered off the event loop and cached by content hash, so
+    repeated downloads are served straight from disk. Single byte ranges are
+    supported for resumable downloads.
+
+    Args:
+        report_id: Report ID
+        request: Incoming request (for the Range header)
+        format: Export format
+        db: Database session
+
+    Returns:
+        The artifact, in full or as a 206 partial response
+
+    Raises:
+        HTTPException: If the report is missing or not completed, the format
+            is unsupported, or rendering fails
+    """
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported export format: {format}")
+
+    report = db.query(Report).filter(Report.id == report_id).first()
+    if not report:
+        raise HTTPException(status_code=404, detail="Report not found")
+    if report.status != "completed" or not report.generated_content:
+        raise HTTPException(status_code=409, detail="Report has no completed content to export")
+
+    try:
+        artifact = await export_report(report.id, report.title, report.generated_content, format)
+    except ExportError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    file_size = os.path.getsize(artifact.path)
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": f'"{artifact.etag}"',
+        "Content-Disposition": f'attachment; filename="{artifact.filename}"',
+    }
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if if_range and if_range.strip('"') != artifact.etag:
+        range_header = None
+
+    try:
+        byte_range = parse_range_header(range_header, file_size)
+    except ValueError:
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{file_size}"})
+
+    if byte_range is None:
+        headers["Content-Length"] = str(file_size)
+        return StreamingResponse(
+            iter_file_range(artifact.path, 0, file_size - 1),
+            media_type=artifact.media_type,
+            headers=headers
+        )
+
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        iter_file_range(artifact.path, start, end),
+        status_code=206,
+        media_type=artifact.media_type,
+        headers=headers
+    )
+
+
+_RENDER_FILENAME_PATTERN = re.compile(r"^[0-9a-f]{64}\.(svg|png)$")
+
+@router.get("/renders/{filename}")
+async def get_rendered_chart(filename: str) -> FileResponse:
+    """
+    Serve a chart rendered for a report placeholder section.
+
+    Files are content-addressed by data hash, so they never change once written.
+
+    Args:
+        filename: Chart file name (<data hash>.<svg|png>)
+
+    Returns:
+        The chart image
+
+    Raises:
+        HTTPException: If the name is invalid or the chart does not exist
+    """
+    if not _RENDER_FILENAME_PATTERN.match(filename):
+        raise HTTPException(status_code=404, detail="Chart not found")
+
+    digest, extension = filename.split(".")
+    path = os.path.join(os.path.dirname(chart_path(digest)), filename)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Chart not found")
+
+    media_type = "image/svg+xml" if extension == "svg" else "image/png"
+    return FileResponse(
+        path,
+        media_type=media_type,
+        headers={"Cache-Control": "public, max-age=31536000, immutable"}
+    )
+
+
+def _admit_llm_call(priority: str, user: object, max_tokens: int) -> Ticket:
+    """Queue an LLM call with the scheduler, answering 503 when the wait would be too long."""
+    try:
+        return llm_scheduler.submit(priority, user, max_tokens)
+    except SchedulerOverloadedError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
 
 # Blueprint Generation Endpoint
 @router.post("/blueprint/generate", response_model=BlueprintGenerationResponse)
 async def generate_blueprint(
     request: BlueprintGenerationRequest,
+    http_request: Request,
     db: Session = Depends(get_db)
 ) -> BlueprintGenerationResponse:
     """
     Generate a report blueprint structure using LLM based on user selections.
+
+    Generation must finish within BLUEPRINT_DEADLINE_SECONDS (504 otherwise)
+    and is stopped if the client disconnects. Its output budget is sized from
+    the number of data points (see app/preflight.py), and it is served by the
+    blueprint task's model tier (see app/model_routing.py).
     """
+    partial = PartialOutput()
     try:
         logger.info(f"Generating blueprint for report type: {request.reportType}")
 
+        # Offer a stored blueprint when an almost identical request was seen before
+        if request.allowReuse and request.user_id is not None:
+            reused = await _find_reusable_blueprint(request, db)
+            if reused is not None:
+                return model_response(reused)
+
         # Build the prompt for LLM
         prompt = _build_blueprint_prompt(request)
         system_prompt = _build_blueprint_system_prompt()
-
-        # Call LLM to generate blueprint
+        try:
+            sizing = size_blueprint_call(
+                len(request.selectedDataPoints), prompt, system_prompt, task_tier(TASK_BLUEPRINT)
+            )
+        except PreflightError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        max_tokens = sizing.max_tokens
+
+        # Call LLM to generate blueprint (interactive: served ahead of report generation)
+        # Capped per user like report calls; anonymous requests fall back to the client address
+        if request.user_id is not None:
+            caller = request.user_id
+        else:
+            caller = http_request.client.host if http_request.client else "unknown"
+        sizing = route_by_load(TASK_BLUEPRINT, PRIORITY_INTERACTIVE, caller, sizing)
+        ticket = _admit_llm_call(PRIORITY_INTERACTIVE, caller, max_tokens)
         start_time = time.time()
-        result = await call_llm(
-            prompt=prompt,
-            system_prompt=system_prompt,
-            max_tokens=4000,
-            temperature=0.7
-        )
+        try:
+            with llm_deadline(settings.BLUEPRINT_DEADLINE_SECONDS):
+                result = await run_cancellable(ticket.run(call_llm_routed(
+                    TASK_BLUEPRINT,
+                    sizing,
+                    prompt=prompt,
+                    system_prompt=system_prompt,
+                    temperature=0.7,
+                    partial=partial
+                )), http_request)
+        finally:
+            # In case the call was cancelled before it even queued
+            ticket.release()
         generation_time = time.time() - start_time
+        record_input_tokens(sizing, result)
 
         logger.info(f"Blueprint generated in {generation_time:.2f}s using {result.get('provider')}")
 
         # Parse the LLM response (expecting JSON)
         import json
-        try:
-            blueprint_data = json.loads(result['content'])
-        except json.JSONDecodeError:
-            # If not valid JSON, try to extract JSON from markdown code blocks
-            content = result['content']
-            if '```json' in content:
-                content = content.split('```json')[1].split('```')[0].strip()
-            elif '```' in content:
-                content = content.split('```')[1].split('```')[0].strip()
-            blueprint_data = json.loads(content)
+        with span("blueprint.parse_response", **{"llm.response_chars": len(result['content'])}):
+            try:
+                blueprint_data = json.loads(result['content'])
+            except json.JSONDecodeError:
+                # If not valid JSON, try to extract JSON from markdown code blocks
+                content = result['content']
+                if '```json' in content:
+                    content = content.split('```json')[1].split('```')[0].strip()
+                elif '```' in content:
+                    content = content.split('```')[1].split('```')[0].strip()
+                blueprint_data = json.loads(content)
 
         # Map invalid section types to valid ones
         def normalize_section_type(section_type: str) -> str:
@@ -413,17 +856,28 @@ async def generate_blueprint(
             reportType=request.reportType
         )
 
-        return BlueprintGenerationResponse(
+        # Already validated while building it: skip validation on the way out
+        return model_response(BlueprintGenerationResponse(
             blueprint=blueprint,
             success=True
-        )
-
+        ))
+
+    except GenerationCancelledError as e:
+        meter_cancellation("blueprint", e.reason, partial.output_tokens, max_tokens)
+        # Nobody is listening anymore (nginx's "client closed request")
+        return Response(status_code=499)
+    except LLMDeadlineExceeded as e:
+        meter_cancellation("blueprint", REASON_DEADLINE, partial.output_tokens, max_tokens)
+        logger.error(f"Blueprint generation timed out: {str(e)}")
+        raise HTTPException(status_code=504, detail="Blueprint generation timed out")
     except LLMRateLimitError as e:
         logger.error(f"Rate limit error: {str(e)}")
         raise HTTPException(status_code=429, detail=str(e))
     except LLMAPIError as e:
         logger.error(f"LLM API error: {str(e)}")
         raise HTTPException(status_code=502, detail=f"LLM API error: {str(e)}")
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Blueprint generation error: {str(e)}")
         return BlueprintGenerationResponse(
@@ -433,6 +887,45 @@ async def generate_blueprint(
         )
 
 
+async def _find_reusable_blueprint(
+    request: BlueprintGenerationRequest,
+    db: Session
+) -> Optional[BlueprintGenerationResponse]:
+    """Return a stored blueprint of the same user for a near-identical request, if any."""
+    try:
+        request_text = blueprint_request_text(
+            request.reportType.value,
+            request.analysisSubject,
+            request.selectedDataPoints,
+            request.additionalNotes
+        )
+        # The lookup reads the index files (and builds the index on first use)
+        match = await asyncio.to_thread(find_similar_blueprint, db, request_text, request.user_id)
+        if match is None:
+            return None
+
+        report = db.query(Report).filter(
+            Report.id == match.report_id, Report.user_id == request.user_id
+        ).first()
+        if not report or not report.blueprint:
+            return None
+
+        blueprint = Blueprint(**report.blueprint)
+        blueprint.generatedAt = datetime.now().isoformat()
+        logger.info(f"Reusing blueprint of report {report.id} (similarity: {match.similarity:.3f})")
+
+        return BlueprintGenerationResponse(
+            blueprint=blueprint,
+            success=True,
+            reusedFromReportId=report.id,
+            similarity=match.similarity
+        )
+    except Exception as e:
+        # A failed lookup must never block generation
+        logger.warning(f"Blueprint reuse lookup failed: {str(e)}")
+        return None
+
+
 def _build_blueprint_prompt(request: BlueprintGenerationRequest) -> str:
     """Build the prompt for blueprint generation."""
     data_points_str = "\n".join(f"- {dp}" for dp in request.selectedDataPoints)
@@ -517,26 +1010,73 @@ Always return valid JSON that matches the requested schema exactly."""
 @router.post("/reports/generate", response_model=ReportGenerationResponse)
 async def generate_report_from_blueprint(
     request: ReportGenerationRequest,
+    http_request: Request,
     db: Session = Depends(get_db)
 ) -> ReportGenerationResponse:
     """
     Generate a complete report from a blueprint structure.
 
     This endpoint:
-    1. Creates a database record with status 'processing'
-    2. Converts blueprint to prompt
+    1. Converts blueprint to prompt and sizes the LLM call
+    2. Creates a database record with status 'processing'
     3. Calls LLM to generate content
     4. Updates database with generated content
+
+    Generation stops when the client disconnects, when it is cancelled with
+    POST /reports/{id}/cancel or after REPORT_DEADLINE_SECONDS; the report is
+    then 'cancelled' and keeps the content generated until then.
+
+    Answers before creating the report: 413 when the blueprint is too large
+    for any model (see app/preflight.py; the detail suggests how to split it),
+    503 with Retry-After when the LLM queue is too long (see app/scheduler.py).
+
+    Writing a report is the section task, rewriting the changed sections of a
+    base report the repair task; each is served by its model tier, or the
+    cheaper one under load (see app/model_routing.py).
     """
+    ticket = None
+    report_id = None
     try:
         logger.info(f"Starting report generation for user: {request.user_id}")
 
-        # Verify user exists
-        user = db.query(User).filter(User.id == request.user_id).first()
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-
-        # Step 1: Create database record with status 'processing'
+        base_report = None
+        if request.base_report_id is not None:
+            base_report = db.query(Report).filter(
+                Report.id == request.base_report_id,
+                Report.user_id == request.user_id
+            ).first()
+            if not base_report:
+                raise HTTPException(status_code=404, detail="Base report not found")
+
+        # Step 1: Render data-backed placeholders, diff against the base report,
+        # convert the blueprint (or just its changed sections) to a prompt and size the call
+        rendered = await render_placeholders(request.blueprint, request.section_data)
+        plan = plan_sections(db, request.blueprint, rendered, base_report)
+        system_prompt = build_report_generation_system_prompt()
+        task = TASK_REPAIR if plan.is_partial else TASK_SECTION
+        try:
+            if plan.is_partial:
+                prompt = blueprint_to_revision_prompt(request.blueprint, plan, rendered)
+                sizing = size_report_call(
+                    request.blueprint, prompt, system_prompt, rendered, [u.section_id for u in plan.regenerate],
+                    tier=task_tier(task)
+                )
+            else:
+                prompt = blueprint_to_prompt_internal(request.blueprint, rendered)
+                sizing = size_report_call(request.blueprint, prompt, system_prompt, rendered, tier=task_tier(task))
+        except PreflightError as e:
+            detail = {"message": str(e), "parts": e.parts} if e.parts else str(e)
+            raise HTTPException(status_code=413, detail=detail)
+        max_tokens = sizing.max_tokens
+        logger.info(f"Generated prompt for report (length: {len(prompt)} chars, ~{sizing.input_tokens} tokens)")
+
+        # Nothing changed: the base report's sections are reused as-is, without an LLM call or a slot
+        needs_llm = not plan.is_partial or bool(plan.regenerate)
+        if needs_llm:
+            sizing = route_by_load(task, PRIORITY_REPORT, request.user_id, sizing)
+            ticket = _admit_llm_call(PRIORITY_REPORT, request.user_id, max_tokens)
+
+        # Step 2: Create database record with status 'processing'
         new_report = Report(
             user_id=request.user_id,
             title=request.blueprint.reportTitle,
@@ -546,56 +1086,124 @@ async def generate_report_from_blueprint(
             form_selections=request.form_selections
         )
         db.add(new_report)
-        db.commit()
+        try:
+            # The user must exist: enforced by the reports.user_id foreign key
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            raise HTTPException(status_code=404, detail="User not found")
         db.refresh(new_report)
 
         logger.info(f"Created report record with ID: {new_report.id}")
-
-        # Step 2: Convert blueprint to prompt
-        prompt = blueprint_to_prompt_internal(request.blueprint)
+        report_id = new_report.id
+        generating_reports.add(report_id)
+        index_report_blueprint(new_report)
 
         # Store the prompt used
         new_report.prompt_used = prompt
         db.commit()
 
-        logger.info(f"Generated prompt for report (length: {len(prompt)} chars)")
-
         # Step 3: Call LLM to generate content
-        system_prompt = _build_report_generation_system_prompt()
-
         start_time = time.time()
+        partial = PartialOutput()
+        revising = plan.is_partial
+
+        def generation_progress() -> float:
+            # A section is written once the marker of the next one arrives
+            expected = len(plan.regenerate) if revising else len(plan.units)
+            return (count_section_markers(partial.text) - 1) / max(expected, 1)
+
         try:
-            result = await call_llm(
-                prompt=prompt,
-                system_prompt=system_prompt,
-                max_tokens=8000,  # Long-form content
-                temperature=0.7
-            )
+            async with publishing_progress(new_report, generation_progress):
+                with llm_deadline(settings.REPORT_DEADLINE_SECONDS):
+                    if not needs_llm:
+                        result = {
+                            'content': "",
+                            'provider': base_report.llm_provider,
+                            'model': base_report.model_used,
+                            'tokens_used': 0
+                        }
+                    else:
+                        result = await run_cancellable(ticket.run(call_llm_routed(
+                            task,
+                            sizing,
+                            prompt=prompt,
+                            system_prompt=system_prompt,
+                            temperature=0.7,
+                            partial=partial
+                        )), http_request, new_report.id)
+                        record_input_tokens(sizing, result)
+
+                    if plan.is_partial:
+                        try:
+                            result['content'] = merge_sections(plan, result['content'])
+                        except SectionMergeError as e:
+                            logger.warning(f"Report {new_report.id}: {str(e)}; regenerating in full")
+                            prompt = blueprint_to_prompt_internal(request.blueprint, rendered)
+                            new_report.prompt_used = prompt
+                            revising = False
+                            sizing = size_report_call(
+                                request.blueprint, prompt, system_prompt, rendered, tier=task_tier(TASK_SECTION)
+                            )
+                            max_tokens = sizing.max_tokens
+                            sizing = route_by_load(TASK_SECTION, PRIORITY_REPORT, request.user_id, sizing)
+                            # Already admitted: queued again, but not shed
+                            ticket = llm_scheduler.submit(PRIORITY_REPORT, request.user_id, max_tokens, shed=False)
+                            result = await run_cancellable(ticket.run(call_llm_routed(
+                                TASK_SECTION,
+                                sizing,
+                                prompt=prompt,
+                                system_prompt=system_prompt,
+                                temperature=0.7,
+                                partial=partial
+                            )), http_request, new_report.id)
+                            record_input_tokens(sizing, result)
             generation_time = time.time() - start_time
 
             # Step 4: Update database with generated content
-            new_report.generated_content = result['content']
-            new_report.status = "completed"
-            new_report.llm_provider = result.get('provider')
-            new_report.model_used = result.get('model')
-            new_report.tokens_used = result.get('tokens_used')
-            new_report.generation_time = generation_time
-
+            complete_report(db, new_report, result, rendered, generation_time)
             db.commit()
             db.refresh(new_report)
 
             logger.info(f"Report {new_report.id} generated successfully in {generation_time:.2f}s")
 
+            message = "Report generated successfully"
+            if plan.is_partial:
+                message = (
+                    f"Report regenerated successfully "
+                    f"({len(plan.regenerate)} of {len(plan.units)} sections rewritten)"
+                )
+
             return ReportGenerationResponse(
                 report_id=new_report.id,
                 status="completed",
-                message="Report generated successfully"
+                message=message
+            )
+
+        except (GenerationCancelledError, LLMDeadlineExceeded) as e:
+            reason = e.reason if isinstance(e, GenerationCancelledError) else REASON_DEADLINE
+            content = partial.text
+            if revising and content:
+                # Complete the rewritten sections with the reused ones when all of them arrived
+                try:
+                    content = merge_sections(plan, content)
+                except SectionMergeError:
+                    pass
+            cancel_report(db, new_report, content, rendered, time.time() - start_time, reason)
+            db.commit()
+            meter_cancellation("report", reason, partial.output_tokens, max_tokens)
+
+            logger.warning(f"Report {new_report.id} generation cancelled ({reason})")
+
+            return ReportGenerationResponse(
+                report_id=new_report.id,
+                status="cancelled",
+                message=f"Report generation cancelled ({reason}); partial content was kept"
             )
 
-        except (LLMError, LLMRateLimitError, LLMAPIError) as e:
+        except (LLMError, LLMRateLimitError, LLMAPIError, PreflightError) as e:
             # Update report status to failed
-            new_report.status = "failed"
-            new_report.error_message = str(e)
+            fail_report(db, new_report, str(e))
             db.commit()
 
             logger.error(f"Report generation failed: {str(e)}")
@@ -612,108 +1220,199 @@ async def generate_report_from_blueprint(
         logger.error(f"Unexpected error in report generation: {str(e)}")
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Report generation failed: {str(e)}")
+    finally:
+        # Unused when generation stopped early
+        if ticket is not None:
+            ticket.release()
+        generating_reports.discard(report_id)
 
 
-def _build_report_generation_system_prompt() -> str:
-    """Build the system prompt for report content generation."""
-    return """You are an expert business analyst and report writer. Your role is to generate comprehensive,
-professional marketing and business reports based on structured blueprints.
-
-Your reports should:
-- Be well-researched and data-driven (use realistic example data when actual data isn't provided)
-- Include clear insights and actionable recommendations
-- Be professionally written with proper formatting
-- Use markdown for structure (headings, lists, tables, emphasis)
-- Include specific numbers, percentages, and metrics where appropriate
-- Maintain objectivity while highlighting key findings
-- Be thorough but concise - every section should add value
-
-When you see placeholders for images or tables:
-- For tables: Generate realistic markdown tables with relevant data
-- For images: Describe what visualization should be shown (e.g., "[Chart: Bar graph showing X over Y period]")
-
-Write in a professional business tone suitable for executive stakeholders."""
-
-
-def blueprint_to_prompt_internal(blueprint: Blueprint) -> str:
-    """
-    Internal function to convert blueprint to prompt.
-    This matches the frontend blueprintToPrompt function.
-    """
-    sections_hierarchy = []
-
-    # Build hierarchy
-    def build_hierarchy(parent_id=None, level=0):
-        children = [s for s in blueprint.sections if s.parentId == parent_id]
-        children.sort(key=lambda x: x.order)
-
-        for idx, section in enumerate(children):
-            number = ""
-            if level > 0:
-                number = f"{idx + 1}. "
-
-            sections_hierarchy.append({
-                "section": section,
-                "level": level,
-                "number": number
-            })
-
-            build_hierarchy(section.id, level + 1)
-
-    build_hierarchy()
-
-    # Build prompt
-    prompt_parts = [
-        "=" * 80,
-        "REPORT GENERATION INSTRUCTIONS",
-        "=" * 80,
-        "",
-        f"Report Title: {blueprint.reportTitle}",
-        f"Report Type: {blueprint.reportType.value.replace('_', ' ').title()}",
-        f"Generated At: {blueprint.generatedAt}",
-        "",
-        "=" * 80,
-        "STRUCTURAL BLUEPRINT",
-        "=" * 80,
-        ""
-    ]
+# Batch Report Generation Endpoints
+@router.post("/reports/generate/batch", response_model=BatchGenerationResponse)
+async def generate_reports_batch(
+    request: BatchReportGenerationRequest,
+    db: Session = Depends(get_db)
+) -> BatchGenerationResponse:
+    """
+    Generate many reports through the provider's message-batch API.
+
+    Creates one 'processing' Report per request, submits all prompts as a
+    single provider batch and returns immediately. A background poller fans
+    the results into the reports; progress is available from
+    GET /reports/batches/{batch_id}.
+    """
+    if not request.requests:
+        raise HTTPException(status_code=400, detail="Batch contains no requests")
+    if len(request.requests) > settings.BATCH_MAX_REQUESTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Batch exceeds the maximum of {settings.BATCH_MAX_REQUESTS} requests"
+        )
+
+    user_ids = {r.user_id for r in request.requests}
+    found = {row.id for row in db.query(User.id).filter(User.id.in_(user_ids)).all()}
+    if user_ids - found:
+        raise HTTPException(status_code=404, detail=f"Users not found: {sorted(user_ids - found)}")
+
+    backend = get_batch_backend()
+    logger.info(f"Submitting batch of {len(request.requests)} reports via {backend.provider}")
+
+    try:
+        batch = ReportBatch(provider=backend.provider, status=BATCH_STATUS_SUBMITTED, total=len(request.requests))
+        db.add(batch)
+        db.flush()
+
+        system_prompt = build_report_generation_system_prompt()
+        items = []
+        reports = []
+        rendered_sections = {}
+        for item_request in request.requests:
+            report = Report(
+                user_id=item_request.user_id,
+                batch_id=batch.id,
+                title=item_request.blueprint.reportTitle,
+                status="processing",
+                report_type=item_request.blueprint.reportType.value,
+                blueprint=item_request.blueprint.dict(),
+                form_selections=item_request.form_selections
+            )
+            db.add(report)
+            db.flush()
+
+            rendered = await render_placeholders(item_request.blueprint, item_request.section_data)
+            report.prompt_used = blueprint_to_prompt_internal(item_request.blueprint, rendered)
+            if rendered:
+                rendered_sections[str(report.id)] = {k: vars(v) for k, v in rendered.items()}
+            try:
+                sizing = size_report_call(
+                    item_request.blueprint, report.prompt_used, system_prompt, rendered, tier=task_tier(TASK_SECTION)
+                )
+            except PreflightError as e:
+                raise PreflightError(f"Request {len(items)}: {str(e)}", e.parts)
+
+            items.append(BatchItem(
+                custom_id=report_custom_id(report.id),
+                prompt=report.prompt_used,
+                system_prompt=system_prompt,
+                max_tokens=sizing.max_tokens,
+                model=sizing.model
+            ))
+            reports.append(report)
+
+        batch.rendered_sections = rendered_sections or None
+        db.commit()
+    except PreflightError as e:
+        db.rollback()
+        detail = {"message": str(e), "parts": e.parts} if e.parts else str(e)
+        raise HTTPException(status_code=413, detail=detail)
+    except Exception as e:
+        logger.error(f"Batch creation failed: {str(e)}")
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"Batch creation failed: {str(e)}")
 
-    for item in sections_hierarchy:
-        section = item["section"]
-        level = item["level"]
-        number = item["number"]
-
-        indent = "  " * level
-        type_badge = section.type.value.upper()
-
-        prompt_parts.append(f"{indent}{number}[{type_badge}] {section.content}")
-
-        if section.metadata.dataSource:
-            prompt_parts.append(f"{indent}  Data Source: {section.metadata.dataSource}")
-        if section.metadata.analysisType:
-            prompt_parts.append(f"{indent}  Analysis: {section.metadata.analysisType}")
-        if section.metadata.visualizationType:
-            prompt_parts.append(f"{indent}  Visualization: {section.metadata.visualizationType}")
-        if section.metadata.estimatedLength:
-            prompt_parts.append(f"{indent}  Est. Length: {section.metadata.estimatedLength}")
-
-        prompt_parts.append("")
-
-    prompt_parts.extend([
-        "=" * 80,
-        "GENERATION GUIDELINES",
-        "=" * 80,
-        "",
-        "1. Follow the structure above exactly",
-        "2. Generate comprehensive, professional content for each section",
-        "3. Use markdown formatting (headings, lists, tables, emphasis)",
-        "4. Include realistic data and metrics where appropriate",
-        "5. For image/table placeholders, create markdown tables or describe visualizations",
-        "6. Maintain consistent tone and quality throughout",
-        "7. Ensure logical flow between sections",
-        "8. Include specific insights and actionable recommendations",
-        "",
-        "=" * 80
-    ])
-
-    return "\n".join(prompt_parts)
+    for report in reports:
+        index_report_blueprint(report)
+
+    try:
+        batch.provider_batch_id = await backend.submit(items)
+        db.commit()
+    except Exception as e:
+        logger.error(f"Batch submission failed: {str(e)}")
+        for report in reports:
+            fail_report(db, report, f"Batch submission failed: {str(e)}")
+        batch.status = BATCH_STATUS_FAILED
+        batch.error_message = str(e)
+        db.commit()
+        raise HTTPException(status_code=502, detail=f"Batch submission failed: {str(e)}")
+
+    start_poller(batch.id)
+    logger.info(f"Batch {batch.id} submitted as {batch.provider_batch_id}")
+
+    return BatchGenerationResponse(
+        batch_id=batch.id,
+        status=batch.status,
+        report_ids=[r.id for r in reports],
+        message=f"Batch of {len(reports)} reports submitted"
+    )
+
+@router.get("/reports/batches/{batch_id}", response_model=BatchStatusResponse)
+async def get_batch_status(
+    batch_id: int,
+    db: Session = Depends(get_db)
+) -> BatchStatusResponse:
+    """
+    Get progress of a batch from its reports' statuses.
+
+    Raises:
+        HTTPException: If the batch is not found
+    """
+    batch = db.query(ReportBatch).filter(ReportBatch.id == batch_id).first()
+    if not batch:
+        raise HTTPException(status_code=404, detail="Batch not found")
+
+    counts = dict(
+        db.query(Report.status, func.count(Report.id)).filter(Report.batch_id == batch_id).group_by(Report.status).all()
+    )
+    completed = counts.get("completed", 0)
+    failed = counts.get("failed", 0)
+    processing = batch.total - completed - failed
+
+    return BatchStatusResponse(
+        batch_id=batch.id,
+        status=batch.status,
+        provider=batch.provider,
+        total=batch.total,
+        completed=completed,
+        failed=failed,
+        processing=processing,
+        progress=(completed + failed) / batch.total if batch.total else 1.0,
+        created_at=batch.created_at,
+        completed_at=batch.completed_at,
+        error_message=batch.error_message
+    )
+
+
+# Report Event Stream
+@router.get("/events/{user_id}")
+async def stream_user_events(user_id: int, request: Request) -> StreamingResponse:
+    """
+    Stream a user's report status transitions as Server-Sent Events.
+
+    The stream opens with a 'snapshot' event listing the user's in-flight
+    reports, then sends a 'report.status' event whenever one of their reports
+    changes status. A 'resync' event means events were dropped because the
+    client fell behind and it should refetch. Heartbeat comments keep idle
+    connections open.
+
+    Raises:
+        HTTPException: If the user is not found or has too many open streams
+    """
+    # Subscribe before reading the snapshot, so a transition committed in between is
+    # queued rather than lost (at worst the client sees it twice, events describe state)
+    try:
+        subscription = broker.subscribe(user_id)
+    except TooManyStreamsError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+    # The stream can stay open for hours, so do not hold a pooled connection for it
+    db = SessionLocal()
+    try:
+        if get_user_by_id(db, user_id) is None:
+            raise HTTPException(status_code=404, detail="User not found")
+
+        in_flight = db.query(Report).filter(
+            Report.user_id == user_id,
+            Report.status.in_(["processing", "pending"])
+        ).all()
+        snapshot = [report_event(report) for report in in_flight]
+    except BaseException:
+        broker.unsubscribe(subscription)
+        raise
+    finally:
+        db.close()
+
+    return StreamingResponse(
+        stream_events(subscription, snapshot, request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
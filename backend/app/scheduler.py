@@ -0,0 +1,320 @@
+"""
+Admission control for LLM calls.
+
+Every interactive LLM call takes a slot from the worker's LLMScheduler. At
+most LLM_MAX_CONCURRENCY calls run at once per worker (size it like the
+database pool: provider capacity divided by WEB_CONCURRENCY), and at most
+LLM_USER_CONCURRENCY of them for one user (or client address) across all
+workers: a running call also holds one of the user's slot leases in shared
+state, renewed while it runs so a dead worker's slots expire.
+LLM_INTERACTIVE_RESERVED_SLOTS of the slots are kept for interactive calls
+(blueprints), so they need not wait for a report to finish.
+
+Waiting calls are served by weighted fair queuing (self-clocked): each
+(priority class, user) flow has its own queue; a call is tagged with a
+virtual finish time of start + cost / class weight, where cost is its
+max_tokens and start the later of the flow's previous finish and the current
+virtual time, and the smallest tag whose user is under the cap is served
+first. A user's tenth report therefore queues behind everyone else's first,
+and a blueprint (4000 tokens, weight LLM_INTERACTIVE_WEIGHT) overtakes
+reports (8000 tokens, weight LLM_REPORT_WEIGHT).
+
+A call whose estimated queue wait exceeds its class's budget is shed before
+any work is done: SchedulerOverloadedError carries a Retry-After estimate.
+The wait is estimated from the work ahead of the call in this worker's queue
+(the slots it waits for are this worker's) and the mean duration of recent
+calls of each class.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import time
+from typing import Any, Awaitable, Dict, List, Optional, Set, Tuple, TypeVar
+
+from app.config import settings
+from app.llm import LLMDeadlineExceeded, deadline_remaining
+from app.shared_state import get_shared_state, worker_id
+from app.metrics import (
+    llm_scheduler_admitted_total,
+    llm_scheduler_queue_depth,
+    llm_scheduler_running,
+    llm_scheduler_shed_total,
+    llm_scheduler_wait_seconds_total
+)
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_REPORT = "report"
+
+# Mean call duration assumed until calls of the class have been measured
+INITIAL_SERVICE_SECONDS = {PRIORITY_INTERACTIVE: 15.0, PRIORITY_REPORT: 60.0}
+SERVICE_TIME_SMOOTHING = 0.2
+
+USER_SLOT_PREFIX = "llm_user_slot:"
+# A running call renews its user slot lease every third of this
+USER_SLOT_TTL = 60.0
+# How soon calls held back by their user's slots on other workers are retried
+USER_SLOT_RETRY_SECONDS = 0.5
+
+# Makes the lease owner of each ticket unique within the worker
+_ticket_ids = itertools.count()
+
+class SchedulerOverloadedError(Exception):
+    """Raised when a call would wait longer for an LLM slot than its priority class allows"""
+
+    def __init__(self, priority: str, estimated_wait: float):
+        super().__init__(f"LLM capacity exhausted: estimated wait {estimated_wait:.0f}s for {priority} work")
+        self.priority = priority
+        self.retry_after = max(1, math.ceil(estimated_wait))
+
+def _weight(priority: str) -> float:
+    return settings.LLM_INTERACTIVE_WEIGHT if priority == PRIORITY_INTERACTIVE else settings.LLM_REPORT_WEIGHT
+
+def _wait_budget(priority: str) -> float:
+    return settings.LLM_INTERACTIVE_MAX_WAIT if priority == PRIORITY_INTERACTIVE else settings.LLM_REPORT_MAX_WAIT
+
+class Ticket:
+    """A call's place in the scheduler queue, then its slot."""
+
+    def __init__(self, scheduler: "LLMScheduler", priority: str, flow: str, finish: float):
+        self.scheduler = scheduler
+        self.priority = priority
+        self.flow = flow
+        self.finish = finish
+        self.owner = f"{worker_id()}:{next(_ticket_ids)}"
+        self.slot_key: Optional[str] = None
+        self.submitted_at = time.monotonic()
+        self.granted: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+        self.running = False
+        self.done = False
+
+    async def run(self, work: Awaitable[T]) -> T:
+        """
+        Wait for a slot, then run the work in it.
+
+        Raises:
+            LLMDeadlineExceeded: If the deadline passes while waiting
+        """
+        started = False
+        try:
+            remaining = deadline_remaining()
+            try:
+                await asyncio.wait_for(asyncio.shield(self.granted), remaining)
+            except asyncio.TimeoutError:
+                raise LLMDeadlineExceeded("Deadline exceeded while waiting for LLM capacity")
+            started = True
+            start = time.monotonic()
+            renewal = asyncio.ensure_future(self._renew_slot()) if self.slot_key else None
+            try:
+                return await work
+            finally:
+                if renewal is not None:
+                    renewal.cancel()
+                self.scheduler.record_service_time(self.priority, time.monotonic() - start)
+        finally:
+            if not started and asyncio.iscoroutine(work):
+                work.close()
+            self.release()
+
+    async def _renew_slot(self) -> None:
+        state = get_shared_state()
+        while True:
+            await asyncio.sleep(USER_SLOT_TTL / 3)
+            try:
+                renewed = await asyncio.to_thread(state.acquire_lease, self.slot_key, self.owner, USER_SLOT_TTL)
+            except Exception as e:
+                logger.warning(f"Could not renew LLM user slot {self.slot_key}: {str(e)}")
+                continue
+            if not renewed:
+                logger.warning(f"LLM user slot {self.slot_key} expired while its call was running")
+
+    def release(self) -> None:
+        """Give up the place in the queue or the slot; safe to call more than once."""
+        if not self.done:
+            self.done = True
+            self.scheduler.release(self)
+
+class LLMScheduler:
+    """Per-worker scheduler of LLM slots."""
+
+    def __init__(self):
+        self._queue: List[Tuple[float, int, Ticket]] = []
+        self._sequence = itertools.count()
+        self._virtual_time = 0.0
+        self._flow_finish: Dict[str, float] = {}
+        self._running: Set[Ticket] = set()
+        self._running_by_user: Dict[str, int] = {}
+        self._running_by_priority: Dict[str, int] = {}
+        self._service_seconds = dict(INITIAL_SERVICE_SECONDS)
+        self._retry: Optional[asyncio.TimerHandle] = None
+
+    @staticmethod
+    def _user(flow: str) -> str:
+        return flow.split("|", 1)[1]
+
+    @staticmethod
+    def _slots(priority: str) -> int:
+        """Slots calls of a class may hold."""
+        if priority == PRIORITY_INTERACTIVE:
+            return settings.LLM_MAX_CONCURRENCY
+        return max(settings.LLM_MAX_CONCURRENCY - settings.LLM_INTERACTIVE_RESERVED_SLOTS, 1)
+
+    def estimated_wait(self, priority: str, finish: float) -> float:
+        """Seconds until a call of a class tagged finish would get a slot, from the work ahead of it."""
+        slots = self._slots(priority)
+        queued = [ticket for _, _, ticket in self._queue if not ticket.done and ticket.finish <= finish]
+        if priority == PRIORITY_INTERACTIVE:
+            running = list(self._running)
+            ahead = [ticket for ticket in queued if ticket.priority == PRIORITY_INTERACTIVE]
+            # Queued reports only get ahead while report slots are free; the reserved ones stay open
+            free_report_slots = self._slots(PRIORITY_REPORT) - self._running_by_priority.get(PRIORITY_REPORT, 0)
+            ahead += [ticket for ticket in queued if ticket.priority == PRIORITY_REPORT][:max(free_report_slots, 0)]
+        else:
+            # Reports cannot use the reserved slots, so only other reports are in their way
+            running = [ticket for ticket in self._running if ticket.priority == priority]
+            ahead = [ticket for ticket in queued if ticket.priority == priority]
+        if len(running) + len(ahead) < slots:
+            return 0.0
+        # Calls running now are on average half done
+        work = sum(0.5 * self._service_seconds[ticket.priority] for ticket in running)
+        work += sum(self._service_seconds[ticket.priority] for ticket in ahead)
+        return work / slots
+
+    def _finish_tag(self, flow: str, priority: str, cost: int) -> float:
+        start = max(self._virtual_time, self._flow_finish.get(flow, 0.0))
+        return start + cost / _weight(priority)
+
+    def load(self, priority: str, user: Any, cost: int) -> float:
+        """Estimated wait of a call submitted now, as a share of its class's wait budget (1 or more: shed)."""
+        wait = self.estimated_wait(priority, self._finish_tag(f"{priority}|{user}", priority, cost))
+        budget = _wait_budget(priority)
+        if budget <= 0:
+            return math.inf if wait > 0 else 0.0
+        return wait / budget
+
+    def submit(self, priority: str, user: Any, cost: int, shed: bool = True) -> Ticket:
+        """
+        Queue a call for a slot.
+
+        Args:
+            priority: PRIORITY_INTERACTIVE or PRIORITY_REPORT
+            user: User id (or client address) the per-user cap and fairness apply to
+            cost: Tokens the call may generate (max_tokens)
+            shed: Reject the call when its estimated wait exceeds the class budget
+
+        Returns:
+            The ticket; run the call with ticket.run() or give it up with ticket.release()
+
+        Raises:
+            SchedulerOverloadedError: If the call is shed
+        """
+        flow = f"{priority}|{user}"
+        finish = self._finish_tag(flow, priority, cost)
+
+        if shed:
+            wait = self.estimated_wait(priority, finish)
+            if wait > _wait_budget(priority):
+                llm_scheduler_shed_total.inc(priority=priority)
+                logger.warning(f"Shedding {priority} LLM call of {user}: estimated wait {wait:.1f}s")
+                raise SchedulerOverloadedError(priority, wait)
+
+        self._flow_finish[flow] = finish
+        ticket = Ticket(self, priority, flow, finish)
+        heapq.heappush(self._queue, (finish, next(self._sequence), ticket))
+        llm_scheduler_queue_depth.inc(priority=priority)
+        self._dispatch()
+        return ticket
+
+    def release(self, ticket: Ticket) -> None:
+        if ticket.running:
+            self._running.discard(ticket)
+            self._running_by_priority[ticket.priority] -= 1
+            user = self._user(ticket.flow)
+            self._running_by_user[user] -= 1
+            if not self._running_by_user[user]:
+                del self._running_by_user[user]
+            if ticket.slot_key is not None:
+                try:
+                    get_shared_state().release_lease(ticket.slot_key, ticket.owner)
+                except Exception as e:
+                    logger.warning(f"Could not release LLM user slot {ticket.slot_key}: {str(e)}")
+            llm_scheduler_running.set(len(self._running))
+        else:
+            # Left the queue without being served (cancelled or gave up); dropped lazily from the heap
+            llm_scheduler_queue_depth.dec(priority=ticket.priority)
+            if not ticket.granted.done():
+                ticket.granted.cancel()
+        self._dispatch()
+
+    def _take_user_slot(self, ticket: Ticket, user: str) -> bool:
+        """Lease one of the user's slots in shared state for a ticket. Returns False if all are taken."""
+        state = get_shared_state()
+        try:
+            for index in range(settings.LLM_USER_CONCURRENCY):
+                key = f"{USER_SLOT_PREFIX}{user}:{index}"
+                if state.acquire_lease(key, ticket.owner, USER_SLOT_TTL):
+                    ticket.slot_key = key
+                    return True
+        except Exception as e:
+            # Fall back to this worker's own count rather than stall every call
+            logger.warning(f"Could not lease an LLM user slot for {user}: {str(e)}")
+            return True
+        return False
+
+    def _dispatch(self) -> None:
+        skipped = []
+        # Users whose slots are all taken by other workers; their calls are retried shortly
+        held_elsewhere: Set[str] = set()
+        while self._queue and len(self._running) < settings.LLM_MAX_CONCURRENCY:
+            entry = heapq.heappop(self._queue)
+            ticket = entry[2]
+            if ticket.done:
+                continue
+            user = self._user(ticket.flow)
+            if (
+                user in held_elsewhere
+                or self._running_by_user.get(user, 0) >= settings.LLM_USER_CONCURRENCY
+                or self._running_by_priority.get(ticket.priority, 0) >= self._slots(ticket.priority)
+            ):
+                skipped.append(entry)
+                continue
+            if not self._take_user_slot(ticket, user):
+                held_elsewhere.add(user)
+                skipped.append(entry)
+                continue
+
+            ticket.running = True
+            self._running.add(ticket)
+            self._running_by_priority[ticket.priority] = self._running_by_priority.get(ticket.priority, 0) + 1
+            self._running_by_user[user] = self._running_by_user.get(user, 0) + 1
+            self._virtual_time = max(self._virtual_time, ticket.finish)
+            wait = time.monotonic() - ticket.submitted_at
+            llm_scheduler_queue_depth.dec(priority=ticket.priority)
+            llm_scheduler_running.set(len(self._running))
+            llm_scheduler_admitted_total.inc(priority=ticket.priority)
+            llm_scheduler_wait_seconds_total.inc(wait, priority=ticket.priority)
+            ticket.granted.set_result(None)
+        for entry in skipped:
+            heapq.heappush(self._queue, entry)
+        if held_elsewhere and self._retry is None:
+            # Slots released on another worker are not signalled here, so poll for them
+            self._retry = asyncio.get_running_loop().call_later(USER_SLOT_RETRY_SECONDS, self._retry_dispatch)
+        if not self._queue and not self._running:
+            # Idle: restart virtual time so the finish tags of the past do not carry over
+            self._virtual_time = 0.0
+            self._flow_finish.clear()
+
+    def _retry_dispatch(self) -> None:
+        self._retry = None
+        self._dispatch()
+
+    def record_service_time(self, priority: str, seconds: float) -> None:
+        previous = self._service_seconds[priority]
+        self._service_seconds[priority] = previous + SERVICE_TIME_SMOOTHING * (seconds - previous)
+
+llm_scheduler = LLMScheduler()
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from datetime import datetime
 from typing import Dict, Any, Optional
 from enum import Enum
@@ -35,7 +35,8 @@ class ReportBase(BaseModel):
 class ReportCreate(ReportBase):
     user_id: int
 
-class Report(ReportBase):
+class ReportSummary(ReportBase):
+    """Report without its large content fields, for listings and status polling."""
     # Core identification
     id: int
     user_id: int
@@ -47,14 +48,14 @@ class Report(ReportBase):
     # Generation metadata
     llm_provider: Optional[str] = None
     model_used: Optional[str] = None
+    model_tier: Optional[str] = None
     tokens_used: Optional[int] = None
     generation_time: Optional[float] = None
+    continuations: Optional[list[Dict[str, Any]]] = None
 
     # Report content and structure
     form_selections: Optional[Dict[str, Any]] = None
-    blueprint: Optional[Dict[str, Any]] = None
-    prompt_used: Optional[str] = None
-    generated_content: Optional[str] = None
+    content_size: Optional[int] = None
 
     # Timestamps
     created_at: datetime
@@ -63,8 +64,32 @@ class Report(ReportBase):
     # Error handling
     error_message: Optional[str] = None
 
-    class Config:
-        from_attributes = True
+    # model_used and model_tier are fields, not pydantic's model_ namespace
+    model_config = ConfigDict(from_attributes=True, protected_namespaces=())
+
+class Report(ReportSummary):
+    # Large fields, loaded from the content store on access
+    blueprint: Optional[Dict[str, Any]] = None
+    prompt_used: Optional[str] = None
+    generated_content: Optional[str] = None
+
+class ReportSearchResult(BaseModel):
+    id: int
+    title: str
+    report_type: Optional[str] = None
+    status: str
+    created_at: datetime
+    rank: float
+    snippet: str
+
+class ReportSearchResponse(BaseModel):
+    results: list[ReportSearchResult]
+    next_cursor: Optional[str] = None
+
+class SimilarReport(BaseModel):
+    id: int
+    title: str
+    similarity: float
 
 # Blueprint Schemas
 class ReportTypeEnum(str, Enum):
@@ -96,6 +121,13 @@ class BlueprintSection(BaseModel):
     parentId: Optional[str] = None
     metadata: SectionMetadata
 
+class SectionData(BaseModel):
+    """Tabular tool/metrics data used to render a placeholder section deterministically."""
+    columns: list[str]
+    rows: list[list[Any]]
+    title: Optional[str] = None
+    chartType: Optional[str] = None  # bar, line or pie; inferred from metadata when omitted
+
 class Blueprint(BaseModel):
     reportTitle: str
     sections: list[BlueprintSection]
@@ -107,18 +139,46 @@ class BlueprintGenerationRequest(BaseModel):
     analysisSubject: str
     selectedDataPoints: list[str]
     additionalNotes: Optional[str] = ""
+    user_id: Optional[int] = None  # Requesting user; without it no stored blueprint is offered
+    allowReuse: bool = True  # Offer a stored blueprint of the same user for near-identical requests
 
 class BlueprintGenerationResponse(BaseModel):
     blueprint: Blueprint
     success: bool
     error: Optional[str] = None
+    reusedFromReportId: Optional[int] = None
+    similarity: Optional[float] = None
 
 class ReportGenerationRequest(BaseModel):
     user_id: int
     blueprint: Blueprint
     form_selections: Dict[str, Any]  # Contains selectedDataPoints, additionalNotes, etc.
+    section_data: Optional[Dict[str, SectionData]] = None  # Keyed by section id or metadata.dataSource
+    base_report_id: Optional[int] = None  # Report being regenerated; its unchanged sections are reused
 
 class ReportGenerationResponse(BaseModel):
     report_id: int
     status: str
     message: str
+
+class BatchReportGenerationRequest(BaseModel):
+    requests: list[ReportGenerationRequest]
+
+class BatchGenerationResponse(BaseModel):
+    batch_id: int
+    status: str
+    report_ids: list[int]
+    message: str
+
+class BatchStatusResponse(BaseModel):
+    batch_id: int
+    status: str
+    provider: str
+    total: int
+    completed: int
+    failed: int
+    processing: int
+    progress: float
+    created_at: datetime
+    completed_at: Optional[datetime] = None
+    error_message: Optional[str] = None
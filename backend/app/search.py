@@ -0,0 +1,289 @@
+"""
+Full-text search over report titles and content.
+
+On PostgreSQL, reports.search_vector holds a weighted tsvector (title A,
+content B) behind a GIN index, written when a report completes. Other
+databases (SQLite test runs) use an in-memory inverted index with BM25
+ranking that is built from the database on first use and kept up to date
+the same way. Results are ranked, carry a highlighted snippet and page with
+an opaque (rank, id) keyset cursor.
+"""
+import base64
+import html
+import json
+import logging
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import Float, and_, cast, func, or_
+from sqlalchemy.orm import Session
+
+from app.content_store import load_blobs
+from app.models import Report
+
+logger = logging.getLogger(__name__)
+
+SEARCH_CONFIG = "english"
+SNIPPET_RADIUS = 120
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+_STOP_WORDS = frozenset(
+    "a an and are as at be by for from has in is it its of on or that the to was were will with".split()
+)
+
+class SearchError(Exception):
+    """Raised for malformed search queries or cursors"""
+    pass
+
+@dataclass
+class SearchHit:
+    report: Report
+    rank: float
+    snippet: str
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens without stop words, used by the fallback index."""
+    return [t for t in _TOKEN_PATTERN.findall(text.lower()) if t not in _STOP_WORDS]
+
+def encode_cursor(rank: float, report_id: int) -> str:
+    payload = json.dumps([rank, report_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("ascii")
+
+def decode_cursor(cursor: str) -> Tuple[float, int]:
+    try:
+        rank, report_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return float(rank), int(report_id)
+    except (ValueError, TypeError) as e:
+        raise SearchError(f"Invalid cursor: {str(e)}")
+
+def highlight_snippet(text: str, terms: Iterable[str], radius: int = SNIPPET_RADIUS) -> str:
+    """
+    Cut a snippet around the first matching term and wrap matches in <mark>.
+
+    Args:
+        text: Document text
+        terms: Query terms to highlight (prefix match, so 'market' marks 'marketing')
+        radius: Characters of context on each side of the first match
+
+    Returns:
+        HTML-escaped snippet with highlighted matches, or the start of the text if nothing matches
+    """
+    terms = [t for t in terms if t]
+    if not text:
+        return ""
+    if not terms:
+        return html.escape(text[:radius * 2].strip())
+
+    pattern = re.compile(r"\b(" + "|".join(re.escape(t) for t in terms) + r")\w*", re.IGNORECASE)
+    match = pattern.search(text)
+    if match is None:
+        return html.escape(text[:radius * 2].strip())
+
+    start = max(match.start() - radius, 0)
+    end = min(match.end() + radius, len(text))
+    snippet = " ".join(text[start:end].split())
+    # Report text may contain markup: escape it, leaving only our <mark> tags as HTML
+    parts = []
+    position = 0
+    for m in pattern.finditer(snippet):
+        parts.append(html.escape(snippet[position:m.start()]))
+        parts.append(f"<mark>{html.escape(m.group(0))}</mark>")
+        position = m.end()
+    parts.append(html.escape(snippet[position:]))
+    return ("…" if start > 0 else "") + "".join(parts) + ("…" if end < len(text) else "")
+
+class InvertedIndex:
+    """In-memory BM25 index used when PostgreSQL full-text search is unavailable."""
+
+    K1 = 1.2
+    B = 0.75
+    TITLE_BOOST = 2
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[int, int]] = defaultdict(dict)
+        self._doc_terms: Dict[int, Counter] = {}
+        self._doc_length: Dict[int, int] = {}
+        self._doc_user: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self.loaded = False
+
+    def add(self, report_id: int, user_id: int, title: str, content: str) -> None:
+        """Index (or re-index) a report."""
+        # Title terms are counted several times as a crude stand-in for tsvector weights
+        terms = Counter(tokenize(content))
+        for term in tokenize(title):
+            terms[term] += self.TITLE_BOOST
+
+        with self._lock:
+            self._remove_locked(report_id)
+            for term, count in terms.items():
+                self._postings[term][report_id] = count
+            self._doc_terms[report_id] = terms
+            self._doc_length[report_id] = sum(terms.values())
+            self._doc_user[report_id] = user_id
+
+    def remove(self, report_id: int) -> None:
+        with self._lock:
+            self._remove_locked(report_id)
+
+    def _remove_locked(self, report_id: int) -> None:
+        for term in self._doc_terms.pop(report_id, ()):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(report_id, None)
+                if not postings:
+                    del self._postings[term]
+        self._doc_length.pop(report_id, None)
+        self._doc_user.pop(report_id, None)
+
+    def search(self, user_id: int, terms: List[str]) -> List[Tuple[float, int]]:
+        """
+        Rank a user's reports containing every query term.
+
+        Returns:
+            (score, report_id) pairs, best first, ties broken by newest id
+        """
+        with self._lock:
+            if not terms or not self._doc_length:
+                return []
+
+            candidates: Optional[set] = None
+            for term in terms:
+                docs = set(self._postings.get(term, {}))
+                candidates = docs if candidates is None else candidates & docs
+                if not candidates:
+                    return []
+
+            total_docs = len(self._doc_length)
+            avg_length = sum(self._doc_length.values()) / total_docs
+            scored = []
+            for report_id in candidates:
+                if self._doc_user.get(report_id) != user_id:
+                    continue
+                length = self._doc_length[report_id]
+                score = 0.0
+                for term in terms:
+                    postings = self._postings[term]
+                    tf = postings[report_id]
+                    idf = math.log(1 + (total_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                    score += idf * tf * (self.K1 + 1) / (tf + self.K1 * (1 - self.B + self.B * length / avg_length))
+                scored.append((round(score, 6), report_id))
+
+        scored.sort(key=lambda item: (-item[0], -item[1]))
+        return scored
+
+_fallback_index = InvertedIndex()
+
+def _uses_postgres(db: Session) -> bool:
+    return db.get_bind().dialect.name == "postgresql"
+
+def _ensure_fallback_loaded(db: Session) -> None:
+    """Build the in-memory index from completed reports on first use."""
+    if _fallback_index.loaded:
+        return
+
+    rows = db.query(Report.id, Report.user_id, Report.title, Report.content_hash).filter(
+        Report.status == "completed",
+        Report.content_hash.isnot(None)
+    ).all()
+    contents = load_blobs(db, [row.content_hash for row in rows])
+    missing = 0
+    for row in rows:
+        content = contents.get(row.content_hash)
+        if content is None:
+            missing += 1
+            logger.warning(f"Report {row.id}: content blob {row.content_hash} is missing, not indexed for search")
+            continue
+        _fallback_index.add(row.id, row.user_id, row.title, content.decode("utf-8"))
+    _fallback_index.loaded = True
+    logger.info(f"Built in-memory search index over {len(rows) - missing} reports")
+
+def index_report(db: Session, report: Report) -> None:
+    """
+    Update the search index for a report that just completed.
+
+    On PostgreSQL this sets search_vector on the row (written on the next
+    flush); otherwise the in-memory index is updated immediately.
+    """
+    content = report.generated_content or ""
+    if _uses_postgres(db):
+        report.search_vector = func.setweight(
+            func.to_tsvector(SEARCH_CONFIG, report.title), "A"
+        ).op("||")(
+            func.setweight(func.to_tsvector(SEARCH_CONFIG, content), "B")
+        )
+    elif _fallback_index.loaded:
+        _fallback_index.add(report.id, report.user_id, report.title, content)
+
+def remove_report(db: Session, report_id: int) -> None:
+    """Drop a deleted report from the in-memory index (the tsvector goes with its row)."""
+    if not _uses_postgres(db):
+        _fallback_index.remove(report_id)
+
+def search_reports(
+    db: Session,
+    user_id: int,
+    query: str,
+    limit: int = 20,
+    cursor: Optional[str] = None
+) -> Tuple[List[SearchHit], Optional[str]]:
+    """
+    Search a user's completed reports.
+
+    Args:
+        db: Database session
+        user_id: Owner of the reports
+        query: Free-text query (web-search syntax on PostgreSQL)
+        limit: Page size
+        cursor: Cursor returned with the previous page
+
+    Returns:
+        Tuple of (hits for this page, cursor for the next page or None)
+
+    Raises:
+        SearchError: If the cursor is malformed
+    """
+    after = decode_cursor(cursor) if cursor else None
+    terms = tokenize(query)
+
+    if _uses_postgres(db):
+        tsquery = func.websearch_to_tsquery(SEARCH_CONFIG, query)
+        # float4 ranks do not round-trip through the cursor exactly; compare as float8
+        rank = cast(func.ts_rank_cd(Report.search_vector, tsquery), Float)
+        q = db.query(Report, rank.label("rank")).filter(
+            Report.user_id == user_id,
+            Report.search_vector.op("@@")(tsquery)
+        )
+        if after is not None:
+            q = q.filter(or_(rank < after[0], and_(rank == after[0], Report.id < after[1])))
+        rows = q.order_by(rank.desc(), Report.id.desc()).limit(limit + 1).all()
+        page = [(float(row.rank), row.Report) for row in rows]
+    else:
+        _ensure_fallback_loaded(db)
+        ranked = _fallback_index.search(user_id, terms)
+        if after is not None:
+            ranked = [(s, i) for s, i in ranked if s < after[0] or (s == after[0] and i < after[1])]
+        ranked = ranked[:limit + 1]
+        reports = {r.id: r for r in db.query(Report).filter(Report.id.in_([i for _, i in ranked])).all()}
+        page = [(score, reports[i]) for score, i in ranked if i in reports]
+
+    has_more = len(page) > limit
+    page = page[:limit]
+
+    # Only the page being returned has its content read, in a single query
+    contents = load_blobs(db, [report.content_hash for _, report in page if report.content_hash])
+    hits = [
+        SearchHit(
+            report=report,
+            rank=rank_value,
+            snippet=highlight_snippet(contents.get(report.content_hash, b"").decode("utf-8"), terms)
+        )
+        for rank_value, report in page
+    ]
+
+    next_cursor = encode_cursor(hits[-1].rank, hits[-1].report.id) if has_more and hits else None
+    return hits, next_cursor
@@ -0,0 +1,251 @@
+"""
+Section-level storage of generated report content for incremental regeneration.
+
+Every top-level blueprint item (and the subtree under it) is a unit. A unit is
+keyed by a hash of its subtree and of the inputs that shape its text: report
+type, the data behind any rendered placeholders and the prompt version.
+Summary-like units (executive summary, overview, conclusions) also hash the
+keys of every other unit, so they are rewritten whenever anything they
+summarise changes.
+
+The LLM is asked to open each unit with a SECTION_MARKER, which lets the
+generated markdown be split and stored per unit in report_sections. When a
+report is regenerated from a base report, units whose key is unchanged reuse
+the stored text verbatim and only the rest are sent to the LLM.
+"""
+import hashlib
+import json
+import logging
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from app.content_store import load_blobs
+from app.models import Report, ReportSection
+from app.rendering import RenderedSection
+from app.schemas import Blueprint, BlueprintSection
+
+logger = logging.getLogger(__name__)
+
+SECTION_MARKER = "<!-- section:{section_id} -->"
+# Bump when prompt changes should invalidate stored section text
+SECTION_PROMPT_VERSION = 1
+
+_MARKER_PATTERN = re.compile(r"^[ \t]*<!--\s*section:(\S+?)\s*-->[ \t]*(?:\r?\n)?", re.MULTILINE)
+_DEPENDENT_PATTERN = re.compile(
+    r"\b(executive summary|summary|overview|conclusions?|key (?:takeaways|findings))\b",
+    re.IGNORECASE
+)
+
+class SectionMergeError(Exception):
+    """Raised when regenerated output is missing sections it was asked to write"""
+    pass
+
+@dataclass
+class SectionUnit:
+    section_id: str
+    position: int
+    unit_hash: str
+    dependent: bool
+
+@dataclass
+class SectionPlan:
+    units: List[SectionUnit]
+    # Stored text of unchanged units, keyed by section id
+    reused: Dict[str, str] = field(default_factory=dict)
+    regenerate: List[SectionUnit] = field(default_factory=list)
+
+    @property
+    def is_partial(self) -> bool:
+        return bool(self.reused)
+
+def _subtree(
+    blueprint: Blueprint,
+    section: BlueprintSection,
+    rendered: Dict[str, RenderedSection]
+) -> Dict:
+    # Ids are left out so an identical subtree matches across blueprints
+    children = sorted((s for s in blueprint.sections if s.parentId == section.id), key=lambda s: s.order)
+    return {
+        "type": section.type.value,
+        "content": section.content,
+        "metadata": section.metadata.dict(exclude_none=True),
+        "data": rendered[section.id].data_hash if section.id in rendered else None,
+        "children": [_subtree(blueprint, child, rendered) for child in children],
+    }
+
+def _hash(payload: Dict) -> str:
+    data = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+def section_units(blueprint: Blueprint, rendered: Optional[Dict[str, RenderedSection]] = None) -> List[SectionUnit]:
+    """
+    Split a blueprint into top-level units and compute their keys.
+
+    Args:
+        blueprint: Report blueprint
+        rendered: Rendered placeholder sections (their data hashes are unit inputs)
+
+    Returns:
+        Units in document order
+    """
+    rendered = rendered or {}
+    top_level = sorted((s for s in blueprint.sections if s.parentId is None), key=lambda s: s.order)
+
+    independent = {}
+    for section in top_level:
+        independent[section.id] = _hash({
+            "version": SECTION_PROMPT_VERSION,
+            "reportType": blueprint.reportType.value,
+            "subtree": _subtree(blueprint, section, rendered),
+        })
+
+    units = []
+    for position, section in enumerate(top_level):
+        dependent = bool(_DEPENDENT_PATTERN.search(section.content))
+        unit_hash = independent[section.id]
+        if dependent:
+            others = [independent[s.id] for s in top_level if s.id != section.id]
+            unit_hash = _hash({"unit": unit_hash, "depends_on": others})
+        units.append(SectionUnit(section.id, position, unit_hash, dependent))
+    return units
+
+def split_sections(content: str) -> Dict[str, str]:
+    """
+    Split marked-up markdown into per-unit text, keyed by section id.
+
+    Text before the first marker is kept with the first unit.
+    """
+    matches = list(_MARKER_PATTERN.finditer(content))
+    chunks = {}
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(content)
+        text = content[match.end():end]
+        if i == 0:
+            text = content[:match.start()] + text
+        chunks.setdefault(match.group(1), text.strip())
+    return chunks
+
+def strip_section_markers(content: str) -> str:
+    """Remove section markers from markdown before it is stored or shown."""
+    return _MARKER_PATTERN.sub("", content)
+
+def count_section_markers(text: str) -> int:
+    """Number of section markers in (partial) LLM output."""
+    return len(_MARKER_PATTERN.findall(text))
+
+def join_sections(units: List[SectionUnit], chunks: Dict[str, str]) -> str:
+    """Reassemble per-unit text into marked-up markdown in document order."""
+    parts = []
+    for unit in units:
+        if unit.section_id in chunks:
+            parts.append(f"{SECTION_MARKER.format(section_id=unit.section_id)}\n{chunks[unit.section_id]}")
+    return "\n\n".join(parts)
+
+def plan_sections(
+    db: Session,
+    blueprint: Blueprint,
+    rendered: Optional[Dict[str, RenderedSection]],
+    base_report: Optional[Report] = None
+) -> SectionPlan:
+    """
+    Diff a blueprint against a base report's stored sections.
+
+    Units are matched on their key rather than their id, so a moved or
+    duplicated section is reused as long as its subtree and inputs match.
+
+    Args:
+        db: Database session
+        blueprint: New blueprint
+        rendered: Rendered placeholder sections of the new blueprint
+        base_report: Report being regenerated, if any
+
+    Returns:
+        Plan listing reused text and the units to send to the LLM
+    """
+    units = section_units(blueprint, rendered)
+    if base_report is None:
+        return SectionPlan(units=units, regenerate=list(units))
+
+    stored = db.query(ReportSection.unit_hash, ReportSection.content_hash).filter(
+        ReportSection.report_id == base_report.id
+    ).all()
+    stored_hashes = {row.unit_hash: row.content_hash for row in stored}
+    contents = load_blobs(db, [stored_hashes[u.unit_hash] for u in units if u.unit_hash in stored_hashes])
+
+    plan = SectionPlan(units=units)
+    for unit in units:
+        content_hash = stored_hashes.get(unit.unit_hash)
+        if content_hash in contents:
+            plan.reused[unit.section_id] = contents[content_hash].decode("utf-8")
+        else:
+            plan.regenerate.append(unit)
+
+    logger.info(
+        f"Section diff against report {base_report.id}: "
+        f"{len(plan.reused)} unchanged, {len(plan.regenerate)} to regenerate"
+    )
+    return plan
+
+def merge_sections(plan: SectionPlan, generated: str) -> str:
+    """
+    Combine reused text with newly generated units.
+
+    Args:
+        plan: Plan the LLM output was requested for
+        generated: LLM output containing the regenerated units
+
+    Returns:
+        Marked-up markdown of the whole report
+
+    Raises:
+        SectionMergeError: If a unit that was asked for is missing from the output
+    """
+    chunks = split_sections(generated)
+    missing = [u.section_id for u in plan.regenerate if u.section_id not in chunks]
+    if missing:
+        raise SectionMergeError(f"Regenerated output is missing sections: {', '.join(missing)}")
+
+    merged = dict(plan.reused)
+    merged.update({u.section_id: chunks[u.section_id] for u in plan.regenerate})
+    return join_sections(plan.units, merged)
+
+def store_report_sections(db: Session, report: Report, units: List[SectionUnit], content: str) -> int:
+    """
+    Store the per-unit text of marked-up report content.
+
+    Units the LLM did not mark are skipped; they will be regenerated the next
+    time. The caller flushes or commits.
+
+    Returns:
+        Number of units stored
+    """
+    chunks = split_sections(content)
+    db.query(ReportSection).filter(ReportSection.report_id == report.id).delete()
+
+    stored = 0
+    for unit in units:
+        if unit.section_id not in chunks:
+            continue
+        section = ReportSection(
+            report_id=report.id,
+            section_id=unit.section_id,
+            position=unit.position,
+            unit_hash=unit.unit_hash
+        )
+        section.content = chunks[unit.section_id]
+        db.add(section)
+        stored += 1
+
+    if units and stored < len(units):
+        logger.warning(f"Report {report.id}: stored {stored} of {len(units)} sections (markers missing)")
+    return stored
+
+def remove_report_sections(db: Session, report_id: int) -> List[str]:
+    """Delete a report's stored sections and return their content hashes. The caller commits."""
+    sections = db.query(ReportSection).filter(ReportSection.report_id == report_id)
+    hashes = [row.content_hash for row in sections.with_entities(ReportSection.content_hash) if row.content_hash]
+    sections.delete()
+    return hashes
@@ -0,0 +1,155 @@
+"""
+Fast JSON responses for the hot report and blueprint schemas.
+
+The app's default response class is ORJSONResponse, but a route with a
+response_model still validates its return value against the schema and dumps
+it to Python objects before encoding. For reports that means copying the
+blueprint dict and the full markdown twice. The helpers here build the
+response bytes directly instead:
+
+- Report rows are encoded with orjson straight from the ORM attributes listed
+  by the schema (no validation on the way out).
+- Blob fields are inserted as pre-serialized JSON fragments. Blueprint blobs
+  are stored as compact JSON already, so their raw bytes are used as is; text
+  blobs are encoded once. Fragments are cached by content hash (blobs are
+  immutable), so a cached report's content is not even read from the
+  database, and uncached blobs of a page are fetched in one query.
+- Pydantic models (Blueprint, BlueprintSection responses) are dumped by
+  model_dump_json, skipping FastAPI's second validation pass.
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+
+import orjson
+from fastapi.responses import Response
+from pydantic import BaseModel
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.content_store import load_blobs
+from app.metrics import serialized_fragment_requests_total
+from app.models import Report
+from app.schemas import Report as ReportSchema, ReportSummary
+
+JSON_MEDIA_TYPE = "application/json"
+ORJSON_OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+
+SUMMARY_FIELDS = tuple(ReportSummary.model_fields)
+# Schema fields backed by the content store -> their BlobField (prefix and kind)
+BLOB_FIELDS = {
+    name: Report.__dict__[name]
+    for name in ReportSchema.model_fields
+    if name not in ReportSummary.model_fields
+}
+
+class FragmentCache:
+    """LRU of serialized JSON fragments keyed by blob hash, bounded in bytes."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, digest: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._entries.get(digest)
+            if data is not None:
+                self._entries.move_to_end(digest)
+            return data
+
+    def put(self, digest: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if digest in self._entries:
+                return
+            self._entries[digest] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+fragment_cache = FragmentCache(settings.SERIALIZED_FIELD_CACHE_BYTES)
+
+def _serialize_blob(data: bytes, kind: str) -> bytes:
+    # JSON blobs are stored compact and UTF-8 encoded: already valid JSON
+    return data if kind == "json" else orjson.dumps(data.decode("utf-8"))
+
+def _blob_fragments(db: Session, reports: List[Report], fields: Iterable[str]) -> Dict[str, orjson.Fragment]:
+    """Fragments for every blob the reports reference, keyed by hash."""
+    fragments: Dict[str, orjson.Fragment] = {}
+    missing: Dict[str, str] = {}
+    for report in reports:
+        loaded = report.__dict__.get("_blob_values", {})
+        for field in fields:
+            blob_field = BLOB_FIELDS[field]
+            digest = getattr(report, f"{blob_field.prefix}_hash")
+            if digest is None or digest in fragments:
+                continue
+            data = fragment_cache.get(digest)
+            if data is None and blob_field.name in loaded:
+                # Already decoded on this instance (e.g. just generated)
+                data = orjson.dumps(loaded[blob_field.name], option=ORJSON_OPTIONS)
+                fragment_cache.put(digest, data)
+            if data is None:
+                missing[digest] = blob_field.kind
+                continue
+            serialized_fragment_requests_total.inc(result="hit")
+            fragments[digest] = orjson.Fragment(data)
+
+    if missing:
+        serialized_fragment_requests_total.inc(len(missing), result="miss")
+        for digest, raw in load_blobs(db, missing).items():
+            data = _serialize_blob(raw, missing[digest])
+            fragment_cache.put(digest, data)
+            fragments[digest] = orjson.Fragment(data)
+    return fragments
+
+def report_payload(report: Report, fragments: Optional[Dict[str, orjson.Fragment]] = None) -> Dict[str, Any]:
+    """
+    A report as a dict ready for orjson (summary fields, plus blob fragments if given).
+
+    Args:
+        report: Report row
+        fragments: Blob fragments by hash; None leaves the blob fields out
+
+    Returns:
+        Dict matching the Report (or ReportSummary) schema
+    """
+    payload = {field: getattr(report, field) for field in SUMMARY_FIELDS}
+    if fragments is not None:
+        for field, blob_field in BLOB_FIELDS.items():
+            payload[field] = fragments.get(getattr(report, f"{blob_field.prefix}_hash"))
+    return payload
+
+def report_payloads(db: Session, reports: List[Report]) -> List[Dict[str, Any]]:
+    """Full payloads (Report schema) for several reports, loading uncached blobs in one query."""
+    fragments = _blob_fragments(db, reports, BLOB_FIELDS)
+    return [report_payload(report, fragments) for report in reports]
+
+def json_response(content: Any, headers: Optional[Dict[str, str]] = None, status_code: int = 200) -> Response:
+    return Response(
+        content=orjson.dumps(content, option=ORJSON_OPTIONS),
+        status_code=status_code,
+        media_type=JSON_MEDIA_TYPE,
+        headers=headers
+    )
+
+def report_response(db: Session, report: Report, headers: Optional[Dict[str, str]] = None) -> Response:
+    """Full report (Report schema) as a JSON response."""
+    return json_response(report_payloads(db, [report])[0], headers)
+
+def report_summaries_response(reports: List[Report], headers: Optional[Dict[str, str]] = None) -> Response:
+    """List of reports (ReportSummary schema) as a JSON response."""
+    return json_response([report_payload(report) for report in reports], headers)
+
+def model_response(model: BaseModel, headers: Optional[Dict[str, str]] = None, status_code: int = 200) -> Response:
+    """An already validated pydantic model as a JSON response, without revalidating it."""
+    return Response(
+        content=model.model_dump_json(),
+        status_code=status_code,
+        media_type=JSON_MEDIA_TYPE,
+        headers=headers
+    )
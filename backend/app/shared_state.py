@@ -0,0 +1,197 @@
+"""
+Key/value state shared between worker processes.
+
+Anything that must agree across workers (counters, rate limits, leases that
+elect a single owner for background work) goes through get_shared_state()
+instead of module globals. SHARED_STATE_BACKEND=memory keeps it in-process
+and is only correct with a single worker; redis makes it shared. Pure caches
+of deterministic results (rendered charts, exports) stay per process.
+"""
+import heapq
+import logging
+import os
+import socket
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "marketing_ai:"
+
+class SharedStateError(Exception):
+    """Raised when the shared state backend is misconfigured or unreachable"""
+    pass
+
+def worker_id() -> str:
+    """Identity of this worker process (computed per call, so it is correct after fork)."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+class SharedState(ABC):
+    """Interface of a shared state backend. Values are strings; ttl is in seconds."""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[str]:
+        """Value of a key, or None if it is missing or expired."""
+
+    @abstractmethod
+    def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        """Set a key, expiring after ttl if given."""
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """Remove a key if present."""
+
+    @abstractmethod
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        """Add to an integer counter, creating it (with ttl) if missing."""
+
+    @abstractmethod
+    def acquire_lease(self, key: str, owner: str, ttl: float) -> bool:
+        """Take or renew a lease. Returns False if another owner holds it."""
+
+    @abstractmethod
+    def release_lease(self, key: str, owner: str) -> None:
+        """Release a lease if this owner still holds it."""
+
+class MemoryState(SharedState):
+    """Process-local backend for single-worker deployments and development."""
+
+    def __init__(self):
+        self._values: Dict[str, Tuple[str, Optional[float]]] = {}
+        # (expires_at, key) of every write with a ttl; keys that are never read again are purged from it
+        self._expiries: List[Tuple[float, str]] = []
+        self._lock = threading.Lock()
+
+    def _get_locked(self, key: str) -> Optional[str]:
+        item = self._values.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._values[key]
+            return None
+        return value
+
+    def _set_locked(self, key: str, value: str, ttl: Optional[float]) -> None:
+        now = time.monotonic()
+        expires_at = now + ttl if ttl else None
+        self._values[key] = (value, expires_at)
+        if expires_at is not None:
+            heapq.heappush(self._expiries, (expires_at, key))
+        self._purge_locked(now)
+
+    def _purge_locked(self, now: float) -> None:
+        """Drop expired keys; entries left behind by rewrites and deletes are skipped."""
+        while self._expiries and self._expiries[0][0] <= now:
+            expires_at, key = heapq.heappop(self._expiries)
+            item = self._values.get(key)
+            if item is not None and item[1] == expires_at:
+                del self._values[key]
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            return self._get_locked(key)
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        with self._lock:
+            self._set_locked(key, value, ttl)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._values.pop(key, None)
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        with self._lock:
+            current = self._get_locked(key)
+            if current is None:
+                value = amount
+                self._set_locked(key, str(value), ttl)
+            else:
+                value = int(current) + amount
+                self._values[key] = (str(value), self._values[key][1])
+            return value
+
+    def acquire_lease(self, key: str, owner: str, ttl: float) -> bool:
+        with self._lock:
+            holder = self._get_locked(key)
+            if holder is not None and holder != owner:
+                return False
+            self._set_locked(key, owner, ttl)
+            return True
+
+    def release_lease(self, key: str, owner: str) -> None:
+        with self._lock:
+            if self._get_locked(key) == owner:
+                del self._values[key]
+
+# Renew only if we still own the lease, atomically
+_RENEW_LEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+_RELEASE_LEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+class RedisState(SharedState):
+    """Redis backend shared by every worker and host."""
+
+    def __init__(self, url: str):
+        try:
+            import redis
+        except ImportError:
+            raise SharedStateError("SHARED_STATE_BACKEND=redis requires the redis package")
+
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+        self._renew = self._client.register_script(_RENEW_LEASE_SCRIPT)
+        self._release = self._client.register_script(_RELEASE_LEASE_SCRIPT)
+
+    def get(self, key: str) -> Optional[str]:
+        return self._client.get(KEY_PREFIX + key)
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        self._client.set(KEY_PREFIX + key, value, px=int(ttl * 1000) if ttl else None)
+
+    def delete(self, key: str) -> None:
+        self._client.delete(KEY_PREFIX + key)
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        pipeline = self._client.pipeline()
+        pipeline.incrby(KEY_PREFIX + key, amount)
+        if ttl:
+            pipeline.pexpire(KEY_PREFIX + key, int(ttl * 1000), nx=True)
+        return int(pipeline.execute()[0])
+
+    def acquire_lease(self, key: str, owner: str, ttl: float) -> bool:
+        ttl_ms = int(ttl * 1000)
+        if self._client.set(KEY_PREFIX + key, owner, nx=True, px=ttl_ms):
+            return True
+        return bool(self._renew(keys=[KEY_PREFIX + key], args=[owner, ttl_ms]))
+
+    def release_lease(self, key: str, owner: str) -> None:
+        self._release(keys=[KEY_PREFIX + key], args=[owner])
+
+_state: Optional[SharedState] = None
+_state_lock = threading.Lock()
+
+def get_shared_state() -> SharedState:
+    """Return the configured backend (created on first use)."""
+    global _state
+    if _state is None:
+        with _state_lock:
+            if _state is None:
+                if settings.SHARED_STATE_BACKEND == "redis":
+                    _state = RedisState(settings.REDIS_URL)
+                else:
+                    _state = MemoryState()
+                logger.info(f"Using {settings.SHARED_STATE_BACKEND} shared state backend")
+    return _state
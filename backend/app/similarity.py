@@ -0,0 +1,481 @@
+"""
+Offline semantic similarity index over stored blueprints and report content.
+
+Texts are embedded with a hashed n-gram vectorizer (word unigrams, bigrams
+and character trigrams hashed into a fixed-size signed vector), so no model
+download or network access is needed. Vectors are indexed with random
+hyperplane LSH for approximate nearest-neighbour lookup and persisted to
+SIMILARITY_INDEX_PATH. generate_blueprint consults the "blueprint" namespace
+to offer an existing blueprint when a new request is nearly identical.
+
+Every entry carries the id of the user who owns the report, and every lookup
+is limited to the requesting user's entries: blueprints and report titles
+are never offered across users.
+
+Worker processes share the index files: each update is appended to a log
+next to the snapshot under an exclusive file lock, and readers apply the
+records appended since they last looked (or reload, after the snapshot was
+rewritten). Updates are embedded and written on a background thread, and
+lookups block on the files, so the async routes run them in a thread.
+"""
+import fcntl
+import hashlib
+import logging
+import os
+import re
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+KIND_BLUEPRINT = "blueprint"
+KIND_CONTENT = "content"
+
+VECTOR_DIM = 1024
+LSH_TABLES = 16
+LSH_BITS = 8
+LSH_SEED = 1729
+# Below this many entries an exact scan is cheaper than probing buckets
+EXACT_SEARCH_LIMIT = 2000
+# Report content is truncated before embedding to bound vectorization cost
+MAX_EMBED_CHARS = 20000
+INITIAL_CAPACITY = 256
+# Log records: op, kind, report id, owner, then the vector (zeros for a removal)
+_RECORD_HEADER = struct.Struct("<B16sqq")
+RECORD_SIZE = _RECORD_HEADER.size + VECTOR_DIM * 4
+OP_ADD = 1
+OP_REMOVE = 2
+# The snapshot is rewritten once the log holds this many records, or more than the index has entries
+COMPACT_MIN_RECORDS = 1000
+
+_WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+@dataclass
+class SimilarityMatch:
+    kind: str
+    report_id: int
+    similarity: float
+
+# Stored for entries without an owner; never matches a lookup
+NO_USER = -1
+
+# Separators for field-structured texts; features are namespaced per field
+_FIELD_SEPARATOR = "\x1e"
+_KEY_SEPARATOR = "\x1f"
+
+def blueprint_request_text(
+    report_type: str,
+    analysis_subject: str,
+    data_points: List[str],
+    additional_notes: Optional[str]
+) -> str:
+    """Canonical text of a blueprint request, used for both indexing and lookup."""
+    points = sorted(p.strip().lstrip("-").strip().lower() for p in data_points if p and p.strip())
+    fields = {
+        "type": report_type,
+        "subject": analysis_subject,
+        "points": " ; ".join(points),
+        "notes": additional_notes or "",
+    }
+    return _FIELD_SEPARATOR.join(f"{key}{_KEY_SEPARATOR}{value}" for key, value in fields.items())
+
+def _text_features(text: str, prefix: str = "") -> List[str]:
+    words = _WORD_PATTERN.findall(text.lower())
+    features = [prefix + w for w in words]
+    features.extend(f"{prefix}{a} {b}" for a, b in zip(words, words[1:]))
+    for word in words:
+        padded = f"#{word}#"
+        features.extend(f"{prefix}~{padded[i:i + 3]}" for i in range(len(padded) - 2))
+    return features
+
+def _features(text: str) -> List[str]:
+    if _KEY_SEPARATOR not in text:
+        return _text_features(text)
+
+    # Field-structured text: keep fields apart so a shared report type or a
+    # shared data point list cannot outweigh a different analysis subject
+    features = []
+    for field in text.split(_FIELD_SEPARATOR):
+        key, _, value = field.partition(_KEY_SEPARATOR)
+        features.extend(_text_features(value, prefix=f"{key}:"))
+    return features
+
+def embed(text: str) -> np.ndarray:
+    """
+    Embed text into a unit-length hashed n-gram vector.
+
+    Hashing uses blake2b rather than hash() so vectors are stable across
+    processes and restarts.
+    """
+    vector = np.zeros(VECTOR_DIM, dtype=np.float32)
+    for feature in _features(text[:MAX_EMBED_CHARS]):
+        h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+        vector[h % VECTOR_DIM] += 1.0 if (h >> 63) & 1 else -1.0
+
+    norm = np.linalg.norm(vector)
+    if norm > 0:
+        vector /= norm
+    return vector
+
+class SimilarityIndex:
+    """
+    Cosine-similarity index with LSH buckets, persisted as a .npz snapshot plus an append-only log.
+
+    Entries live in preallocated arrays that grow by doubling, and removed
+    entries are left as tombstones, so adding or removing one costs O(1)
+    rather than copying the index. Each change is appended to the log as one
+    fixed-size record; the snapshot is only rewritten (and the log emptied)
+    once the log outgrows it.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.log_path = f"{os.path.splitext(path)[0]}.log"
+        rng = np.random.default_rng(LSH_SEED)
+        self._planes = rng.standard_normal((LSH_TABLES * LSH_BITS, VECTOR_DIM)).astype(np.float32)
+        self._bit_weights = (1 << np.arange(LSH_BITS, dtype=np.int64))
+        self._lock = threading.RLock()
+        self._mtime: Optional[float] = None
+        self._log_offset = 0
+        self.loaded = False
+        self._clear()
+
+    def _clear(self) -> None:
+        self._vectors = np.zeros((INITIAL_CAPACITY, VECTOR_DIM), dtype=np.float32)
+        self._signatures = np.zeros((INITIAL_CAPACITY, LSH_TABLES), dtype=np.int64)
+        # Rows in use; removed entries leave a None key behind
+        self._size = 0
+        self._keys: List[Optional[Tuple[str, int]]] = []
+        self._user_ids: List[int] = []
+        self._positions: Dict[Tuple[str, int], int] = {}
+        self._owned: Dict[Tuple[str, int], Set[int]] = {}
+        self._buckets: List[Dict[int, List[int]]] = [{} for _ in range(LSH_TABLES)]
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def _signature(self, vectors: np.ndarray) -> np.ndarray:
+        bits = (vectors @ self._planes.T > 0).reshape(len(vectors), LSH_TABLES, LSH_BITS)
+        return (bits * self._bit_weights).sum(axis=2)
+
+    def _put(self, kind: str, report_id: int, user_id: int, vector: np.ndarray,
+             signature: Optional[np.ndarray] = None) -> None:
+        self._drop(kind, report_id)
+        if self._size == len(self._vectors):
+            capacity = 2 * len(self._vectors)
+            self._vectors = np.resize(self._vectors, (capacity, VECTOR_DIM))
+            self._signatures = np.resize(self._signatures, (capacity, LSH_TABLES))
+        position = self._size
+        self._size += 1
+        if signature is None:
+            signature = self._signature(vector[None, :])[0]
+        self._vectors[position] = vector
+        self._signatures[position] = signature
+        self._keys.append((kind, report_id))
+        self._user_ids.append(user_id)
+        self._positions[(kind, report_id)] = position
+        self._owned.setdefault((kind, user_id), set()).add(position)
+        for table, bucket in enumerate(signature):
+            self._buckets[table].setdefault(int(bucket), []).append(position)
+
+    def _drop(self, kind: str, report_id: int) -> None:
+        # Bucket lists keep the position; it is skipped as a tombstone
+        position = self._positions.pop((kind, report_id), None)
+        if position is None:
+            return
+        self._keys[position] = None
+        self._owned[(kind, self._user_ids[position])].discard(position)
+
+    def _apply_log(self, data: bytes) -> int:
+        """Apply the whole records in data; returns the bytes consumed."""
+        count = len(data) // RECORD_SIZE
+        for i in range(count):
+            record = data[i * RECORD_SIZE:(i + 1) * RECORD_SIZE]
+            op, kind, report_id, user_id = _RECORD_HEADER.unpack_from(record)
+            kind = kind.rstrip(b"\0").decode("ascii")
+            if op == OP_ADD:
+                vector = np.frombuffer(record, dtype=np.float32, offset=_RECORD_HEADER.size)
+                self._put(kind, report_id, user_id, vector)
+            else:
+                self._drop(kind, report_id)
+        return count * RECORD_SIZE
+
+    def load(self) -> bool:
+        """Load the snapshot and the log from disk. Returns False if no usable snapshot exists."""
+        with self._lock:
+            if not os.path.exists(self.path):
+                return False
+            mtime = os.path.getmtime(self.path)
+            with np.load(self.path) as data:
+                if "user_ids" not in data:
+                    # Saved before entries had owners: rebuilt from the database
+                    logger.info(f"Similarity index {self.path} has no owners, rebuilding it")
+                    return False
+                vectors = data["vectors"].astype(np.float32)
+                signatures = data["signatures"].astype(np.int64)
+                keys = [(str(k), int(r)) for k, r in zip(data["kinds"], data["report_ids"])]
+                user_ids = [int(u) for u in data["user_ids"]]
+            self._clear()
+            for i, (kind, report_id) in enumerate(keys):
+                self._put(kind, report_id, user_ids[i], vectors[i], signatures[i])
+            self._mtime = mtime
+            self._log_offset = 0
+            self._read_log()
+            self.loaded = True
+            logger.info(f"Loaded similarity index with {len(self)} entries from {self.path}")
+            return True
+
+    def _read_log(self) -> None:
+        try:
+            with open(self.log_path, "rb") as f:
+                f.seek(self._log_offset)
+                self._log_offset += self._apply_log(f.read())
+        except FileNotFoundError:
+            pass
+
+    def _refresh(self) -> None:
+        try:
+            mtime = os.path.getmtime(self.path)
+            log_size = os.path.getsize(self.log_path) if os.path.exists(self.log_path) else 0
+        except OSError:
+            return
+        if mtime != self._mtime or log_size < self._log_offset:
+            # Compacted by another process
+            self.load()
+        elif log_size > self._log_offset:
+            self._read_log()
+
+    def refresh(self) -> None:
+        """Catch up with the changes other processes have made."""
+        with self.file_lock(exclusive=False):
+            self._refresh()
+
+    @contextmanager
+    def file_lock(self, exclusive: bool = True) -> Iterator[None]:
+        """Cross-process lock on the index files: exclusive for changes, shared for reading them."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._lock, open(f"{self.path}.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def save(self) -> None:
+        """Write the live entries as the snapshot atomically and empty the log (under the exclusive lock)."""
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            live = sorted(self._positions.values())
+            tmp_path = f"{self.path}.{os.getpid()}.tmp.npz"
+            np.savez(
+                tmp_path,
+                vectors=self._vectors[live],
+                signatures=self._signatures[live],
+                kinds=np.array([self._keys[i][0] for i in live], dtype="U16"),
+                report_ids=np.array([self._keys[i][1] for i in live], dtype=np.int64),
+                user_ids=np.array([self._user_ids[i] for i in live], dtype=np.int64)
+            )
+            os.replace(tmp_path, self.path)
+            with open(self.log_path, "wb"):
+                pass
+            self._mtime = os.path.getmtime(self.path)
+            self._log_offset = 0
+            if self._size > len(live):
+                # Drop the tombstones from memory too
+                self.load()
+
+    def _append(self, record: bytes) -> None:
+        """Append a record to the log, after the records of other processes (under the exclusive lock)."""
+        self._refresh()
+        with open(self.log_path, "ab") as f:
+            # A record torn by a crash is cut off so the next ones stay aligned
+            if f.tell() % RECORD_SIZE:
+                f.truncate(f.tell() - f.tell() % RECORD_SIZE)
+                f.seek(0, os.SEEK_END)
+            f.write(record)
+            self._log_offset = f.tell()
+        self._apply_log(record)
+        records = self._log_offset // RECORD_SIZE
+        if records >= max(COMPACT_MIN_RECORDS, len(self)):
+            self.save()
+
+    def add(self, kind: str, report_id: int, user_id: Optional[int], text: str, persist: bool = True) -> None:
+        """
+        Add or replace the entry for (kind, report_id), owned by user_id.
+
+        With persist, the change is appended to the log; take the exclusive file_lock around it.
+        """
+        vector = embed(text)
+        user_id = NO_USER if user_id is None else user_id
+        with self._lock:
+            if persist:
+                self._append(_RECORD_HEADER.pack(OP_ADD, kind.encode("ascii"), report_id, user_id) + vector.tobytes())
+            else:
+                self._put(kind, report_id, user_id, vector)
+
+    def remove(self, report_id: int) -> None:
+        """Remove every entry of a report and log it; take the exclusive file_lock around it."""
+        with self._lock:
+            self._refresh()
+            for kind in (KIND_BLUEPRINT, KIND_CONTENT):
+                if (kind, report_id) in self._positions:
+                    self._append(_RECORD_HEADER.pack(OP_REMOVE, kind.encode("ascii"), report_id, NO_USER)
+                                 + bytes(VECTOR_DIM * 4))
+
+    def query(self, kind: str, text: str, user_id: int, top_k: int = 5) -> List[SimilarityMatch]:
+        """
+        Find the most similar entries of one kind owned by a user.
+
+        Args:
+            kind: Namespace to search (blueprint or content)
+            text: Query text
+            user_id: Only this user's entries are searched
+            top_k: Maximum number of matches
+
+        Returns:
+            Matches ordered by descending cosine similarity
+        """
+        vector = embed(text)
+        with self._lock:
+            owned = self._owned.get((kind, user_id))
+            if not owned:
+                return []
+
+            if len(owned) <= EXACT_SEARCH_LIMIT:
+                found = owned
+            else:
+                signature = self._signature(vector[None, :])[0]
+                found = set()
+                for table, bucket in enumerate(signature):
+                    found.update(self._buckets[table].get(int(bucket), ()))
+                found &= owned
+            if not found:
+                return []
+
+            candidates = np.fromiter(found, dtype=np.int64)
+            scores = self._vectors[candidates] @ vector
+            best = np.argsort(-scores)[:top_k]
+            return [
+                SimilarityMatch(kind, self._keys[candidates[i]][1], min(float(scores[i]), 1.0))
+                for i in best
+            ]
+
+_index = SimilarityIndex(settings.SIMILARITY_INDEX_PATH)
+# Index updates run here, off the event loop and in order
+_updates = ThreadPoolExecutor(max_workers=1, thread_name_prefix="similarity-index")
+
+def _blueprint_text_from_selections(form_selections: Optional[Dict[str, Any]], report_type: Optional[str]) -> Optional[str]:
+    if not form_selections or not form_selections.get("analysisSubject"):
+        return None
+    return blueprint_request_text(
+        form_selections.get("reportType") or report_type or "",
+        form_selections.get("analysisSubject", ""),
+        form_selections.get("selectedDataPoints") or [],
+        form_selections.get("additionalNotes")
+    )
+
+def _ensure_loaded(db: Optional[Session] = None) -> SimilarityIndex:
+    """Load the persisted index, or build it from stored reports the first time."""
+    if _index.loaded:
+        _index.refresh()
+        return _index
+
+    with _index.file_lock():
+        if _index.loaded or _index.load():
+            return _index
+
+        from app.content_store import load_blobs
+        from app.database import SessionLocal
+        from app.models import Report
+
+        session = db or SessionLocal()
+        try:
+            rows = session.query(
+                Report.id, Report.user_id, Report.report_type, Report.form_selections, Report.content_hash,
+                Report.status
+            ).filter(Report.blueprint_hash.isnot(None)).all()
+            contents = load_blobs(
+                session, [row.content_hash for row in rows if row.content_hash and row.status == "completed"]
+            )
+        finally:
+            if db is None:
+                session.close()
+        for row in rows:
+            text = _blueprint_text_from_selections(row.form_selections, row.report_type)
+            if text:
+                _index.add(KIND_BLUEPRINT, row.id, row.user_id, text, persist=False)
+            if row.content_hash in contents:
+                _index.add(KIND_CONTENT, row.id, row.user_id, contents[row.content_hash].decode("utf-8"), persist=False)
+        _index.loaded = True
+        _index.save()
+        logger.info(f"Built similarity index over {len(rows)} reports")
+    return _index
+
+def _add_entry(kind: str, report_id: int, user_id: Optional[int], text: str) -> None:
+    try:
+        index = _ensure_loaded()
+        with index.file_lock():
+            index.add(kind, report_id, user_id, text)
+    except Exception as e:
+        # The index is an optimisation: a failed update must not fail the report
+        logger.warning(f"Indexing report {report_id} ({kind}) failed: {str(e)}")
+
+def _remove_entries(report_id: int) -> None:
+    try:
+        if _index.loaded:
+            with _index.file_lock():
+                _index.remove(report_id)
+    except Exception as e:
+        logger.warning(f"Removing report {report_id} from the similarity index failed: {str(e)}")
+
+def index_report_blueprint(report: Any) -> None:
+    """Index a report's blueprint under the request that produced it (in the background)."""
+    text = _blueprint_text_from_selections(report.form_selections, report.report_type)
+    if text is not None:
+        _updates.submit(_add_entry, KIND_BLUEPRINT, report.id, report.user_id, text)
+
+def index_report_content(report: Any) -> None:
+    """Index a completed report's generated content (in the background)."""
+    if report.generated_content:
+        _updates.submit(_add_entry, KIND_CONTENT, report.id, report.user_id, report.generated_content)
+
+def remove_report_entries(report_id: int) -> None:
+    """Drop a deleted report from the index (in the background)."""
+    _updates.submit(_remove_entries, report_id)
+
+def wait_for_index_updates() -> None:
+    """Block until the index updates submitted so far are done."""
+    _updates.submit(lambda: None).result()
+
+def find_similar_blueprint(db: Session, request_text: str, user_id: int) -> Optional[SimilarityMatch]:
+    """
+    Return the user's closest stored blueprint if it clears SIMILARITY_REUSE_THRESHOLD.
+
+    Blocks on file access and, the first time, on building the index: call it
+    from a thread.
+
+    Args:
+        db: Database session (used to build the index on first use)
+        request_text: Output of blueprint_request_text for the new request
+        user_id: User making the request; only their reports are considered
+
+    Returns:
+        The best match above the threshold, or None
+    """
+    matches = _ensure_loaded(db).query(KIND_BLUEPRINT, request_text, user_id, top_k=1)
+    if matches and matches[0].similarity >= settings.SIMILARITY_REUSE_THRESHOLD:
+        return matches[0]
+    return None
+
+def find_similar_reports(db: Session, text: str, user_id: int, top_k: int = 5) -> List[SimilarityMatch]:
+    """Return the user's reports whose content is most similar to the given text (call it from a thread)."""
+    return _ensure_loaded(db).query(KIND_CONTENT, text, user_id, top_k=top_k)
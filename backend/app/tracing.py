@@ -0,0 +1,427 @@
+"""
+Request tracing with OpenTelemetry-compatible spans.
+
+Every HTTP request gets a server span (TracingMiddleware); code running inside
+it opens child spans with `span()` or `@traced()`. Database queries, LLM calls
+and prompt building are instrumented, so the time of a slow report can be
+split into connection checkout, queries, prompt building, provider time to
+first token and generation. Spans outside a traced request (startup,
+background pollers) are not recorded.
+
+Sampling is decided once per trace, at the request: an incoming W3C
+traceparent header is followed, otherwise TRACING_SAMPLE_RATE of requests are
+recorded. Unsampled requests carry a non-recording span, so instrumented code
+costs a context variable lookup. With TRACING_SLOW_TRACE_MS set, every request
+is recorded in memory and unsampled traces are still exported when they were
+slower than that or failed.
+
+Finished traces are queued for a background thread that exports them as OTLP
+JSON (ExportTraceServiceRequest), either appended to TRACING_FILE_PATH as one
+JSON document per line or posted to an OTLP/HTTP collector. When the queue is
+full, spans are dropped rather than slowing requests down.
+"""
+import functools
+import inspect
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.config import settings
+from app.metrics import tracing_spans_dropped_total, tracing_spans_exported_total, tracing_traces_total
+
+logger = logging.getLogger(__name__)
+
+# OTLP span kinds and status codes
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+KIND_CLIENT = 3
+STATUS_UNSET = 0
+STATUS_ERROR = 2
+
+class _Trace:
+    """Spans of one trace recorded in this process, held until the root span ends."""
+
+    __slots__ = ("trace_id", "sampled", "root", "spans", "error", "finished")
+
+    def __init__(self, trace_id: str, sampled: bool):
+        self.trace_id = trace_id
+        self.sampled = sampled
+        self.root: Optional["Span"] = None
+        self.spans: List["Span"] = []
+        self.error = False
+        self.finished = False
+
+class Span:
+    """A timed operation with attributes, part of a trace."""
+
+    recording = True
+
+    def __init__(self, trace: _Trace, name: str, kind: int, parent_id: Optional[str],
+                 attributes: Optional[Dict[str, Any]] = None):
+        self.trace = trace
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.attributes: Dict[str, Any] = dict(attributes) if attributes else {}
+        self.events: List[tuple] = []
+        self.status = STATUS_UNSET
+        self.status_message = ""
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def set_attributes(self, attributes: Dict[str, Any]) -> None:
+        self.attributes.update(attributes)
+
+    def add_event(self, name: str, **attributes: Any) -> None:
+        self.events.append((time.time_ns(), name, attributes))
+
+    def record_error(self, error: BaseException) -> None:
+        self.status = STATUS_ERROR
+        self.status_message = f"{type(error).__name__}: {error}"[:500]
+        self.trace.error = True
+
+    def end(self) -> None:
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        trace = self.trace
+        if not trace.finished:
+            trace.spans.append(self)
+            if self is trace.root:
+                _finish_trace(trace, (self.end_ns - self.start_ns) / 1e6)
+        elif trace.sampled:
+            # Outlived its request (e.g. a stream closed late): exported on its own
+            _exporter().submit([self])
+
+class _NonRecordingSpan:
+    """Stands in for the spans of an unsampled trace; every method is a no-op."""
+
+    recording = False
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def set_attributes(self, attributes: Dict[str, Any]) -> None:
+        pass
+
+    def add_event(self, name: str, **attributes: Any) -> None:
+        pass
+
+    def record_error(self, error: BaseException) -> None:
+        pass
+
+    def end(self) -> None:
+        pass
+
+NON_RECORDING_SPAN = _NonRecordingSpan()
+
+_current_span: ContextVar[Any] = ContextVar("current_span", default=NON_RECORDING_SPAN)
+
+def tracing_enabled() -> bool:
+    return settings.TRACING_EXPORTER != "off"
+
+def current_span() -> Any:
+    """The active span, or a non-recording one; safe to set attributes on either way."""
+    return _current_span.get()
+
+def _parse_traceparent(header: Optional[str]) -> Optional[tuple]:
+    """(trace_id, parent span id, sampled) from a W3C traceparent header."""
+    if not header:
+        return None
+    parts = header.strip().split("-")
+    if len(parts) < 4 or len(parts[1]) != 32 or len(parts[2]) != 16 or parts[1] == "0" * 32:
+        return None
+    try:
+        sampled = bool(int(parts[3][:2], 16) & 1)
+    except ValueError:
+        return None
+    return parts[1], parts[2], sampled
+
+def start_trace(name: str, traceparent: Optional[str] = None, attributes: Optional[Dict[str, Any]] = None) -> Any:
+    """
+    Start the server span of a request, applying the sampling policy.
+
+    Args:
+        name: Span name (renamed to the route template once it is known)
+        traceparent: Incoming W3C traceparent header, if any
+        attributes: Initial span attributes
+
+    Returns:
+        A recording Span, or a non-recording span when the trace is not kept
+    """
+    parent = _parse_traceparent(traceparent)
+    if parent is not None:
+        trace_id, parent_id, sampled = parent
+    else:
+        trace_id, parent_id = f"{random.getrandbits(128):032x}", None
+        sampled = random.random() < settings.TRACING_SAMPLE_RATE
+    if not sampled and settings.TRACING_SLOW_TRACE_MS <= 0:
+        return NON_RECORDING_SPAN
+    trace = _Trace(trace_id, sampled)
+    trace.root = Span(trace, name, KIND_SERVER, parent_id, attributes)
+    return trace.root
+
+def start_span(name: str, kind: int = KIND_INTERNAL, attributes: Optional[Dict[str, Any]] = None) -> Any:
+    """
+    Start a child of the active span without making it active (for query and stream spans).
+
+    Returns:
+        The span, which the caller must end(); non-recording outside a recorded trace
+    """
+    parent = _current_span.get()
+    if not parent.recording:
+        return NON_RECORDING_SPAN
+    return Span(parent.trace, name, kind, parent.span_id, attributes)
+
+@contextmanager
+def use_span(span: Any) -> Iterator[Any]:
+    """Make a span active for the block (without ending it)."""
+    token = _current_span.set(span)
+    try:
+        yield span
+    finally:
+        _current_span.reset(token)
+
+@contextmanager
+def span(name: str, kind: int = KIND_INTERNAL, **attributes: Any) -> Iterator[Any]:
+    """
+    Record a child span of the active one around a block.
+
+    Exceptions leaving the block mark the span as failed and propagate.
+
+    Args:
+        name: Span name
+        kind: KIND_INTERNAL or KIND_CLIENT (outgoing calls)
+        **attributes: Span attributes; dots are allowed with ** {"a.b": 1}
+
+    Yields:
+        The span (non-recording outside a recorded trace)
+    """
+    parent = _current_span.get()
+    if not parent.recording:
+        yield parent
+        return
+    child = Span(parent.trace, name, kind, parent.span_id, attributes)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.record_error(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        child.end()
+
+def traced(name: str) -> Callable:
+    """Decorator recording every call of a function (sync or async) as a span."""
+    def decorator(func: Callable) -> Callable:
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                with span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def _finish_trace(trace: _Trace, duration_ms: float) -> None:
+    trace.finished = True
+    slow = 0 < settings.TRACING_SLOW_TRACE_MS <= duration_ms
+    if trace.sampled or trace.error or slow:
+        reason = "sampled" if trace.sampled else ("error" if trace.error else "slow")
+        tracing_traces_total.inc(decision=reason)
+        # Late spans of this trace are exported too
+        trace.sampled = True
+        _exporter().submit(trace.spans)
+    else:
+        tracing_traces_total.inc(decision="dropped")
+    trace.spans = []
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+def _otlp_span(span: Span) -> Dict[str, Any]:
+    data = {
+        "traceId": span.trace.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": span.kind,
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": _otlp_attributes(span.attributes),
+        "status": {"code": span.status, "message": span.status_message} if span.status else {},
+    }
+    if span.parent_id:
+        data["parentSpanId"] = span.parent_id
+    if span.events:
+        data["events"] = [
+            {"timeUnixNano": str(ts), "name": name, "attributes": _otlp_attributes(attrs)}
+            for ts, name, attrs in span.events
+        ]
+    return data
+
+def otlp_payload(spans: List[Span]) -> Dict[str, Any]:
+    """An OTLP/JSON ExportTraceServiceRequest for a batch of spans."""
+    return {"resourceSpans": [{
+        "resource": {"attributes": _otlp_attributes({
+            "service.name": settings.TRACING_SERVICE_NAME,
+            "process.pid": os.getpid(),
+        })},
+        "scopeSpans": [{"scope": {"name": __name__}, "spans": [_otlp_span(s) for s in spans]}],
+    }]}
+
+class _Exporter(threading.Thread):
+    """Background thread batching finished spans to the file or OTLP endpoint."""
+
+    def __init__(self):
+        super().__init__(name="trace-exporter", daemon=True)
+        self.pid = os.getpid()
+        self.queue: "queue.Queue[Optional[List[Span]]]" = queue.Queue(maxsize=settings.TRACING_QUEUE_SIZE)
+        self._client = None
+
+    def submit(self, spans: List[Span]) -> None:
+        try:
+            self.queue.put_nowait(spans)
+        except queue.Full:
+            tracing_spans_dropped_total.inc(len(spans))
+
+    def run(self) -> None:
+        stop = False
+        while not stop:
+            batch: List[Span] = []
+            try:
+                item = self.queue.get(timeout=settings.TRACING_EXPORT_INTERVAL)
+                while True:
+                    if item is None:
+                        stop = True
+                        break
+                    batch.extend(item)
+                    if len(batch) >= settings.TRACING_EXPORT_BATCH_SIZE:
+                        break
+                    item = self.queue.get_nowait()
+            except queue.Empty:
+                pass
+            if batch:
+                self._export(batch)
+
+    def _export(self, batch: List[Span]) -> None:
+        try:
+            payload = json.dumps(otlp_payload(batch), separators=(",", ":"))
+            if settings.TRACING_EXPORTER == "file":
+                os.makedirs(os.path.dirname(settings.TRACING_FILE_PATH) or ".", exist_ok=True)
+                with open(settings.TRACING_FILE_PATH, "a") as f:
+                    f.write(payload + "\n")
+            else:
+                if self._client is None:
+                    import httpx
+                    self._client = httpx.Client(timeout=10)
+                response = self._client.post(
+                    settings.TRACING_OTLP_ENDPOINT, content=payload, headers={"Content-Type": "application/json"}
+                )
+                response.raise_for_status()
+            tracing_spans_exported_total.inc(len(batch))
+        except Exception as e:
+            tracing_spans_dropped_total.inc(len(batch))
+            logger.warning(f"Trace export failed ({len(batch)} spans dropped): {str(e)}")
+
+    def stop(self, timeout: float = 5.0) -> None:
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self.join(timeout)
+
+_exporter_instance: Optional[_Exporter] = None
+_exporter_lock = threading.Lock()
+
+def _exporter() -> _Exporter:
+    global _exporter_instance
+    exporter = _exporter_instance
+    # Started lazily, and again in a forked worker (threads do not survive fork)
+    if exporter is None or exporter.pid != os.getpid():
+        with _exporter_lock:
+            exporter = _exporter_instance
+            if exporter is None or exporter.pid != os.getpid():
+                exporter = _Exporter()
+                exporter.start()
+                _exporter_instance = exporter
+    return exporter
+
+def shutdown_tracing() -> None:
+    """Export the spans still queued (called on shutdown)."""
+    exporter = _exporter_instance
+    if exporter is not None and exporter.pid == os.getpid():
+        exporter.stop()
+
+class TracingMiddleware:
+    """ASGI middleware recording a server span for every HTTP request."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not tracing_enabled():
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        root = start_trace(
+            f"{method} {scope['path']}",
+            Headers(scope=scope).get("traceparent"),
+            {"http.method": method, "http.target": scope["path"]}
+        )
+        status_code = 500
+
+        async def send_traced(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                root.add_event("response_started")
+            await send(message)
+
+        with use_span(root):
+            try:
+                await self.app(scope, receive, send_traced)
+            except BaseException as e:
+                root.record_error(e)
+                raise
+            finally:
+                if root.recording:
+                    route = getattr(scope.get("route"), "path", None)
+                    if route:
+                        # Named by route template, like the HTTP metrics
+                        root.name = f"{method} {route}"
+                        root.set_attribute("http.route", route)
+                    root.set_attribute("http.status_code", status_code)
+                    if status_code >= 500:
+                        root.status = STATUS_ERROR
+                        root.trace.error = True
+                root.end()
@@ -0,0 +1,193 @@
+"""
+Cache of user records by id and username.
+
+Most page loads call /users/me/{user_id} and several routes only need to know
+that a user exists, so user rows are cached as plain dicts (the fields of the
+User schema). USER_CACHE_BACKEND=memory keeps a TTL/LRU cache per process;
+shared stores entries in the shared state backend so every worker sees the
+same entries and invalidations; off always queries.
+
+Entries are invalidated when a committed transaction changes or deletes a
+user (picked up by Session listeners, like report events). With the memory
+backend another worker may serve a stale record until USER_CACHE_TTL expires.
+"""
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Optional, Set, Tuple
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.metrics import user_cache_invalidations_total, user_cache_requests_total
+from app.models import User
+
+logger = logging.getLogger(__name__)
+
+SHARED_KEY_PREFIX = "user_cache:"
+
+_PENDING_KEY = "pending_user_invalidations"
+_RECORD_FIELDS = ("id", "username", "email", "created_at", "updated_at")
+
+class MemoryUserCache:
+    """Per-process LRU cache whose entries expire after ttl seconds."""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            record, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return record
+
+    def set(self, key: str, record: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[key] = (record, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+class SharedUserCache:
+    """Entries kept in the shared state backend (JSON, expiring after ttl)."""
+
+    def __init__(self, ttl: float):
+        from app.shared_state import get_shared_state
+
+        self.ttl = ttl
+        self._state = get_shared_state()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        value = self._state.get(SHARED_KEY_PREFIX + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key: str, record: Dict[str, Any]) -> None:
+        self._state.set(SHARED_KEY_PREFIX + key, json.dumps(record, default=_json_default), ttl=self.ttl)
+
+    def delete(self, key: str) -> None:
+        self._state.delete(SHARED_KEY_PREFIX + key)
+
+def _json_default(value: Any) -> str:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+_cache: Any = None
+_cache_lock = threading.Lock()
+
+def _get_cache() -> Any:
+    """Return the configured cache (created on first use), or None when disabled."""
+    global _cache
+    if settings.USER_CACHE_BACKEND == "off":
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                if settings.USER_CACHE_BACKEND == "shared":
+                    _cache = SharedUserCache(settings.USER_CACHE_TTL)
+                else:
+                    _cache = MemoryUserCache(settings.USER_CACHE_MAX_SIZE, settings.USER_CACHE_TTL)
+    return _cache
+
+def _id_key(user_id: int) -> str:
+    return f"id:{user_id}"
+
+def _username_key(username: str) -> str:
+    return f"username:{username}"
+
+def user_record(user: User) -> Dict[str, Any]:
+    """The cached representation of a user (fields of the User schema)."""
+    return {field: getattr(user, field) for field in _RECORD_FIELDS}
+
+def _lookup(db: Session, lookup: str, key: str, criterion: Any) -> Optional[Dict[str, Any]]:
+    cache = _get_cache()
+    if cache is not None:
+        record = cache.get(key)
+        if record is not None:
+            user_cache_requests_total.inc(lookup=lookup, result="hit")
+            return record
+        user_cache_requests_total.inc(lookup=lookup, result="miss")
+
+    user = db.query(User).filter(criterion).first()
+    if user is None:
+        # Misses are not cached, so a newly registered user is found immediately
+        return None
+
+    record = user_record(user)
+    if cache is not None:
+        cache.set(_id_key(user.id), record)
+        cache.set(_username_key(user.username), record)
+    return record
+
+def get_user_by_id(db: Session, user_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Look up a user by id, from the cache when possible.
+
+    Args:
+        db: Database session, used on a cache miss
+        user_id: User ID
+
+    Returns:
+        User record (fields of the User schema), or None if there is no such user
+    """
+    return _lookup(db, "id", _id_key(user_id), User.id == user_id)
+
+def get_user_by_username(db: Session, username: str) -> Optional[Dict[str, Any]]:
+    """
+    Look up a user by username, from the cache when possible.
+
+    Args:
+        db: Database session, used on a cache miss
+        username: Username
+
+    Returns:
+        User record (fields of the User schema), or None if there is no such user
+    """
+    return _lookup(db, "username", _username_key(username), User.username == username)
+
+def invalidate_user(user_id: int, usernames: Set[str]) -> None:
+    """Drop the cached entries of a user (under every username it was cached by)."""
+    cache = _get_cache()
+    if cache is None:
+        return
+    cache.delete(_id_key(user_id))
+    for username in usernames:
+        cache.delete(_username_key(username))
+    user_cache_invalidations_total.inc()
+
+@event.listens_for(Session, "after_flush")
+def _collect_user_changes(session: Session, flush_context: Any) -> None:
+    """Remember users updated or deleted in this flush, with old and new usernames."""
+    changed = session.info.setdefault(_PENDING_KEY, {})
+    for obj in list(session.dirty) + list(session.deleted):
+        if not isinstance(obj, User) or obj.id is None:
+            continue
+        history = inspect(obj).attrs.username.history
+        usernames = changed.setdefault(obj.id, set())
+        usernames.update(name for name in (*history.deleted, *history.unchanged, *history.added) if name)
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed(session: Session) -> None:
+    for user_id, usernames in session.info.pop(_PENDING_KEY, {}).items():
+        invalidate_user(user_id, usernames)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back(session: Session) -> None:
+    session.info.pop(_PENDING_KEY, None)
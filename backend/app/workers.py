@@ -0,0 +1,52 @@
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Any, Callable, Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """
+    Return the shared process pool, creating it on first use.
+
+    Workers are started with the 'spawn' method so they only import the
+    modules needed by the submitted function, not the whole web app.
+    """
+    global _pool
+    if _pool is None:
+        max_workers = settings.PROCESS_POOL_WORKERS or None
+        _pool = ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+        logger.info(f"Started process pool (max_workers: {_pool._max_workers})")
+    return _pool
+
+async def run_in_process(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """
+    Run a picklable, module-level function in the shared process pool.
+
+    Args:
+        func: Function to execute in a worker process
+        *args: Positional arguments for func
+        **kwargs: Keyword arguments for func
+
+    Returns:
+        The function's return value
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_process_pool(), partial(func, *args, **kwargs))
+
+def shutdown_process_pool() -> None:
+    """Shut down the shared process pool, waiting for running tasks."""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
+        logger.info("Process pool shut down")
@@ -0,0 +1,90 @@
+"""
+Throughput benchmark for concurrent report exports.
+
+Renders a batch of synthetic reports concurrently through app.export, first
+with a cold artifact cache and then warm, and prints exports per second.
+
+Usage (from backend/):
+    python -m benchmarks.export_throughput --format html --reports 40 --concurrency 8
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def build_markdown(index: int, sections: int) -> str:
+    parts = [f"# Benchmark Report {index}", ""]
+    for s in range(sections):
+        parts.extend([
+            f"## Section {s + 1}",
+            "",
+            "Market share grew **steadily** across all regions, driven by *organic* search "
+            "and a sharper focus on retention. " * 6,
+            "",
+            "- Key finding one",
+            "- Key finding two",
+            "",
+            "| Region | Revenue | Growth |",
+            "| --- | --- | --- |",
+            *[f"| R{r} | {1000 + r * 37 + index} | {r * 1.5:.1f}% |" for r in range(8)],
+            "",
+        ])
+    return "\n".join(parts)
+
+async def run_round(export_format: str, reports: list[str], concurrency: int, offset: int) -> list[float]:
+    from app.export import export_report
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+
+    async def one(i: int, markdown_text: str) -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            await export_report(offset + i, f"Benchmark Report {i}", markdown_text, export_format)
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(one(i, md) for i, md in enumerate(reports)))
+    return latencies
+
+def summarize(label: str, latencies: list[float], elapsed: float) -> None:
+    ordered = sorted(latencies)
+    p95 = ordered[max(int(len(ordered) * 0.95) - 1, 0)]
+    print(
+        f"{label:<6} {len(latencies) / elapsed:8.1f} exports/s  "
+        f"p50 {statistics.median(ordered) * 1000:7.1f} ms  p95 {p95 * 1000:7.1f} ms"
+    )
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--format", default="html", choices=["html", "pdf", "docx"])
+    parser.add_argument("--reports", type=int, default=40)
+    parser.add_argument("--sections", type=int, default=12)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=0, help="Process pool size (0 = one per CPU)")
+    args = parser.parse_args()
+
+    cache_dir = tempfile.mkdtemp(prefix="export-bench-")
+    os.environ["EXPORT_CACHE_DIR"] = cache_dir
+    os.environ["PROCESS_POOL_WORKERS"] = str(args.workers)
+
+    from app.workers import get_process_pool, shutdown_process_pool
+
+    reports = [build_markdown(i, args.sections) for i in range(args.reports)]
+    print(f"format={args.format} reports={args.reports} concurrency={args.concurrency} "
+          f"pool_workers={get_process_pool()._max_workers} cache={cache_dir}")
+
+    try:
+        for label in ("cold", "warm"):
+            start = time.perf_counter()
+            latencies = await run_round(args.format, reports, args.concurrency, offset=0)
+            summarize(label, latencies, time.perf_counter() - start)
+    finally:
+        shutdown_process_pool()
+
+if __name__ == "__main__":
+    asyncio.run(main())
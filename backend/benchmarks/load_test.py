@@ -0,0 +1,388 @@
+"""
+End-to-end load test of the API against the mock LLM provider.
+
+Starts benchmarks/mock_llm_server.py and the production server (gunicorn +
+uvicorn workers) pointed at it, seeds completed reports, then drives each
+scenario open-loop at its target rate (requests are sent on schedule whether
+or not earlier ones have finished, so queueing shows up as latency):
+
+  - blueprint: POST /api/blueprint/generate (allowReuse off, distinct subjects)
+  - report:    POST /api/reports/generate with a fixed blueprint
+  - read:      report detail, listing and search (the worker_scaling.py mix)
+
+For every scenario it reports latency percentiles, achieved throughput and
+status codes, plus CPU time and peak RSS of the server process tree. The
+result can be written as a JSON baseline (--output) and a later run compared
+against it (--compare): latency or throughput worse than --tolerance, or an
+error rate more than 1 point higher, is a regression and exits with code 1.
+
+--record DIR stores every LLM call of the run as fixtures (app/llm_fixtures.py)
+and --replay DIR serves them back instead of the mock, with the recorded
+timing (scaled by --time-scale). Requests are generated from --seed per
+scenario, so a replayed run sends the same workload; fixtures can also be
+recorded against the real providers by the server itself
+(LLM_FIXTURE_MODE=record).
+
+Usage (from backend/):
+    python -m benchmarks.load_test --duration 30 --rps blueprint=1,report=1,read=20 --output baseline.json
+    python -m benchmarks.load_test --duration 30 --compare baseline.json --tolerance 0.2
+    python -m benchmarks.load_test --provider openai --ttft 0.8 --tokens-per-second 50 --rate-limit-rate 0.05
+    python -m benchmarks.load_test --record fixtures/ --output baseline.json
+    python -m benchmarks.load_test --replay fixtures/ --compare baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from benchmarks.startup_time import git_revision  # noqa: E402
+from benchmarks.worker_scaling import free_port, request_path, seed, start_server, stop_server  # noqa: E402
+
+REPORT_TYPES = ["competitor_analysis", "business_performance", "new_partners", "market_trends", "product_launch"]
+DATA_POINTS = ["organic_traffic", "paid_search", "backlinks", "conversion_rate", "bounce_rate", "top_keywords"]
+PERCENTILES = (50, 90, 95, 99)
+# Latency percentiles checked by --compare
+LATENCY_KEYS = ("p50", "p95", "p99")
+
+def percentile(ordered: list[float], pct: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(max(int(round(len(ordered) * pct / 100)) - 1, 0), len(ordered) - 1)]
+
+def start_mock(port: int, args: argparse.Namespace) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.mock_llm_server", "--port", str(port),
+         "--ttft", str(args.ttft), "--tokens-per-second", str(args.tokens_per_second),
+         "--output-tokens", str(args.output_tokens), "--error-rate", str(args.error_rate),
+         "--rate-limit-rate", str(args.rate_limit_rate), "--jitter", str(args.jitter), "--seed", str(args.seed)],
+        cwd=BACKEND_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+
+    import httpx
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Mock LLM server exited with code {process.returncode}")
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/stats", timeout=1)
+            return process
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("Mock LLM server did not become ready within 30s")
+
+def process_tree(root: int) -> list[int]:
+    """The pid and all its descendants, from /proc."""
+    children: dict[int, list[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces; fields resume after its closing parenthesis
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    pids, pending = [], [root]
+    while pending:
+        pid = pending.pop()
+        pids.append(pid)
+        pending.extend(children.get(pid, []))
+    return pids
+
+def read_usage(pids: list[int]) -> tuple[float, int]:
+    """(CPU seconds, RSS bytes) summed over the pids."""
+    ticks = os.sysconf("SC_CLK_TCK")
+    page = os.sysconf("SC_PAGE_SIZE")
+    cpu, rss = 0.0, 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            with open(f"/proc/{pid}/statm") as f:
+                rss += int(f.read().split()[1]) * page
+        except (OSError, IndexError, ValueError):
+            continue
+        # utime and stime are fields 14 and 15 of stat, i.e. 11 and 12 after the command name
+        cpu += (int(fields[11]) + int(fields[12])) / ticks
+    return cpu, rss
+
+class ResourceSampler(threading.Thread):
+    """Samples CPU time and RSS of a process tree while the load runs."""
+
+    def __init__(self, pid: int, interval: float = 0.5):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.max_rss = 0
+        self.cpu_start = 0.0
+        self.cpu_end = 0.0
+        self._done = threading.Event()
+
+    def run(self) -> None:
+        self.cpu_start, self.max_rss = read_usage(process_tree(self.pid))
+        while not self._done.wait(self.interval):
+            self.cpu_end, rss = read_usage(process_tree(self.pid))
+            self.max_rss = max(self.max_rss, rss)
+
+    def stop(self) -> None:
+        self._done.set()
+        self.join()
+        self.cpu_end = max(self.cpu_end, read_usage(process_tree(self.pid))[0])
+
+def blueprint_request(rng: random.Random, index: int) -> dict:
+    return {
+        "reportType": rng.choice(REPORT_TYPES),
+        "analysisSubject": f"Load test subject {index} {rng.randrange(10 ** 6)}",
+        "selectedDataPoints": rng.sample(DATA_POINTS, 3),
+        "additionalNotes": "",
+        "allowReuse": False,
+    }
+
+def fetch_blueprint(base_url: str) -> dict:
+    import httpx
+
+    response = httpx.post(f"{base_url}/api/blueprint/generate",
+                          json=blueprint_request(random.Random(0), 0), timeout=120)
+    body = response.json()
+    if response.status_code != 200 or not body.get("success"):
+        raise RuntimeError(f"Could not generate the report blueprint: {response.status_code} {body}")
+    # Part of the report prompt: pinned so a replayed run sends identical prompts
+    body["blueprint"]["generatedAt"] = "2024-01-01T00:00:00"
+    return body["blueprint"]
+
+async def run_scenario(client, name: str, rps: float, duration: float, make_request, results: dict) -> None:
+    """Send requests at a fixed rate for the duration, without waiting for responses."""
+    latencies: list[float] = []
+    statuses: Counter = Counter()
+    tasks = []
+
+    async def send(index: int) -> None:
+        method, path, body = make_request(index)
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, path, json=body)
+            status = str(response.status_code)
+            # Generation endpoints report LLM failures in the body with a 200
+            if response.status_code == 200 and method == "POST":
+                payload = response.json()
+                if payload.get("success") is False or payload.get("status") == "failed":
+                    status = "200-failed"
+        except Exception as e:
+            status = type(e).__name__
+        latencies.append(time.perf_counter() - start)
+        statuses[status] += 1
+
+    start = time.perf_counter()
+    count = int(rps * duration)
+    for index in range(count):
+        delay = start + index / rps - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(send(index)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+
+    ordered = sorted(latencies)
+    errors = sum(n for status, n in statuses.items() if status != "200")
+    results[name] = {
+        "target_rps": rps,
+        "requests": len(ordered),
+        "errors": errors,
+        "error_rate": errors / len(ordered) if ordered else 0.0,
+        "achieved_rps": (len(ordered) - errors) / elapsed if elapsed else 0.0,
+        "statuses": dict(statuses),
+        "latency_ms": {
+            **{f"p{p}": percentile(ordered, p) * 1000 for p in PERCENTILES},
+            "mean": statistics.fmean(ordered) * 1000 if ordered else 0.0,
+            "max": ordered[-1] * 1000 if ordered else 0.0,
+        },
+    }
+
+async def run_load(base_url: str, rates: dict[str, float], duration: float, user_id: int,
+                   report_ids: list[int], blueprint: dict, seed_value: int) -> dict:
+    import httpx
+
+    # One generator per scenario, so each sends the same requests on every run
+    blueprint_rng = random.Random(f"{seed_value}-blueprint")
+    read_rng = random.Random(f"{seed_value}-read")
+    scenarios = {
+        "blueprint": lambda i: ("POST", "/api/blueprint/generate", blueprint_request(blueprint_rng, i)),
+        "report": lambda i: ("POST", "/api/reports/generate",
+                             {"user_id": user_id, "blueprint": blueprint, "form_selections": {}}),
+        "read": lambda i: ("GET", request_path(read_rng, user_id, report_ids), None),
+    }
+    results: dict = {}
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=100)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=300) as client:
+        await asyncio.gather(*(
+            run_scenario(client, name, rps, duration, scenarios[name], results)
+            for name, rps in rates.items() if rps > 0
+        ))
+    return results
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Regressions of the current run against a baseline, as readable lines."""
+    regressions = []
+    for name, base in baseline["scenarios"].items():
+        result = current["scenarios"].get(name)
+        if result is None:
+            continue
+        for key in LATENCY_KEYS:
+            before, after = base["latency_ms"][key], result["latency_ms"][key]
+            if before and after > before * (1 + tolerance):
+                regressions.append(f"{name} {key} {before:.1f} -> {after:.1f} ms")
+        if result["achieved_rps"] < base["achieved_rps"] * (1 - tolerance):
+            regressions.append(f"{name} throughput {base['achieved_rps']:.2f} -> {result['achieved_rps']:.2f} req/s")
+        if result["error_rate"] > base["error_rate"] + 0.01:
+            regressions.append(f"{name} error rate {base['error_rate']:.1%} -> {result['error_rate']:.1%}")
+    return regressions
+
+def parse_rates(value: str) -> dict[str, float]:
+    rates = {}
+    for item in value.split(","):
+        name, _, rate = item.partition("=")
+        if name not in ("blueprint", "report", "read"):
+            raise argparse.ArgumentTypeError(f"Unknown scenario: {name}")
+        rates[name] = float(rate)
+    return rates
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of load per scenario")
+    parser.add_argument("--rps", type=parse_rates, default="blueprint=1,report=1,read=20",
+                        help="Target requests per second per scenario")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--provider", choices=["anthropic", "openai"], default="anthropic")
+    parser.add_argument("--ttft", type=float, default=0.4, help="Mock time to first token (s)")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0, help="Mock output rate")
+    parser.add_argument("--output-tokens", type=int, default=800, help="Mock report length")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Mock 5xx rate")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Mock 429 rate")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Mock TTFT jitter")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--reports", type=int, default=50, help="Completed reports seeded for reads")
+    parser.add_argument("--sections", type=int, default=12)
+    parser.add_argument("--database-url", default=None, help="Defaults to a temporary SQLite file")
+    parser.add_argument("--record", metavar="DIR", help="Record the run's LLM calls as fixtures")
+    parser.add_argument("--replay", metavar="DIR", help="Replay LLM fixtures instead of using the mock")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="Replayed latency multiplier")
+    parser.add_argument("--output", help="Write the result as a JSON baseline")
+    parser.add_argument("--compare", help="Baseline JSON to check the result against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="load-test-")
+    mock_port = free_port()
+    env = dict(
+        os.environ,
+        DATABASE_URL=args.database_url or f"sqlite:///{work_dir}/bench.db",
+        SIMILARITY_INDEX_PATH=f"{work_dir}/similarity.npz",
+        RENDER_CACHE_DIR=f"{work_dir}/renders",
+        EXPORT_CACHE_DIR=f"{work_dir}/exports",
+        SCHEMA_CHECK="off",
+        LLM_PROVIDER=args.provider,
+        ANTHROPIC_API_KEY="mock",
+        OPENAI_API_KEY="mock",
+        ANTHROPIC_BASE_URL=f"http://127.0.0.1:{mock_port}",
+        OPENAI_BASE_URL=f"http://127.0.0.1:{mock_port}/v1",
+    )
+    if args.record or args.replay:
+        env.update(
+            LLM_FIXTURE_MODE="replay" if args.replay else "record",
+            LLM_FIXTURE_DIR=os.path.abspath(args.replay or args.record),
+            LLM_FIXTURE_TIME_SCALE=str(args.time_scale),
+        )
+    os.environ.update(env)
+
+    user_id, report_ids = seed(args.reports, args.sections)
+    config = {key: value for key, value in vars(args).items()
+              if key not in ("output", "compare", "database_url", "record", "replay")}
+    config["llm"] = "replay" if args.replay else "mock"
+    config["cpus"] = os.cpu_count()
+    print(f"duration={args.duration:g}s rps={args.rps} workers={args.workers} provider={args.provider} "
+          f"ttft={args.ttft:g}s tps={args.tokens_per_second:g} db={env['DATABASE_URL']}")
+
+    import httpx
+
+    mock = None if args.replay else start_mock(mock_port, args)
+    mock_stats = None
+    try:
+        port = free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        server = start_server(args.workers, port, env)
+        try:
+            blueprint = fetch_blueprint(base_url)
+            sampler = ResourceSampler(server.pid)
+            sampler.start()
+            scenarios = asyncio.run(run_load(base_url, args.rps, args.duration, user_id, report_ids,
+                                             blueprint, args.seed))
+            sampler.stop()
+        finally:
+            stop_server(server)
+        if mock is not None:
+            mock_stats = httpx.get(f"http://127.0.0.1:{mock_port}/stats", timeout=5).json()
+    finally:
+        if mock is not None:
+            stop_server(mock)
+
+    cpu_seconds = sampler.cpu_end - sampler.cpu_start
+    result = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "revision": git_revision(),
+        "config": config,
+        "scenarios": scenarios,
+        "resources": {
+            "cpu_seconds": cpu_seconds,
+            "cpu_percent": cpu_seconds / args.duration * 100,
+            "max_rss_mib": sampler.max_rss / (1024 * 1024),
+        },
+        "mock_llm": mock_stats,
+    }
+
+    for name, scenario in scenarios.items():
+        latency = scenario["latency_ms"]
+        print(
+            f"{name:<10} {scenario['achieved_rps']:7.2f}/{scenario['target_rps']:g} req/s  "
+            + "  ".join(f"p{p} {latency[f'p{p}']:8.1f}" for p in PERCENTILES)
+            + f"  max {latency['max']:8.1f} ms  errors {scenario['errors']}/{scenario['requests']}"
+            + (f" {scenario['statuses']}" if scenario["errors"] else "")
+        )
+    print(f"server     cpu {cpu_seconds:.1f}s ({result['resources']['cpu_percent']:.0f}%)  "
+          f"max rss {result['resources']['max_rss_mib']:.0f} MiB"
+          + (f"  llm calls {mock_stats['requests']}" if mock_stats else "  llm calls replayed"))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Baseline written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(result, baseline, args.tolerance)
+        print(f"Compared with {args.compare} (revision {baseline.get('revision')}, tolerance {args.tolerance:.0%})")
+        for line in regressions:
+            print(f"  REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print("  no regressions")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+"""
+Deterministic mock of the Anthropic Messages and OpenAI Chat Completions APIs.
+
+Lets the API be exercised and load-tested without real tokens. Point the app
+at it with:
+
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8100   ANTHROPIC_API_KEY=mock
+    OPENAI_BASE_URL=http://127.0.0.1:8100/v1   OPENAI_API_KEY=mock
+
+Endpoints: POST /v1/messages and POST /v1/chat/completions, both with
+"stream": true support in the providers' SSE formats, plus GET /stats.
+
+Responses are a pure function of the request (model, system prompt, messages,
+max_tokens), shaped after this app's prompts: blueprint requests get a
+blueprint JSON, sectioned report prompts get markdown with every section
+marker and render placeholder echoed back, anything else gets generic
+markdown. Output longer than max_tokens is cut off with stop_reason
+max_tokens / finish_reason length. A report request carrying earlier output
+in an assistant turn (a continuation) resumes in the last section marked in
+it.
+
+Latency is time to first token plus output tokens at a fixed rate. Errors
+(500 / 529) and rate limits (429 with retry-after) are injected from a
+seeded random sequence, so a run with the same request order fails the same
+requests.
+
+Usage (from backend/):
+    python -m benchmarks.mock_llm_server --port 8100 --ttft 0.4 --tokens-per-second 80
+    python -m benchmarks.mock_llm_server --error-rate 0.02 --rate-limit-rate 0.05 --seed 7
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+WORDS = (
+    "market share revenue growth retention cohort segment channel organic search paid campaign "
+    "conversion funnel pricing competitor positioning audience engagement acquisition churn region "
+    "quarter forecast margin partner launch adoption benchmark trend signal opportunity risk"
+).split()
+
+SECTION_MARKER = re.compile(r"Section marker: (<!-- section:(\S+) -->)")
+RENDER_MARKER = re.compile(r"\{\{render:[^}]+\}\}")
+OUTPUT_MARKER = re.compile(r"<!-- section:(\S+) -->")
+TOKEN = re.compile(r"\S+\s*")
+
+# Seconds between streamed events; tokens produced in between are sent together
+STREAM_TICK = 0.02
+
+class MockConfig:
+    def __init__(self, ttft: float, tokens_per_second: float, error_rate: float, rate_limit_rate: float,
+                 output_tokens: int, jitter: float, seed: int):
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.output_tokens = output_tokens
+        self.jitter = jitter
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {
+            "requests": 0, "streamed": 0, "rate_limited": 0, "errors": 0, "input_tokens": 0, "output_tokens": 0,
+            "streamed_tokens": 0,
+        }
+
+    def draw(self) -> float:
+        with self._lock:
+            return self._rng.random()
+
+    def count(self, key: str, amount: int = 1) -> None:
+        with self._lock:
+            self.stats[key] += amount
+
+    def scaled(self, seconds: float) -> float:
+        if not self.jitter:
+            return seconds
+        return max(seconds * (1 + self.jitter * (2 * self.draw() - 1)), 0.0)
+
+def _words(rng: random.Random, count: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(count))
+
+def _paragraph(rng: random.Random, sentences: int) -> str:
+    return " ".join(_words(rng, rng.randint(8, 16)).capitalize() + "." for _ in range(sentences))
+
+def _blueprint(rng: random.Random) -> str:
+    sections = []
+    title = _words(rng, 3).title()
+    sections.append({"id": "title", "type": "title", "content": f"{title} Report", "order": 0, "metadata": {}})
+    for s in range(rng.randint(4, 7)):
+        section_id = f"section_{s + 1}"
+        sections.append({
+            "id": section_id, "type": "section", "content": _words(rng, 3).title(), "order": s + 1,
+            "metadata": {"analysisType": rng.choice(["descriptive", "comparative", "predictive"])},
+        })
+        children = [("paragraph", {"estimatedLength": "2 paragraphs"}), ("paragraph", {})]
+        if s % 2 == 0:
+            children.append(("image_placeholder", {"visualizationType": rng.choice(["bar chart", "line chart"]),
+                                                   "dataSource": "semrush"}))
+        if s % 3 == 1:
+            children.append(("table_placeholder", {"dataSource": "google_analytics"}))
+        for c, (section_type, metadata) in enumerate(children):
+            sections.append({
+                "id": f"{section_id}_{c + 1}", "type": section_type, "content": _paragraph(rng, 1),
+                "order": c, "parentId": section_id, "metadata": metadata,
+            })
+    return json.dumps({"reportTitle": f"{title} Report", "sections": sections}, indent=2)
+
+def _report(rng: random.Random, prompt: str, target_tokens: int, resume_in: Optional[str] = None) -> str:
+    markers = list(SECTION_MARKER.finditer(prompt))
+    per_section = max(target_tokens // max(len(markers), 1), 40)
+    resuming = resume_in is not None and any(match.group(2) == resume_in for match in markers)
+    if resuming:
+        index = next(i for i, match in enumerate(markers) if match.group(2) == resume_in)
+        markers = markers[index:]
+    if not markers:
+        parts = ["# " + _words(rng, 4).title()]
+        while sum(len(TOKEN.findall(part)) for part in parts) < target_tokens:
+            parts.append(f"## {_words(rng, 3).title()}\n\n{_paragraph(rng, 5)}")
+        return "\n\n".join(parts)
+
+    parts = []
+    for i, match in enumerate(markers):
+        end = markers[i + 1].start() if i + 1 < len(markers) else len(prompt)
+        block = prompt[match.end():end]
+        # A resumed section goes on with its text
+        body = [] if resuming and i == 0 else [match.group(1), f"## {_words(rng, 3).title()}"]
+        while sum(len(TOKEN.findall(line)) for line in body) < per_section:
+            body.append(_paragraph(rng, 4))
+        # Placeholders the prompt asks to keep verbatim
+        body.extend(RENDER_MARKER.findall(block))
+        parts.append("\n\n".join(body))
+    return "\n\n".join(parts)
+
+def generate(
+    system: str,
+    prompt: str,
+    model: str,
+    max_tokens: int,
+    default_tokens: int,
+    earlier_output: str = ""
+) -> Tuple[List[str], bool]:
+    """Deterministic output for a request, as tokens, and whether it was cut at max_tokens."""
+    seed_parts = [model, system, prompt, max_tokens] + ([earlier_output] if earlier_output else [])
+    seed = hashlib.sha256(json.dumps(seed_parts).encode("utf-8")).digest()
+    rng = random.Random(seed)
+    if "report architect" in system:
+        text = _blueprint(rng)
+    else:
+        resume_in = OUTPUT_MARKER.findall(earlier_output)
+        text = _report(rng, prompt, min(default_tokens, max_tokens), resume_in[-1] if resume_in else None)
+    tokens = TOKEN.findall(text)
+    truncated = len(tokens) > max_tokens
+    return tokens[:max_tokens], truncated
+
+def _input_tokens(*texts: str) -> int:
+    return max(sum(len(text) for text in texts) // 4, 1)
+
+def _anthropic_error(status: int, error_type: str, message: str) -> Response:
+    headers = {"retry-after": "1"} if status == 429 else None
+    return JSONResponse({"type": "error", "error": {"type": error_type, "message": message}},
+                        status_code=status, headers=headers)
+
+def _openai_error(status: int, error_type: str, message: str) -> Response:
+    headers = {"retry-after": "1"} if status == 429 else None
+    return JSONResponse({"error": {"message": message, "type": error_type, "code": error_type}},
+                        status_code=status, headers=headers)
+
+def _inject_failure(config: MockConfig, provider: str) -> Optional[Response]:
+    roll = config.draw()
+    error = _anthropic_error if provider == "anthropic" else _openai_error
+    if roll < config.rate_limit_rate:
+        config.count("rate_limited")
+        return error(429, "rate_limit_error", "Mock rate limit")
+    if roll < config.rate_limit_rate + config.error_rate:
+        config.count("errors")
+        if provider == "anthropic":
+            return error(529, "overloaded_error", "Mock overload")
+        return error(500, "server_error", "Mock server error")
+    return None
+
+async def _paced(config: MockConfig, tokens: List[str]) -> AsyncIterator[str]:
+    """Yield text at the configured rate after the time to first token."""
+    await asyncio.sleep(config.scaled(config.ttft))
+    rate = config.tokens_per_second
+    start = time.monotonic()
+    sent = 0
+    while sent < len(tokens):
+        due = len(tokens) if rate <= 0 else min(int((time.monotonic() - start) * rate) + 1, len(tokens))
+        if due > sent:
+            # Counted as sent, so /stats shows what a cancelled stream saved
+            config.count("streamed_tokens", due - sent)
+            yield "".join(tokens[sent:due])
+            sent = due
+        if sent < len(tokens):
+            await asyncio.sleep(STREAM_TICK)
+
+def _sse(event: Optional[str], data: Dict[str, Any]) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+async def anthropic_messages(request: Request) -> Response:
+    config: MockConfig = request.app.state.config
+    body = await request.json()
+    config.count("requests")
+    failure = _inject_failure(config, "anthropic")
+    if failure is not None:
+        return failure
+
+    system = body.get("system") or ""
+    if isinstance(system, list):
+        system = "".join(block.get("text", "") for block in system)
+    texts = {"user": [], "assistant": []}
+    for message in body.get("messages", []):
+        content = message["content"]
+        if not isinstance(content, str):
+            content = "".join(block.get("text", "") for block in content)
+        texts.setdefault(message["role"], []).append(content)
+    prompt = "\n".join(texts["user"])
+    earlier = "\n".join(texts["assistant"])
+    model = body.get("model", "mock")
+    tokens, truncated = generate(
+        system, prompt, model, int(body.get("max_tokens", 1024)), config.output_tokens, earlier
+    )
+    input_tokens = _input_tokens(system, prompt, earlier)
+    stop_reason = "max_tokens" if truncated else "end_turn"
+    message_id = "msg_mock_" + hashlib.sha256("".join(tokens).encode("utf-8")).hexdigest()[:24]
+    config.count("input_tokens", input_tokens)
+    config.count("output_tokens", len(tokens))
+
+    if not body.get("stream"):
+        await asyncio.sleep(config.scaled(config.ttft) + (len(tokens) / config.tokens_per_second
+                                                           if config.tokens_per_second > 0 else 0))
+        return JSONResponse({
+            "id": message_id, "type": "message", "role": "assistant", "model": model,
+            "content": [{"type": "text", "text": "".join(tokens)}],
+            "stop_reason": stop_reason, "stop_sequence": None,
+            "usage": {"input_tokens": input_tokens, "output_tokens": len(tokens)},
+        })
+
+    config.count("streamed")
+
+    async def events() -> AsyncIterator[str]:
+        yield _sse("message_start", {"type": "message_start", "message": {
+            "id": message_id, "type": "message", "role": "assistant", "model": model, "content": [],
+            "stop_reason": None, "stop_sequence": None, "usage": {"input_tokens": input_tokens, "output_tokens": 1},
+        }})
+        yield _sse("content_block_start", {"type": "content_block_start", "index": 0,
+                                           "content_block": {"type": "text", "text": ""}})
+        async for text in _paced(config, tokens):
+            yield _sse("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                               "delta": {"type": "text_delta", "text": text}})
+        yield _sse("content_block_stop", {"type": "content_block_stop", "index": 0})
+        yield _sse("message_delta", {"type": "message_delta",
+                                     "delta": {"stop_reason": stop_reason, "stop_sequence": None},
+                                     "usage": {"output_tokens": len(tokens)}})
+        yield _sse("message_stop", {"type": "message_stop"})
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+async def openai_chat_completions(request: Request) -> Response:
+    config: MockConfig = request.app.state.config
+    body = await request.json()
+    config.count("requests")
+    failure = _inject_failure(config, "openai")
+    if failure is not None:
+        return failure
+
+    messages = body.get("messages", [])
+    system = "\n".join(m.get("content") or "" for m in messages if m.get("role") == "system")
+    prompt = "\n".join(m.get("content") or "" for m in messages if m.get("role") == "user")
+    earlier = "\n".join(m.get("content") or "" for m in messages if m.get("role") == "assistant")
+    model = body.get("model", "mock")
+    max_tokens = int(body.get("max_tokens") or body.get("max_completion_tokens") or 4096)
+    tokens, truncated = generate(system, prompt, model, max_tokens, config.output_tokens, earlier)
+    prompt_tokens = _input_tokens(system, prompt, earlier)
+    finish_reason = "length" if truncated else "stop"
+    completion_id = "chatcmpl-mock" + hashlib.sha256("".join(tokens).encode("utf-8")).hexdigest()[:24]
+    created = int(time.time())
+    config.count("input_tokens", prompt_tokens)
+    config.count("output_tokens", len(tokens))
+    usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+             "total_tokens": prompt_tokens + len(tokens)}
+
+    if not body.get("stream"):
+        await asyncio.sleep(config.scaled(config.ttft) + (len(tokens) / config.tokens_per_second
+                                                           if config.tokens_per_second > 0 else 0))
+        return JSONResponse({
+            "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)},
+                         "finish_reason": finish_reason}],
+            "usage": usage,
+        })
+
+    config.count("streamed")
+
+    def chunk(delta: Dict[str, Any], finish: Optional[str] = None) -> str:
+        return _sse(None, {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                           "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]})
+
+    async def events() -> AsyncIterator[str]:
+        yield chunk({"role": "assistant", "content": ""})
+        async for text in _paced(config, tokens):
+            yield chunk({"content": text})
+        yield chunk({}, finish_reason)
+        if (body.get("stream_options") or {}).get("include_usage"):
+            yield _sse(None, {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                              "model": model, "choices": [], "usage": usage})
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+async def stats(request: Request) -> Response:
+    return JSONResponse(request.app.state.config.stats)
+
+def create_app(config: MockConfig) -> Starlette:
+    app = Starlette(routes=[
+        Route("/v1/messages", anthropic_messages, methods=["POST"]),
+        Route("/v1/chat/completions", openai_chat_completions, methods=["POST"]),
+        Route("/stats", stats, methods=["GET"]),
+    ])
+    app.state.config = config
+    return app
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--ttft", type=float, default=0.4, help="Seconds to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=80.0, help="Output rate (0 = instant)")
+    parser.add_argument("--output-tokens", type=int, default=800, help="Length of generated reports")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failing with 5xx")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of requests answered 429")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Relative +/- jitter applied to the TTFT")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    config = MockConfig(args.ttft, args.tokens_per_second, args.error_rate, args.rate_limit_rate,
+                        args.output_tokens, args.jitter, args.seed)
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
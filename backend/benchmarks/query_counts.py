@@ -0,0 +1,160 @@
+"""
+SQL statements issued per request for the user and report routes.
+
+Runs each route in-process against a temporary SQLite database, counts the
+statements sent to the database while it is handled and compares the count
+with the route's budget. Exits with status 1 if any route exceeds its budget,
+so it can guard against reintroducing existence checks and N+1 queries.
+
+Existence of users is enforced by constraints (unique username/email, the
+reports.user_id foreign key) or folded into the main query, so the budgets
+count only the statements that do real work; refreshing a row after commit
+is one SELECT. User lookups are warmed first and answered by the user cache.
+
+Report generation is counted with the LLM stubbed out (it answers every
+section of the prompt at once), so only the route's own statements are
+measured: creating the report, storing its blobs and sections, and
+recording the outcome.
+
+Usage (from backend/):
+    python -m benchmarks.query_counts
+"""
+import logging
+import os
+import re
+import sys
+import tempfile
+from typing import Any, Callable, Dict, NamedTuple
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# Two sections with a paragraph each: enough to store several section rows
+BLUEPRINT = {
+    "reportTitle": "Query counts",
+    "reportType": "market_trends",
+    "generatedAt": "2026-01-01T00:00:00",
+    "sections": [
+        {"id": "title", "type": "title", "content": "Query counts", "order": 0, "metadata": {}},
+        {"id": "summary", "type": "section", "content": "Executive Summary", "order": 1, "metadata": {}},
+        {"id": "summary-text", "type": "paragraph", "content": "Key findings", "order": 0,
+         "parentId": "summary", "metadata": {}},
+        {"id": "traffic", "type": "section", "content": "Traffic", "order": 2, "metadata": {}},
+        {"id": "traffic-text", "type": "paragraph", "content": "Traffic trends", "order": 0,
+         "parentId": "traffic", "metadata": {}},
+    ],
+}
+
+_SECTION_MARKER_PATTERN = re.compile(r"<!-- section:\S+ -->")
+
+async def stub_llm(prompt: str, **kwargs) -> Dict[str, Any]:
+    """Answer a report prompt with a line of text under each of its section markers."""
+    content = "\n\n".join(f"{marker}\nGenerated text." for marker in _SECTION_MARKER_PATTERN.findall(prompt))
+    return {
+        "content": content,
+        "provider": "anthropic",
+        "model": "claude-3-5-sonnet-20241022",
+        "tokens_used": 100,
+        "input_tokens": 80,
+        "output_tokens": 20,
+        "stop_reason": "end_turn",
+    }
+
+class Check(NamedTuple):
+    name: str
+    budget: int
+    expected_status: int
+    call: Callable
+
+def main() -> None:
+    work_dir = tempfile.mkdtemp(prefix="query-counts-")
+    os.environ.update(
+        DATABASE_URL=f"sqlite:///{work_dir}/bench.db",
+        SIMILARITY_INDEX_PATH=f"{work_dir}/similarity.npz",
+        RENDER_CACHE_DIR=f"{work_dir}/renders",
+        EXPORT_CACHE_DIR=f"{work_dir}/exports",
+        SCHEMA_CHECK="off",
+    )
+
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event
+
+    import app.models  # noqa: F401 (registers the tables)
+    from app import continuation
+    from app.database import Base, engine
+    from app.similarity import wait_for_index_updates
+    from main import app
+
+    continuation.call_llm = stub_llm
+
+    logging.getLogger().setLevel(logging.WARNING)
+    Base.metadata.create_all(bind=engine)
+    statements = []
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    # Without a context manager the app's startup hooks (pollers, listeners) do not run
+    client = TestClient(app)
+    user = client.post("/api/users/register", json={"username": "counts", "email": "counts@example.com"}).json()
+    client.post("/api/reports", json={"user_id": user["id"], "title": "Existing report"})
+    client.post("/api/users/login", json={"username": "counts"})
+    missing_user = user["id"] + 1000
+
+    def generate_report():
+        response = client.post("/api/reports/generate", json={
+            "user_id": user["id"], "blueprint": BLUEPRINT, "form_selections": {}
+        })
+        # The similarity index is updated in the background; its first update
+        # builds the index from the database
+        wait_for_index_updates()
+        return response
+
+    generate_report()
+
+    checks = [
+        Check("POST /users/register", 2, 200,
+              lambda: client.post("/api/users/register", json={"username": "new", "email": "new@example.com"})),
+        Check("POST /users/register (duplicate)", 1, 400,
+              lambda: client.post("/api/users/register", json={"username": "counts", "email": "other@example.com"})),
+        Check("POST /users/register (duplicate email)", 1, 400,
+              lambda: client.post("/api/users/register", json={"username": "other", "email": "counts@example.com"})),
+        # Served from the user cache (filled by the login and the /users/me call before it)
+        Check("POST /users/login", 0, 200, lambda: client.post("/api/users/login", json={"username": "counts"})),
+        Check("GET /users/me/{user_id}", 0, 200, lambda: client.get(f"/api/users/me/{user['id']}")),
+        Check("GET /users/{user_id}/stats", 1, 200, lambda: client.get(f"/api/users/{user['id']}/stats")),
+        Check("GET /users/{user_id}/stats (missing user)", 1, 404,
+              lambda: client.get(f"/api/users/{missing_user}/stats")),
+        Check("POST /reports", 2, 200,
+              lambda: client.post("/api/reports", json={"user_id": user["id"], "title": "Report"})),
+        Check("POST /reports (missing user)", 1, 404,
+              lambda: client.post("/api/reports", json={"user_id": missing_user, "title": "Report"})),
+        Check("GET /reports/user/{user_id}", 1, 200, lambda: client.get(f"/api/reports/user/{user['id']}")),
+        Check("GET /reports/user/{user_id} (missing user)", 2, 404,
+              lambda: client.get(f"/api/reports/user/{missing_user}")),
+        # The report row (insert, two updates), its blobs (blueprint, prompt,
+        # content, one per section), replacing the section rows, and a refresh
+        # after each of the three commits
+        Check("POST /reports/generate", 16, 200, generate_report),
+    ]
+
+    failures = 0
+    for check in checks:
+        statements.clear()
+        response = check.call()
+        count = len(statements)
+        ok = count <= check.budget and response.status_code == check.expected_status
+        failures += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {check.name:<45} {count:>2} queries (budget {check.budget})  "
+              f"status {response.status_code}")
+        if not ok:
+            for statement in statements:
+                print(f"       {' '.join(statement.split())[:120]}")
+
+    if failures:
+        print(f"{failures} route(s) over budget or with an unexpected status")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
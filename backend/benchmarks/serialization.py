@@ -0,0 +1,145 @@
+"""
+Microbenchmark of report serialization: the default FastAPI path vs app.serialization.
+
+For 1, 50 and 500 full reports (blueprint, prompt and markdown content),
+compares:
+  - fastapi: response_model validation and dump (fastapi.routing.serialize_response)
+    followed by JSONResponse rendering, loading blobs through BlobField
+  - orjson cold: app.serialization with an empty fragment cache (blobs loaded
+    in one query and serialized once)
+  - orjson warm: app.serialization with every fragment cached (no blob reads)
+
+Rows are queried outside the timed region; blob loading is included because
+it is part of producing the body. Prints the median time over the repeats and
+the peak memory allocated while serializing (tracemalloc).
+
+Usage (from backend/):
+    python -m benchmarks.serialization --sizes 1,50,500 --repeats 5
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+def build_blueprint(index: int, sections: int) -> dict:
+    items = []
+    for s in range(sections):
+        items.append({
+            "id": f"s{s}", "type": "section", "content": f"Section {s} of report {index}", "order": s,
+            "parentId": None, "metadata": {"required": True, "dataSource": "semrush"},
+        })
+        for p in range(3):
+            items.append({
+                "id": f"s{s}-p{p}", "type": "paragraph", "order": p, "parentId": f"s{s}",
+                "content": "Describe traffic, retention and revenue trends for the selected market. " * 3,
+                "metadata": {"visualizationType": "line chart", "tags": ["traffic", "growth"]},
+            })
+    return {"reportTitle": f"Report {index}", "reportType": "market_trends", "sections": items}
+
+def build_content(index: int, sections: int) -> str:
+    parts = [f"# Report {index}"]
+    for s in range(sections):
+        parts.append(f"## Section {s}\n\n" + "Market share grew steadily across all regions. " * 40)
+        parts.append("| Region | Revenue |\n| --- | --- |\n" + "\n".join(f"| R{r} | {r * 37} |" for r in range(10)))
+    return "\n\n".join(parts)
+
+def seed(count: int, sections: int) -> list[int]:
+    from app.database import Base, SessionLocal, engine
+    from app.models import Report, User
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        user = User(username=f"ser-{time.time_ns()}", email=f"ser-{time.time_ns()}@example.com")
+        db.add(user)
+        db.flush()
+        ids = []
+        for i in range(count):
+            # Distinct content per report, so no blob is shared between rows
+            report = Report(user_id=user.id, title=f"Report {i}", status="completed", report_type="market_trends")
+            report.blueprint = build_blueprint(i, sections)
+            report.prompt_used = f"Prompt {i}\n" + "Write the report. " * 200
+            report.generated_content = build_content(i, sections)
+            db.add(report)
+            db.flush()
+            ids.append(report.id)
+        db.commit()
+        return ids
+    finally:
+        db.close()
+
+def serialize_fastapi(db, reports) -> bytes:
+    from fastapi.responses import JSONResponse
+    from fastapi.routing import serialize_response
+    from fastapi.utils import create_response_field
+
+    from app.schemas import Report as ReportSchema
+
+    field = create_response_field(name="response", type_=list[ReportSchema])
+    content = asyncio.run(serialize_response(field=field, response_content=reports))
+    return JSONResponse(content).body
+
+def serialize_orjson(db, reports) -> bytes:
+    from app.serialization import json_response, report_payloads
+
+    return json_response(report_payloads(db, reports)).body
+
+def measure(serializer, report_ids: list[int], repeats: int, clear_cache: bool) -> tuple[float, float, int]:
+    """Returns (median seconds, peak MiB allocated, body bytes)."""
+    from app.database import SessionLocal
+    from app.models import Report
+    from app.serialization import fragment_cache
+
+    times, peaks, size = [], [], 0
+    for _ in range(repeats):
+        if clear_cache:
+            fragment_cache.__init__(fragment_cache.max_bytes)
+        db = SessionLocal()
+        try:
+            reports = db.query(Report).filter(Report.id.in_(report_ids)).order_by(Report.id).all()
+            tracemalloc.start()
+            start = time.perf_counter()
+            body = serializer(db, reports)
+            times.append(time.perf_counter() - start)
+            peaks.append(tracemalloc.get_traced_memory()[1] / (1024 * 1024))
+            tracemalloc.stop()
+            size = len(body)
+        finally:
+            db.close()
+    return statistics.median(times), statistics.median(peaks), size
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1,50,500", help="Comma-separated report counts")
+    parser.add_argument("--sections", type=int, default=10, help="Sections per report")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="serialization-")
+    os.environ.update(
+        DATABASE_URL=f"sqlite:///{work_dir}/bench.db",
+        SIMILARITY_INDEX_PATH=f"{work_dir}/similarity.npz",
+        SERIALIZED_FIELD_CACHE_BYTES=str(1024 * 1024 * 1024),
+    )
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    all_ids = seed(max(sizes), args.sections)
+    print(f"sections={args.sections} repeats={args.repeats}")
+    for size in sizes:
+        ids = all_ids[:size]
+        baseline = measure(serialize_fastapi, ids, args.repeats, clear_cache=True)
+        cold = measure(serialize_orjson, ids, args.repeats, clear_cache=True)
+        warm = measure(serialize_orjson, ids, args.repeats, clear_cache=False)
+        print(f"reports={size:<4} body {baseline[2] / 1024:9.1f} KiB")
+        for name, (seconds, peak, _) in (("fastapi", baseline), ("orjson cold", cold), ("orjson warm", warm)):
+            print(f"  {name:<12} {seconds * 1000:9.2f} ms  x{baseline[0] / seconds:6.1f}  peak {peak:8.2f} MiB")
+
+if __name__ == "__main__":
+    main()
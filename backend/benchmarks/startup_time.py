@@ -0,0 +1,175 @@
+"""
+Startup time of the API: import cost of the app and time to the first response.
+
+Measures, in fresh interpreters:
+  - import time of `main` via `python -X importtime`, with the slowest
+    packages and app modules (cumulative) so regressions can be traced
+  - time from spawning the server (uvicorn, or gunicorn with --server gunicorn)
+    until /api/health answers, which includes startup hooks
+
+Each measurement is repeated and the median reported. --record appends the
+result as a JSON line (with timestamp and git revision) so startup time can be
+tracked across changes.
+
+Startup no longer creates tables, so the benchmark database is prepared here:
+on SQLite with create_all and `alembic stamp head`, on Postgres with
+`alembic upgrade head`.
+
+Usage (from backend/):
+    python -m benchmarks.startup_time --runs 5
+    python -m benchmarks.startup_time --server gunicorn --record benchmarks/startup_history.jsonl
+"""
+import argparse
+import json
+import os
+import re
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| *(\S+)")
+
+def prepare_database(env: dict) -> None:
+    if env["DATABASE_URL"].startswith("sqlite"):
+        subprocess.run(
+            [sys.executable, "-c", "from app.database import Base, engine; import app.models; "
+             "Base.metadata.create_all(bind=engine)"],
+            cwd=BACKEND_DIR, env=env, check=True
+        )
+        command = ["stamp", "head"]
+    else:
+        command = ["upgrade", "head"]
+    subprocess.run(
+        [sys.executable, "-m", "alembic", *command],
+        cwd=BACKEND_DIR, env=env, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+def measure_import(env: dict) -> tuple[float, dict[str, float]]:
+    """Import `main` once; returns (total seconds, cumulative seconds per package and app module)."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    packages: dict[str, float] = {}
+    total = 0.0
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        cumulative = int(match.group(2)) / 1_000_000
+        name = match.group(3)
+        if name == "main":
+            total = cumulative
+        elif "." not in name or name.startswith("app."):
+            # Package roots and our own modules; nested entries overlap
+            packages[name] = cumulative
+    return total, packages
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def server_command(server: str, port: int) -> list[str]:
+    if server == "gunicorn":
+        return [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "main:app"]
+    return [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)]
+
+def measure_first_response(server: str, env: dict) -> float:
+    """Seconds from spawning the server until /api/health returns 200."""
+    import httpx
+
+    port = free_port()
+    server_env = dict(env, PORT=str(port), WEB_CONCURRENCY="1")
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        server_command(server, port),
+        cwd=BACKEND_DIR,
+        env=server_env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    try:
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"Server exited with code {process.returncode}")
+            try:
+                if httpx.get(f"http://127.0.0.1:{port}/api/health", timeout=1).status_code == 200:
+                    return time.perf_counter() - start
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.01)
+        raise RuntimeError("Server did not become ready within 60s")
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--server", choices=["uvicorn", "gunicorn"], default="uvicorn")
+    parser.add_argument("--top", type=int, default=10, help="Slowest imports to list")
+    parser.add_argument("--database-url", default=None, help="Defaults to a temporary SQLite file")
+    parser.add_argument("--record", default=None, help="Append the result as a JSON line to this file")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="startup-time-")
+    env = dict(
+        os.environ,
+        DATABASE_URL=args.database_url or f"sqlite:///{work_dir}/bench.db",
+        SIMILARITY_INDEX_PATH=f"{work_dir}/similarity.npz",
+        RENDER_CACHE_DIR=f"{work_dir}/renders",
+        EXPORT_CACHE_DIR=f"{work_dir}/exports",
+    )
+    prepare_database(env)
+
+    import_runs = [measure_import(env) for _ in range(args.runs)]
+    import_total = statistics.median(total for total, _ in import_runs)
+    packages = {
+        name: statistics.median(run.get(name, 0.0) for _, run in import_runs)
+        for name in import_runs[0][1]
+    }
+    first_response = statistics.median(measure_first_response(args.server, env) for _ in range(args.runs))
+
+    print(f"runs={args.runs} server={args.server} db={env['DATABASE_URL']}")
+    print(f"import main          {import_total * 1000:8.1f} ms")
+    print(f"first response       {first_response * 1000:8.1f} ms")
+    print("slowest imports (cumulative, nested entries overlap):")
+    for name, seconds in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"  {name:<24} {seconds * 1000:8.1f} ms")
+
+    if args.record:
+        record = {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "revision": git_revision(),
+            "server": args.server,
+            "runs": args.runs,
+            "import_ms": round(import_total * 1000, 1),
+            "first_response_ms": round(first_response * 1000, 1),
+        }
+        with open(args.record, "a") as f:
+            f.write(json.dumps(record) + "\n")
+        print(f"recorded to {args.record}")
+
+if __name__ == "__main__":
+    main()
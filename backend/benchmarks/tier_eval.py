@@ -0,0 +1,171 @@
+"""
+Compare latency and cost of the model tiers on recorded LLM fixtures.
+
+Reads the fixtures in one or more directories (app/llm_fixtures.py) and
+groups the non-streaming calls by task and by the tier of their model
+(app/preflight.py MODEL_TIERS). Tasks are told apart by their prompts:
+blueprint, section (a report written in full) or repair (the changed sections
+of a report rewritten). For each group it prints the number of calls and
+errors, latency percentiles, output tokens per second, and the cost per call
+at the tier's prices.
+
+Requests recorded on more than one tier (same prompts and budget, different
+model) are also compared like for like: only on those requests, the mean
+latency and cost of each tier relative to the standard tier. To get them,
+record the same workload again with a task moved to another tier
+(LLM_TASK_TIERS). load_test.py writes its reports from a blueprint generated
+at the start of the run, so move one task at a time: with the blueprint task
+moved, the report prompts change too. The mock LLM server answers every model
+at the same speed, so meaningful latencies come from fixtures recorded
+against the providers (LLM_FIXTURE_MODE=record).
+
+Usage (from backend/):
+    python -m benchmarks.load_test --seed 1 --record fixtures/
+    LLM_TASK_TIERS='{"section": "economy"}' python -m benchmarks.load_test --seed 1 --record fixtures/
+    LLM_TASK_TIERS='{"blueprint": "economy"}' python -m benchmarks.load_test --seed 1 --record fixtures/
+    python -m benchmarks.tier_eval fixtures/
+"""
+import argparse
+import gzip
+import json
+import os
+import statistics
+from collections import defaultdict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from app.llm_fixtures import fixture_key
+from app.model_routing import TASK_BLUEPRINT, TASK_REPAIR, TASK_SECTION
+from app.preflight import MODEL_TIERS, TIER_ORDER, TIER_STANDARD, ModelTier, tier_of_model
+from app.report_service import build_report_generation_system_prompt
+
+# First line of the prompt of blueprint_to_revision_prompt
+REVISION_HEADER = "REPORT REVISION INSTRUCTIONS"
+
+def load_records(directories: List[str]) -> Iterator[Dict[str, Any]]:
+    """Every recorded call in the fixture directories."""
+    for directory in directories:
+        for root, _, files in os.walk(directory):
+            for name in sorted(files):
+                if not name.endswith(".jsonl.gz"):
+                    continue
+                with gzip.open(os.path.join(root, name), "rt", encoding="utf-8") as f:
+                    for line in f:
+                        if line.strip():
+                            yield json.loads(line)
+
+def task_of(request: Dict[str, Any], report_system_prompt: str) -> str:
+    if request.get("system_prompt") != report_system_prompt:
+        return TASK_BLUEPRINT
+    return TASK_REPAIR if REVISION_HEADER in request["prompt"] else TASK_SECTION
+
+def model_of(request: Dict[str, Any]) -> Tuple[str, Optional[ModelTier]]:
+    """Model a request was made on (None: the provider's default) and its tier entry."""
+    provider = request["provider"]
+    tiers = MODEL_TIERS.get(provider, [])
+    model = request.get("model") or (tiers[0].model if tiers else "default")
+    return model, tier_of_model(provider, model)
+
+def summarize(records: List[Dict[str, Any]], tier: Optional[ModelTier]) -> Dict[str, Any]:
+    ok = [record for record in records if "result" in record]
+    latencies = sorted(record["latency"] for record in ok)
+    output_tokens = [record["result"].get("output_tokens") or 0 for record in ok]
+    costs = [
+        tier.cost(record["result"].get("input_tokens") or 0, record["result"].get("output_tokens") or 0)
+        for record in ok
+    ] if tier else []
+    return {
+        "calls": len(records),
+        "errors": len(records) - len(ok),
+        "p50": latencies[len(latencies) // 2] if latencies else None,
+        "p95": latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)] if latencies else None,
+        "mean_latency": statistics.fmean(latencies) if latencies else None,
+        "output_tokens": statistics.fmean(output_tokens) if output_tokens else None,
+        "tokens_per_second": sum(output_tokens) / sum(latencies) if latencies and sum(latencies) else None,
+        "cost": statistics.fmean(costs) if costs else None,
+        "total_cost": sum(costs),
+    }
+
+def _fmt(value: Optional[float], spec: str) -> str:
+    if value is None:
+        return "-".rjust(int(spec.split(".")[0]))
+    return format(value, spec)
+
+def _tier_rank(name: str) -> int:
+    return TIER_ORDER.index(name) if name in TIER_ORDER else len(TIER_ORDER)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directories", nargs="+", help="Fixture directories (LLM_FIXTURE_DIR)")
+    parser.add_argument("--provider", choices=sorted(MODEL_TIERS), help="Only calls to this provider")
+    args = parser.parse_args()
+
+    report_system_prompt = build_report_generation_system_prompt()
+    groups: Dict[Tuple[str, str, str], List[Dict[str, Any]]] = defaultdict(list)
+    entries: Dict[str, Optional[ModelTier]] = {}
+    # Requests by everything but their model, for the like-for-like comparison
+    by_request: Dict[Tuple[str, str], Dict[str, List[Dict[str, Any]]]] = defaultdict(lambda: defaultdict(list))
+    streams = 0
+    for record in load_records(args.directories):
+        request = record["request"]
+        if args.provider and request["provider"] != args.provider:
+            continue
+        if request["kind"] != "call":
+            # Streamed calls carry no token usage
+            streams += 1
+            continue
+        task = task_of(request, report_system_prompt)
+        model, tier = model_of(request)
+        tier_name = tier.name if tier else "unknown"
+        entries[model] = tier
+        groups[(task, tier_name, model)].append(record)
+        key = fixture_key({k: v for k, v in request.items() if k != "model"})
+        by_request[(task, key)][tier_name].append(record)
+
+    if not groups:
+        print(f"No recorded calls in {', '.join(args.directories)}")
+        return
+
+    print(f"{'task':<10}{'tier':<10}{'model':<28}{'calls':>6}{'errors':>7}{'p50 s':>8}{'p95 s':>8}"
+          f"{'out tok':>9}{'tok/s':>8}{'$/call':>10}{'$ total':>10}")
+    for (task, tier_name, model), records in sorted(groups.items(), key=lambda item: (
+        item[0][0], _tier_rank(item[0][1]), item[0][2]
+    )):
+        stats = summarize(records, entries[model])
+        print(f"{task:<10}{tier_name:<10}{model[:27]:<28}{stats['calls']:>6}{stats['errors']:>7}"
+              f"{_fmt(stats['p50'], '8.2f')}{_fmt(stats['p95'], '8.2f')}{_fmt(stats['output_tokens'], '9.0f')}"
+              f"{_fmt(stats['tokens_per_second'], '8.1f')}{_fmt(stats['cost'], '10.5f')}{stats['total_cost']:10.4f}")
+    if streams:
+        print(f"({streams} streamed calls skipped)")
+
+    # Like for like: requests recorded on the standard tier and another one
+    paired: Dict[Tuple[str, str], List[Tuple[Dict[str, Any], Dict[str, Any]]]] = defaultdict(list)
+    for (task, _), tiers in by_request.items():
+        if TIER_STANDARD not in tiers:
+            continue
+        for tier_name, records in tiers.items():
+            if tier_name == TIER_STANDARD:
+                continue
+            standard = summarize(tiers[TIER_STANDARD], model_of(tiers[TIER_STANDARD][0]["request"])[1])
+            other = summarize(records, model_of(records[0]["request"])[1])
+            if standard["mean_latency"] and other["mean_latency"] is not None:
+                paired[(task, tier_name)].append((standard, other))
+    if not paired:
+        print("\nNo request was recorded on both the standard tier and another one")
+        return
+
+    print(f"\nSame requests, relative to the {TIER_STANDARD} tier")
+    print(f"{'task':<10}{'tier':<10}{'requests':>9}{'latency':>10}{'cost':>10}{'out tok':>10}")
+    for (task, tier_name), pairs in sorted(paired.items(), key=lambda item: (item[0][0], _tier_rank(item[0][1]))):
+        latency = statistics.fmean(other["mean_latency"] for _, other in pairs) / statistics.fmean(
+            standard["mean_latency"] for standard, _ in pairs)
+        costs = [
+            (standard["cost"], other["cost"]) for standard, other in pairs
+            if standard["cost"] and other["cost"] is not None
+        ]
+        cost = statistics.fmean(o for _, o in costs) / statistics.fmean(s for s, _ in costs) if costs else None
+        tokens = statistics.fmean(other["output_tokens"] or 0 for _, other in pairs) / max(
+            statistics.fmean(standard["output_tokens"] or 0 for standard, _ in pairs), 1)
+        print(f"{task:<10}{tier_name:<10}{len(pairs):>9}{latency:>9.2f}x{_fmt(cost, '9.2f')}x{tokens:>9.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Summarize exported traces: where the time of each request went.
+
+Reads the OTLP JSON lines written with TRACING_EXPORTER=file and splits every
+request (server span) into connection checkout, queries, prompt building
+(placeholder rendering included), LLM calls, blueprint parsing and the rest
+(routing, serialization, unaccounted time). LLM time is further split into
+time to first token for streamed calls, the number of attempts and the
+backoff after rate limits.
+
+Prints the mean breakdown per route, then the slowest requests.
+
+Usage (from backend/):
+    TRACING_EXPORTER=file TRACING_SAMPLE_RATE=1 python -m benchmarks.load_test --duration 20
+    python -m benchmarks.trace_summary /tmp/marketing_ai/traces.jsonl --slowest 10
+"""
+import argparse
+import json
+import statistics
+from collections import defaultdict
+
+CATEGORIES = {
+    "db.checkout": "checkout",
+    "db.query": "queries",
+    "report.build_prompt": "prompt",
+    "report.build_revision_prompt": "prompt",
+    "report.render_placeholders": "prompt",
+    "llm.call": "llm",
+    "llm.stream": "llm",
+    "blueprint.parse_response": "parse",
+}
+COLUMNS = ("checkout", "queries", "prompt", "llm", "parse", "other")
+
+def _value(value: dict):
+    for key in ("stringValue", "boolValue", "doubleValue"):
+        if key in value:
+            return value[key]
+    return int(value["intValue"]) if "intValue" in value else None
+
+def load_spans(path: str) -> list[dict]:
+    spans = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            for resource in json.loads(line)["resourceSpans"]:
+                for scope in resource["scopeSpans"]:
+                    for span in scope["spans"]:
+                        span["attributes"] = {a["key"]: _value(a["value"]) for a in span.get("attributes", [])}
+                        span["duration_ms"] = (int(span["endTimeUnixNano"]) - int(span["startTimeUnixNano"])) / 1e6
+                        spans.append(span)
+    return spans
+
+def breakdown(root: dict, spans: list[dict]) -> dict:
+    """Milliseconds per category for one request; nested spans count once, under the outermost."""
+    by_id = {span["spanId"]: span for span in spans}
+    result = dict.fromkeys(COLUMNS, 0.0)
+    result.update(total=root["duration_ms"], ttft=0.0, attempts=0, backoff=0.0)
+    for span in spans:
+        if span["name"] == "llm.attempt":
+            result["attempts"] += 1
+        if span["name"] == "llm.stream":
+            result["attempts"] += 1
+            result["ttft"] += span["attributes"].get("llm.time_to_first_token_ms") or 0.0
+        for event in span.get("events", []):
+            if event["name"] == "llm.retry_backoff":
+                attributes = {a["key"]: _value(a["value"]) for a in event.get("attributes", [])}
+                result["backoff"] += (attributes.get("wait_seconds") or 0) * 1000
+        category = CATEGORIES.get(span["name"])
+        if category is None:
+            continue
+        parent = by_id.get(span.get("parentSpanId"))
+        nested = False
+        while parent is not None:
+            if parent["name"] in CATEGORIES:
+                nested = True
+                break
+            parent = by_id.get(parent.get("parentSpanId"))
+        if not nested:
+            result[category] += span["duration_ms"]
+    result["other"] = max(result["total"] - sum(result[c] for c in COLUMNS if c != "other"), 0.0)
+    return result
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", nargs="?", default="/tmp/marketing_ai/traces.jsonl")
+    parser.add_argument("--slowest", type=int, default=10, help="Slowest requests to list")
+    args = parser.parse_args()
+
+    traces = defaultdict(list)
+    for span in load_spans(args.path):
+        traces[span["traceId"]].append(span)
+
+    requests = []
+    for spans in traces.values():
+        for root in (span for span in spans if span["kind"] == 2):
+            route = root["attributes"].get("http.route") or root["name"]
+            requests.append((root["attributes"].get("http.method", ""), route, root, breakdown(root, spans)))
+
+    if not requests:
+        print(f"No requests in {args.path}")
+        return
+
+    header = "".join(f"{name:>10}" for name in ("total", *COLUMNS, "ttft"))
+    print(f"{'route':<44}{'n':>6}{header}   (mean ms)")
+    by_route = defaultdict(list)
+    for method, route, _, result in requests:
+        by_route[f"{method} {route}"].append(result)
+    for route, results in sorted(by_route.items(), key=lambda item: -sum(r["total"] for r in item[1])):
+        means = "".join(f"{statistics.fmean(r[c] for r in results):10.1f}" for c in ("total", *COLUMNS, "ttft"))
+        print(f"{route[:43]:<44}{len(results):>6}{means}")
+
+    print(f"\nSlowest {args.slowest} requests")
+    print(f"{'route':<44}{'status':>6}{header}  attempts  backoff")
+    for method, route, root, result in sorted(requests, key=lambda item: -item[3]["total"])[:args.slowest]:
+        values = "".join(f"{result[c]:10.1f}" for c in ("total", *COLUMNS, "ttft"))
+        status = root["attributes"].get("http.status_code", "")
+        print(f"{(method + ' ' + route)[:43]:<44}{status:>6}{values}{result['attempts']:>10}{result['backoff']:9.0f}")
+
+if __name__ == "__main__":
+    main()
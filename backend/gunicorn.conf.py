@@ -0,0 +1,59 @@
+"""
+Production server configuration: gunicorn managing uvicorn worker processes.
+
+    gunicorn -c gunicorn.conf.py main:app
+
+Tunables come from the environment:
+    WEB_CONCURRENCY   worker processes (settings.WEB_CONCURRENCY, which the
+                      per-worker limits such as LLM_MAX_CONCURRENCY and
+                      DB_POOL_SIZE are sized against)
+    PORT              listen port (default 8000)
+    GUNICORN_PRELOAD  import the app once in the master before forking (default 1)
+    GRACEFUL_TIMEOUT  seconds a stopping worker gets to finish in-flight requests,
+                      including LLM generations (default: REPORT_DEADLINE_SECONDS
+                      plus LLM_REPORT_MAX_WAIT plus 30)
+
+More than one worker needs SHARED_STATE_BACKEND=redis and EVENTS_BACKEND=postgres
+so batch pollers and report events are coordinated across processes.
+"""
+import os
+
+from app.config import settings
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = settings.WEB_CONCURRENCY
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Preloading shares the imported app (and its memory pages) between workers
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") not in ("0", "false", "False")
+
+# On SIGTERM a worker stops accepting connections and waits for in-flight
+# requests to finish; report generation holds its request open for the whole
+# LLM call, so this must cover the slowest generation: its queue wait and its
+# deadline. Event streams end on their own within EVENTS_STREAM_MAX_AGE.
+# Reports a worker is still generating when it stops are marked failed (main.py).
+graceful_timeout = int(os.environ.get(
+    "GRACEFUL_TIMEOUT",
+    (settings.REPORT_DEADLINE_SECONDS or 3600) + settings.LLM_REPORT_MAX_WAIT + 30
+))
+timeout = graceful_timeout + 30
+keepalive = 5
+
+def post_fork(server, worker):
+    # Connections opened by the master during preload must not be shared
+    from app.database import engine
+
+    engine.dispose(close=False)
+
+def when_ready(server):
+    if workers > 1:
+        if settings.SHARED_STATE_BACKEND == "memory":
+            server.log.warning(
+                f"Running {workers} workers with SHARED_STATE_BACKEND=memory: "
+                "batch poller leases and per-user LLM slots are not shared between workers"
+            )
+        if settings.EVENTS_BACKEND == "memory":
+            server.log.warning(
+                f"Running {workers} workers with EVENTS_BACKEND=memory: "
+                "event streams only see reports handled by their own worker"
+            )
@@ -1,14 +1,26 @@
 import logging
+import time
 from datetime import datetime
 from typing import Dict
 
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
 import colorlog
 
-from app.database import engine, Base
+from app.database import SessionLocal, check_schema_version, is_statement_timeout
 from app.routes import router
 from app.config import settings
+from app.batch import start_poller_supervisor, stop_pollers
+from app.compression import CompressionMiddleware
+from app.events import start_event_listener, stop_event_listener
+from app.idempotency import IdempotencyMiddleware
+from app.metrics import db_statement_timeouts_total, http_request_duration_seconds_total, http_requests_total
+from app.report_service import interrupt_generating_reports, recover_interrupted_reports
+from app.profiling import ProfilingMiddleware, profiling_enabled
+from app.tracing import TracingMiddleware, shutdown_tracing
+from app.workers import shutdown_process_pool
 
 handler = colorlog.StreamHandler()
 handler.setFormatter(colorlog.ColoredFormatter(
@@ -26,10 +38,11 @@ logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 logger.addHandler(handler)
 
-Base.metadata.create_all(bind=engine)
-
-app = FastAPI(title="Marketing AI Agent API", version="1.0.0")
+app = FastAPI(title="Marketing AI Agent API", version="1.0.0", default_response_class=ORJSONResponse)
 
+# Innermost, so stored responses are kept uncompressed and compressed per replay
+app.add_middleware(IdempotencyMiddleware)
+app.add_middleware(CompressionMiddleware, minimum_size=settings.COMPRESSION_MIN_SIZE)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000"],
@@ -37,20 +50,79 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Added after compression and CORS so the server span includes them
+app.add_middleware(TracingMiddleware)
+if profiling_enabled():
+    # Not installed at all otherwise, so profiling costs nothing when off
+    app.add_middleware(ProfilingMiddleware)
 
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
     timestamp = datetime.now().isoformat()
     logger.info(f"{request.method} {request.url.path} - {timestamp}")
+    start_time = time.perf_counter()
     response = await call_next(request)
+
+    # Label by route template so ids in paths do not multiply series
+    route = request.scope.get("route")
+    route_path = getattr(route, "path", "unmatched")
+    http_requests_total.inc(method=request.method, route=route_path, status=str(response.status_code))
+    http_request_duration_seconds_total.inc(
+        time.perf_counter() - start_time, method=request.method, route=route_path
+    )
     return response
 
 app.include_router(router, prefix="/api")
 
+@app.exception_handler(PoolTimeoutError)
+async def pool_timeout_handler(request: Request, exc: PoolTimeoutError) -> JSONResponse:
+    logger.warning(f"No database connection free within {settings.DB_POOL_TIMEOUT}s: {request.url.path}")
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Database is busy, please retry"},
+        headers={"Retry-After": "1"}
+    )
+
+@app.exception_handler(OperationalError)
+async def operational_error_handler(request: Request, exc: OperationalError) -> JSONResponse:
+    if not is_statement_timeout(exc):
+        raise exc
+    db_statement_timeouts_total.inc()
+    logger.warning(f"Statement timeout: {request.url.path}")
+    return JSONResponse(status_code=503, content={"detail": "Database query timed out"})
+
+@app.on_event("startup")
+async def startup() -> None:
+    check_schema_version()
+    with SessionLocal() as db:
+        recovered = recover_interrupted_reports(db)
+    if recovered:
+        logger.warning(f"Marked {recovered} interrupted reports as failed")
+    start_poller_supervisor()
+    await start_event_listener()
+
+@app.on_event("shutdown")
+async def shutdown() -> None:
+    with SessionLocal() as db:
+        interrupted = interrupt_generating_reports(db)
+    if interrupted:
+        logger.warning(f"Shutting down with {interrupted} reports still generating: marked as failed")
+    await stop_event_listener()
+    await stop_pollers()
+    shutdown_process_pool()
+    shutdown_tracing()
+
 @app.get("/")
 async def root() -> Dict[str, str]:
     return {"message": "Marketing AI Agent API", "version": "1.0.0"}
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
+    # Production runs under gunicorn (see gunicorn.conf.py); this is for local runs
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        reload=settings.UVICORN_RELOAD,
+        workers=None if settings.UVICORN_RELOAD else settings.WEB_CONCURRENCY
+    )
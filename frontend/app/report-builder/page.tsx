@@ -1,6 +1,6 @@
 'use client';
 
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { useUser } from '@/contexts/UserContext';
 import { useRouter } from 'next/navigation';
 import FormWizard from '@/components/ReportBuilder/FormWizard/FormWizard';
@@ -23,7 +23,14 @@ export default function ReportBuilderPage() {
   const [generatedPrompt, setGeneratedPrompt] = useState<string | null>(null);
   const [isGenerating, setIsGenerating] = useState(false);
   const [currentReport, setCurrentReport] = useState<Report | null>(null);
-  const [reportPollingInterval, setReportPollingInterval] = useState<NodeJS.Timeout | null>(null);
+  const [generationProgress, setGenerationProgress] = useState(0);
+  const reportSubscription = useRef<(() => void) | null>(null);
+  // One key per generation: double clicks and retries after an error reuse it
+  const generationKey = useRef<string | null>(null);
+
+  useEffect(() => {
+    generationKey.current = null;
+  }, [blueprint, formSelections]);
 
   // Redirect if not authenticated
   React.useEffect(() => {
@@ -32,31 +39,27 @@ export default function ReportBuilderPage() {
     }
   }, [user, isLoading, router]);
 
-  // Cleanup polling interval on unmount
+  // Close the report event stream on unmount
   useEffect(() => {
     return () => {
-      if (reportPollingInterval) {
-        clearInterval(reportPollingInterval);
-      }
+      reportSubscription.current?.();
     };
-  }, [reportPollingInterval]);
+  }, []);
 
-  // Poll for report status updates
-  const pollReportStatus = async (reportId: number) => {
+  // Fetch the report once its status changes
+  const refreshReport = async (reportId: number) => {
     try {
       const report = await api.getReport(reportId);
       setCurrentReport(report);
 
-      // Stop polling if the report is completed or failed
-      if (report.status === 'completed' || report.status === 'failed') {
-        if (reportPollingInterval) {
-          clearInterval(reportPollingInterval);
-          setReportPollingInterval(null);
-        }
+      // Stop listening once the report is completed, failed or cancelled
+      if (report.status === 'completed' || report.status === 'failed' || report.status === 'cancelled') {
+        reportSubscription.current?.();
+        reportSubscription.current = null;
         setIsGenerating(false);
       }
     } catch (error) {
-      console.error('Error polling report status:', error);
+      console.error('Error fetching report status:', error);
     }
   };
 
@@ -94,31 +97,58 @@ export default function ReportBuilderPage() {
     if (!blueprint || !user) return;
 
     setIsGenerating(true);
+    setGenerationProgress(0);
+
+    // Subscribe before starting: the request only returns once generation is
+    // over, and progress is pushed while it runs. Until the response names the
+    // report, progress of this user's interactive report with this title is shown.
+    let reportId: number | null = null;
+    const title = blueprint.reportTitle;
+    reportSubscription.current?.();
+    reportSubscription.current = api.subscribeToReportEvents(user.id, {
+      onStatus: (event) => {
+        if (event.report_id === reportId && event.progress === 1) {
+          refreshReport(event.report_id);
+        }
+      },
+      onProgress: (event) => {
+        const ours = reportId === null
+          ? event.batch_id === null && event.title === title
+          : event.report_id === reportId;
+        if (ours) {
+          setGenerationProgress(event.progress);
+        }
+      },
+      onResync: () => {
+        if (reportId !== null) {
+          refreshReport(reportId);
+        }
+      },
+    });
 
     try {
       const prompt = blueprintToPrompt(blueprint);
       setGeneratedPrompt(prompt);
 
+      generationKey.current ??= crypto.randomUUID();
       const response = await api.generateReportFromBlueprint({
         user_id: user.id,
         blueprint: blueprint,
         form_selections: formSelections || {},
-      });
-
-      console.log('Report generation started:', response);
-
-      const initialReport = await api.getReport(response.report_id);
-      setCurrentReport(initialReport);
+        // Regenerating: unchanged sections of the previous report are reused
+        base_report_id: currentReport?.status === 'completed' ? currentReport.id : undefined,
+      }, generationKey.current);
+      generationKey.current = null;
 
-      const interval = setInterval(() => {
-        pollReportStatus(response.report_id);
-      }, 2000);
-      setReportPollingInterval(interval);
+      console.log('Report generation finished:', response);
 
-      pollReportStatus(response.report_id);
+      reportId = response.report_id;
+      refreshReport(response.report_id);
     } catch (error) {
       console.error('Error generating report:', error);
       alert('An error occurred while generating the report. Please try again.');
+      reportSubscription.current?.();
+      reportSubscription.current = null;
       setIsGenerating(false);
     }
   };
@@ -156,7 +186,7 @@ export default function ReportBuilderPage() {
         </div>
 
         {showForm && !blueprint ? (
-          <FormWizard onBlueprintGenerated={handleBlueprintGenerated} />
+          <FormWizard userId={user.id} onBlueprintGenerated={handleBlueprintGenerated} />
         ) : (
           <div className="flex flex-col gap-6">
             {/* Summaries Row with Equal Heights */}
@@ -246,7 +276,7 @@ export default function ReportBuilderPage() {
                     {isGenerating ? (
                       <>
                         <div className="animate-spin rounded-full h-4 w-4 border-b-2 border-white mr-2" />
-                        Generating...
+                        Generating...{generationProgress > 0 && ` ${Math.round(generationProgress * 100)}%`}
                       </>
                     ) : currentReport ? (
                       <>
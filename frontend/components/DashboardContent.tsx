@@ -47,6 +47,13 @@ export function DashboardContent() {
     };
 
     fetchStats();
+    if (!user) return;
+
+    // Refresh the counts when a report changes status rather than polling
+    return api.subscribeToReportEvents(user.id, {
+      onStatus: () => fetchStats(),
+      onResync: fetchStats,
+    });
   }, [user]);
 
   return (
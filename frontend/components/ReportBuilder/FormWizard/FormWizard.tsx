@@ -14,10 +14,11 @@ import { Blueprint } from '@/types/blueprint.types';
 import api from '@/lib/api';
 
 interface FormWizardProps {
+  userId: number;
   onBlueprintGenerated: (blueprint: Blueprint, formSelections: any) => void;
 }
 
-export default function FormWizard({ onBlueprintGenerated }: FormWizardProps) {
+export default function FormWizard({ userId, onBlueprintGenerated }: FormWizardProps) {
   const [currentStep, setCurrentStep] = useState(1);
   const [isLoading, setIsLoading] = useState(false);
   const [error, setError] = useState<string | null>(null);
@@ -143,6 +144,7 @@ export default function FormWizard({ onBlueprintGenerated }: FormWizardProps) {
         analysisSubject: formData.analysisSubject,
         selectedDataPoints: selectedLabels,
         additionalNotes: formData.additionalNotes,
+        user_id: userId,
       });
 
       if (!data.success) {
@@ -57,6 +57,23 @@ export interface Report {
   error_message?: string;
 }
 
+export interface ReportStatusEvent {
+  type: 'report.status';
+  report_id: number;
+  user_id: number;
+  batch_id: number | null;
+  title: string;
+  status: string;
+  progress: number;
+  error_message: string | null;
+  timestamp: string;
+}
+
+// Sent while a report is generated; completion arrives as a report.status event
+export interface ReportProgressEvent extends Omit<ReportStatusEvent, 'type'> {
+  type: 'report.progress';
+}
+
 export interface ReportCreate {
   user_id: number;
   title: string;
@@ -94,6 +111,28 @@ export const api = {
     return response.data;
   },
 
+  // Report status push channel (Server-Sent Events). Returns a function that closes it.
+  subscribeToReportEvents: (
+    userId: number,
+    handlers: {
+      onStatus: (event: ReportStatusEvent) => void;
+      onProgress?: (event: ReportProgressEvent) => void;
+      onResync?: () => void;
+    }
+  ): (() => void) => {
+    const source = new EventSource(`${API_URL}/api/events/${userId}`);
+    // The snapshot is re-sent after every automatic reconnect, so treat it as a resync
+    source.addEventListener('snapshot', () => handlers.onResync?.());
+    source.addEventListener('report.status', (e) => {
+      handlers.onStatus(JSON.parse((e as MessageEvent).data));
+    });
+    source.addEventListener('report.progress', (e) => {
+      handlers.onProgress?.(JSON.parse((e as MessageEvent).data));
+    });
+    source.addEventListener('resync', () => handlers.onResync?.());
+    return () => source.close();
+  },
+
   // Report management endpoints
   createReport: async (reportData: ReportCreate): Promise<Report> => {
     const response = await apiClient.post<Report>('/api/reports', reportData);
@@ -125,6 +164,7 @@ export const api = {
     analysisSubject: string;
     selectedDataPoints: string[];
     additionalNotes?: string;
+    user_id?: number;
   }): Promise<{
     blueprint: any;
     success: boolean;
@@ -139,12 +179,16 @@ export const api = {
     user_id: number;
     blueprint: any;
     form_selections: any;
-  }): Promise<{
+    base_report_id?: number;
+  }, idempotencyKey?: string): Promise<{
     report_id: number;
     status: string;
     message: string;
   }> => {
-    const response = await apiClient.post('/api/reports/generate', request);
+    // Requests sent again with the same key get the first one's result instead of a new report
+    const response = await apiClient.post('/api/reports/generate', request, {
+      headers: idempotencyKey ? { 'Idempotency-Key': idempotencyKey } : undefined,
+    });
     return response.data;
   },
 };
@@ -62,6 +62,7 @@ export interface BlueprintGenerationRequest {
   analysisSubject: string;
   selectedDataPoints: string[];
   additionalNotes: string;
+  user_id?: number;
 }
 
 export interface BlueprintGenerationResponse {